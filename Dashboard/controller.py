@@ -1,6 +1,5 @@
-from datetime import datetime
-import pandas as pd
 from .utils import fetch_notion_data
+from .page_catalog import load_page_catalog
 
 
 class DataManager:
@@ -11,23 +10,12 @@ class DataManager:
         data = fetch_notion_data(notion_client, database_id)
         return data
 
+    def get_catalog(self, data):
+        return load_page_catalog(data)
+
     def get_data_in_scope(self, data, source_title):
-        data_in_scope = []
-        for item in data:
-            if item["properties"]["Title"]["title"][0]["text"]["content"] == source_title:
-                data_in_scope.append(item)
-        return data_in_scope
+        return [record.page for record in self.get_catalog(data).by_title(source_title)]
 
     def filter_data_by_datae_range(self, data, start_date, end_date, source_title):
-        filtered_data = []
-        for item in data:
-            try:
-                if (item['properties']['Type']['select']['name'] != 'Source') and (
-                        start_date <= datetime.strptime(item['properties']['Date']['date']['start'],
-                                                        '%Y-%m-%d').date() <= end_date) and (
-                        item["properties"]["Title"]["title"][0]["text"]["content"] == source_title
-                ):
-                    filtered_data.append(item)
-            except Exception as e:
-                print(e)
-        return filtered_data
+        records = self.get_catalog(data).by_date_range(source_title, start_date, end_date, exclude_type='Source')
+        return [record.page for record in records]
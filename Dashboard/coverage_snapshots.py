@@ -0,0 +1,229 @@
+import argparse
+import os
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+import streamlit as st
+from dotenv import load_dotenv
+from .controller import DataManager
+from .ledger import get_ledger
+from .report import slugify, get_source_files, seconds_until_next_run
+from .utils import process_filtered_data, read_file_by_key, get_page_url_refresher
+
+COVERAGE_SNAPSHOTS_DIR = os.getenv('COVERAGE_SNAPSHOTS_DIR', "coverage_snapshots")
+OVERALL_MEMBER = "Overall"
+TREND_COLUMNS = ["Date", "Team Member", "Reviewed Transactions", "Coverage (%)"]
+
+
+class CoverageState:
+    """ Cumulative reviewed coverage of a source as of a day: one bit per distinct source description, for every
+    member and overall, plus the submission files already applied. The next day is computed from it and that
+    day's submissions only.
+    """
+
+    def __init__(self, source_key, last_date=None, covered=None, applied_files=None):
+        self.source_key = source_key
+        self.last_date = last_date
+        self.covered = covered or {}
+        self.applied_files = applied_files or set()
+
+    # Function to mark the source descriptions of a reviewed file as covered by its member and overall
+    def apply(self, member_name, positions, descriptions_count):
+        for name in (member_name, OVERALL_MEMBER):
+            covered = self.covered.setdefault(name, np.zeros(descriptions_count, dtype=bool))
+            covered[positions] = True
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        members = sorted(self.covered)
+        temp_path = f"{path}.tmp.npz"
+        np.savez_compressed(temp_path, source_key=self.source_key, last_date=self.last_date.isoformat(),
+                            members=np.array(members, dtype=str),
+                            covered=np.array([np.packbits(self.covered[name]) for name in members], dtype=np.uint8),
+                            descriptions_count=len(next(iter(self.covered.values()), [])),
+                            applied_files=np.array(sorted(self.applied_files), dtype=str))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            descriptions_count = int(saved["descriptions_count"])
+            covered = {str(name): np.unpackbits(bits, count=descriptions_count).astype(bool)
+                       for name, bits in zip(saved["members"], saved["covered"])}
+            return cls(str(saved["source_key"]), last_date=date.fromisoformat(str(saved["last_date"])),
+                       covered=covered, applied_files={str(file_id) for file_id in saved["applied_files"]})
+
+
+# Function to get the directory holding the coverage state and trend of a source
+def get_snapshot_dir(source_title, snapshots_dir=COVERAGE_SNAPSHOTS_DIR):
+    return os.path.join(snapshots_dir, slugify(source_title))
+
+
+# Function to identify a submission file across runs (signed file URLs rotate) by its page and file name
+def get_submission_file_id(page_id, file_name):
+    return f"{page_id}|{file_name}"
+
+
+# Function to get the distinct source descriptions (in first-appearance order) and their number of rows
+def get_source_descriptions(source_df):
+    description_counts = source_df["description"].value_counts(sort=False)
+    return description_counts.index, description_counts.to_numpy(dtype=np.int64)
+
+
+def update_coverage_snapshot(data, source_file, until=None, notion_client=None, ledger=None,
+                             snapshots_dir=COVERAGE_SNAPSHOTS_DIR):
+    """ Record the cumulative reviewed coverage of a source for every day since its last snapshot, reading only the
+    submissions that weren't applied yet. Submissions dated before the last snapshot are applied on the first new day
+    (or on the last day again, which is recomputed).
+    :param data: list of Notion pages
+    :param source_file: (source_title, source_file_url, source_filename)
+    :param until: last day to snapshot, today if None
+    :param notion_client: Notion client used to re-sign expired file URLs, if given
+    :return: path of the trend file, or None if the source has no reviewed submissions yet
+    """
+    source_title, source_file_url, source_filename = source_file
+    until = until or datetime.now().date()
+    ledger = ledger or get_ledger()
+    records = DataManager().get_catalog(data).by_title(source_title)
+    source_record = next(record for record in records if record.type == 'Source')
+    # The page edit time is part of the key, so a replaced source file starts a new history
+    source_key = str((source_title, source_filename, source_record.last_edited_time))
+
+    snapshot_dir = get_snapshot_dir(source_title, snapshots_dir)
+    state_path, trend_path = os.path.join(snapshot_dir, "state.npz"), os.path.join(snapshot_dir, "trend.parquet")
+    state = CoverageState.load(state_path) if os.path.exists(state_path) else None
+    if state is None or state.source_key != source_key:
+        state = CoverageState(source_key)
+    if state.last_date is not None and os.path.exists(trend_path):
+        trend_df = pd.read_parquet(trend_path)
+    else:
+        trend_df = pd.DataFrame(columns=TREND_COLUMNS)
+
+    new_records = [record for record in records
+                   if record.type == 'Submission' and record.data_type == 'Reviewed Transactions'
+                   and record.date is not None and record.date <= until
+                   and get_submission_file_id(record.page_id, record.file_name) not in state.applied_files]
+    if state.last_date is None and not new_records:
+        return None
+    if state.last_date is not None and state.last_date >= until and not new_records:
+        return trend_path
+    if state.last_date is None:
+        first_day = min(record.date for record in new_records)
+    else:
+        first_day = min(state.last_date + timedelta(days=1), until)
+
+    _, dfs_reviewed_transactions, _ = process_filtered_data([record.page for record in new_records], ledger,
+                                                            notion_client)
+    source_df = read_file_by_key(source_file_url, f"{source_title}_{source_filename}",
+                                 refresh_url=get_page_url_refresher(notion_client, source_record.page_id),
+                                 tags={f"source:{source_title}", "data_type:Source",
+                                       f"file:{source_title}_{source_filename}"})
+    source_descriptions, description_counts = get_source_descriptions(source_df)
+    total_transactions_count = len(source_df)
+
+    files_by_day = {}
+    for member_name, member_filename, submission_date, member_df in dfs_reviewed_transactions:
+        day = max(datetime.strptime(str(submission_date)[:10], "%Y-%m-%d").date(), first_day)
+        files_by_day.setdefault(day, []).append((member_name, member_filename, submission_date, member_df))
+
+    # Marking descriptions as covered is idempotent, so a recomputed day only needs its trend rows replaced
+    trend_rows = []
+    day = first_day
+    while day <= until:
+        for member_name, member_filename, submission_date, member_df in files_by_day.get(day, []):
+            positions = source_descriptions.get_indexer(member_df["description"].dropna().unique())
+            state.apply(member_name, positions[positions >= 0], len(source_descriptions))
+            state.applied_files.add(get_submission_file_id(member_df.attrs.get("page_id"), member_filename))
+        for member_name, covered in state.covered.items():
+            reviewed_transactions_count = int(description_counts[covered].sum())
+            trend_rows.append((pd.Timestamp(day), member_name, reviewed_transactions_count,
+                               reviewed_transactions_count / total_transactions_count * 100))
+        day += timedelta(days=1)
+    state.last_date = until
+
+    previous_trend_df = trend_df[pd.to_datetime(trend_df["Date"]) < pd.Timestamp(first_day)]
+    trend_df = pd.concat([df for df in (previous_trend_df, pd.DataFrame(trend_rows, columns=TREND_COLUMNS)) if len(df)],
+                         ignore_index=True)
+    trend_df = trend_df.astype({"Date": "datetime64[ns]", "Team Member": "category",
+                                "Reviewed Transactions": "int64", "Coverage (%)": "float32"})
+    os.makedirs(snapshot_dir, exist_ok=True)
+    trend_df.to_parquet(trend_path + ".tmp", index=False)
+    os.replace(trend_path + ".tmp", trend_path)
+    # The state is written after the trend, so a failed run is redone from the previous state
+    state.save(state_path)
+    return trend_path
+
+
+def update_coverage_snapshots(notion_client, database_id, until=None, source_titles=None,
+                              snapshots_dir=COVERAGE_SNAPSHOTS_DIR):
+    """ Record the daily coverage snapshots of every source
+    :param notion_client: Notion client
+    :param database_id: id of the "Data Hub Progress" Notion database
+    :param until: last day to snapshot, today if None
+    :param source_titles: source titles to snapshot, all sources if None
+    :return: list of written trend paths
+    """
+    data = DataManager().get_notion_data(notion_client, database_id)
+    ledger = get_ledger()
+    trend_paths = []
+    for source_file in get_source_files(data):
+        if source_titles and source_file[0] not in source_titles:
+            continue
+        print(f"[update_coverage_snapshots] {source_file[0]}")
+        try:
+            trend_path = update_coverage_snapshot(data, source_file, until=until, notion_client=notion_client,
+                                                  ledger=ledger, snapshots_dir=snapshots_dir)
+            if trend_path:
+                trend_paths.append(trend_path)
+        except Exception as e:
+            print(f"[update_coverage_snapshots] Error snapshotting {source_file[0]}: {e}")
+    return trend_paths
+
+
+# Function to record the coverage snapshots every night
+def run_coverage_snapshots_nightly(notion_client, database_id, snapshots_dir=COVERAGE_SNAPSHOTS_DIR):
+    while True:
+        time.sleep(seconds_until_next_run())
+        try:
+            update_coverage_snapshots(notion_client, database_id, snapshots_dir=snapshots_dir)
+        except Exception as e:
+            print(f"[run_coverage_snapshots_nightly] Error: {e}")
+
+
+# Function to load the coverage trend of a source, or None if it was never snapshotted
+def load_coverage_trend(source_title, snapshots_dir=COVERAGE_SNAPSHOTS_DIR):
+    trend_path = os.path.join(get_snapshot_dir(source_title, snapshots_dir), "trend.parquet")
+    if not os.path.exists(trend_path):
+        return None
+    return _load_coverage_trend(trend_path, os.path.getmtime(trend_path))
+
+
+# The file modification time is part of the cache key, so a new snapshot is picked up
+@st.cache_data(show_spinner=False)
+def _load_coverage_trend(trend_path, modified_time):
+    return pd.read_parquet(trend_path)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Record the daily cumulative coverage snapshots of the sources")
+    parser.add_argument("--source", action="append", help="Source title to snapshot (repeatable), all if omitted")
+    parser.add_argument("--until", type=date.fromisoformat, help="Last day to snapshot (YYYY-MM-DD), today if omitted")
+    parser.add_argument("--snapshots-dir", default=COVERAGE_SNAPSHOTS_DIR)
+    parser.add_argument("--nightly", action="store_true", help="Keep running and snapshot nightly")
+    args = parser.parse_args()
+
+    from notion_client import Client
+    notion_client = Client(auth=os.getenv("NOTION_TOKEN"))
+    database_id = os.getenv("DATABASE_ID")
+
+    for trend_path in update_coverage_snapshots(notion_client, database_id, until=args.until,
+                                                source_titles=args.source, snapshots_dir=args.snapshots_dir):
+        print(trend_path)
+    if args.nightly:
+        run_coverage_snapshots_nightly(notion_client, database_id, snapshots_dir=args.snapshots_dir)
+
+
+if __name__ == "__main__":
+    main()
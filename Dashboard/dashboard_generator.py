@@ -1,5 +1,7 @@
 from datetime import datetime
 from .dashboard_visualization import DashboardVisualization
+from .report import generate_reports, REPORTS_DIR
+from .controller import DataManager
 import streamlit as st
 
 
@@ -7,9 +9,18 @@ class DashboardGenerator:
     def __init__(self):
         self.visualizer = DashboardVisualization()
 
-    def generate_full_dashboard(self):
-        # TODO:
-        pass
+    def generate_full_dashboard(self, notion_client, database_id, source_titles=None, date_ranges=None,
+                                output_dir=REPORTS_DIR):
+        """ Generate the full team-progress report headlessly (JSON/Parquet data and static Plotly HTML)
+        :param notion_client: Notion client
+        :param database_id: id of the "Data Hub Progress" Notion database
+        :param source_titles: source titles to report on, all sources if None
+        :param date_ranges: list of (start_date, end_date), the default dashboard range if None
+        :param output_dir: directory the reports are written to
+        :return: list of written summary paths
+        """
+        return generate_reports(notion_client, database_id, source_titles=source_titles, date_ranges=date_ranges,
+                                output_dir=output_dir)
 
     def init_sidebar(self, data):
         # Streamlit sidebar input for database ID
@@ -20,10 +31,7 @@ class DashboardGenerator:
                                            [datetime.now().replace(month=1, day=1).date(), datetime.now().date()])
 
         # Extract source files for dropdown selection
-        source_files = [(item['properties']['Title']['title'][0]['text']['content'],
-                         item['properties']['Files & media']['files'][0]['file']['url'],
-                         item['properties']['Files & media']['files'][0]['name'])
-                        for item in data if item['properties']['Type']['select']['name'] == 'Source']
+        source_files = DataManager().get_catalog(data).source_files
 
         # Sidebar source file selection
         source_file_selection = st.sidebar.selectbox("Select Source File", source_files, format_func=lambda x: x[0])
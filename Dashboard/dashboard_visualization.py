@@ -1,6 +1,39 @@
+import hashlib
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+from .tagged_cache import get_tagged_cache
+
+# Traces with more points than this are drawn with WebGL (Scattergl) instead of SVG
+SCATTERGL_POINTS_THRESHOLD = 1000
+# Largest date ranges (in days) plotted per day and per week, longer ranges are plotted per month
+DAILY_BUCKETS_MAX_DAYS = 92
+WEEKLY_BUCKETS_MAX_DAYS = 2 * 365
+
+
+# Function to pick the time bucket of a date range: daily, weekly or monthly
+def get_time_bucket(dates):
+    dates = pd.to_datetime(dates)
+    span_days = (dates.max() - dates.min()).days if len(dates) else 0
+    if span_days <= DAILY_BUCKETS_MAX_DAYS:
+        return "D", "daily"
+    if span_days <= WEEKLY_BUCKETS_MAX_DAYS:
+        return "W-MON", "weekly"
+    return "MS", "monthly"
+
+
+# Function to sum the per-file counts of a member into date buckets, with the number of files of every bucket
+def bucket_by_date(df, freq, value_columns):
+    df = df.assign(Date=pd.to_datetime(df['Date']))
+    df_buckets = df.groupby(pd.Grouper(key='Date', freq=freq, label='left', closed='left')).agg(
+        **{column: (column, 'sum') for column in value_columns}, Files=('Date', 'size'))
+    return df_buckets[df_buckets['Files'] > 0].reset_index()
+
+
+# Function to get the scatter trace class for a number of points
+def get_scatter_trace_type(points):
+    return go.Scattergl if points > SCATTERGL_POINTS_THRESHOLD else go.Scatter
 
 
 class DashboardVisualization:
@@ -55,37 +88,61 @@ class DashboardVisualization:
 
         return fig
 
+    # Function to build a figure once per distinct input data, caching its JSON in the process-wide tagged cache
+    def _get_cached_figure(self, name, df, build, *args):
+        data_hash = hashlib.sha256(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        data_hash.update(repr((list(df.columns), args)).encode())
+        key = ("figure", name, data_hash.hexdigest())
+        cache = get_tagged_cache()
+        fig_json = cache.get(key)
+        if fig_json is None:
+            fig_json = build(df, *args).to_json()
+            cache.set(key, fig_json, tags={"figure", f"figure:{name}"})
+        return pio.from_json(fig_json)
+
     def plot_reviewed_txns_scatter_plot(self, filtered_df_ngrams, selected_member):
+        return self._get_cached_figure("reviewed_txns_scatter_plot", filtered_df_ngrams,
+                                       self._build_reviewed_txns_scatter_plot, selected_member)
+
+    def _build_reviewed_txns_scatter_plot(self, filtered_df_ngrams, selected_member):
+        # Aggregate the files into day/week/month buckets, depending on the date range
+        bucket_freq, bucket_label = get_time_bucket(filtered_df_ngrams['Date'])
+        df_buckets = bucket_by_date(filtered_df_ngrams, bucket_freq,
+                                    ['valid_ngrams_transactions', 'invalid_ngrams_transactions'])
+        # The per-file coverages are ratios of the file's rows, so a bucket's coverage is derived from its summed counts
+        bucket_rows = df_buckets['valid_ngrams_transactions'] + df_buckets['invalid_ngrams_transactions']
+        df_buckets['valid_ngrams_transactions_coverage'] = df_buckets['valid_ngrams_transactions'] / bucket_rows
+        df_buckets['invalid_ngrams_transactions_coverage'] = df_buckets['invalid_ngrams_transactions'] / bucket_rows
+        scatter = get_scatter_trace_type(len(df_buckets))
+
         # Plot for ngrams transactions
         fig_ngrams = go.Figure()
 
         # Add scatter plot for valid transactions with hover text
-        fig_ngrams.add_scatter(x=filtered_df_ngrams['Date'],
-                               y=filtered_df_ngrams['valid_ngrams_transactions'],
-                               mode='markers+lines',
-                               name='Valid Transactions',
-                               hovertemplate=
-                               # '\n<b>Date</b>: %{x}<br>' +
-                               '<b>Valid Transactions</b>: %{y}<br>' +
-                               '<b>Valid Coverage</b>: %{text}',
-                               text=[f'{coverage:.2%}' for coverage in
-                                     filtered_df_ngrams['valid_ngrams_transactions_coverage']])
+        fig_ngrams.add_trace(scatter(x=df_buckets['Date'],
+                                     y=df_buckets['valid_ngrams_transactions'],
+                                     mode='markers+lines',
+                                     name='Valid Transactions',
+                                     customdata=df_buckets[['valid_ngrams_transactions_coverage', 'Files']],
+                                     hovertemplate=
+                                     '<b>Valid Transactions</b>: %{y}<br>' +
+                                     '<b>Valid Coverage</b>: %{customdata[0]:.2%}<br>' +
+                                     '<b>Files</b>: %{customdata[1]}'))
 
         # Add scatter plot for invalid transactions with hover text
-        fig_ngrams.add_scatter(x=filtered_df_ngrams['Date'],
-                               y=filtered_df_ngrams['invalid_ngrams_transactions'],
-                               mode='markers+lines',
-                               name='Invalid Transactions',
-                               hovertemplate=
-                               # '\n<b>Date</b>: %{x}<br>' +
-                               '<b>Invalid Transactions</b>: %{y}<br>' +
-                               '<b>Invalid Coverage</b>: %{text}',
-                               text=[f'{coverage:.2%}' for coverage in
-                                     filtered_df_ngrams['invalid_ngrams_transactions_coverage']])
+        fig_ngrams.add_trace(scatter(x=df_buckets['Date'],
+                                     y=df_buckets['invalid_ngrams_transactions'],
+                                     mode='markers+lines',
+                                     name='Invalid Transactions',
+                                     customdata=df_buckets[['invalid_ngrams_transactions_coverage', 'Files']],
+                                     hovertemplate=
+                                     '<b>Invalid Transactions</b>: %{y}<br>' +
+                                     '<b>Invalid Coverage</b>: %{customdata[0]:.2%}<br>' +
+                                     '<b>Files</b>: %{customdata[1]}'))
 
         # Customize layout for ngrams
         fig_ngrams.update_layout(
-            title=f"Progress of {selected_member} - Ngrams Transactions Over Time",
+            title=f"Progress of {selected_member} - Ngrams Transactions Over Time ({bucket_label})",
             xaxis_title="Date",
             yaxis_title="Number of Transactions",
             legend_title="Transaction Type",
@@ -95,37 +152,43 @@ class DashboardVisualization:
         return fig_ngrams
 
     def plot_merchants_scatter_plot(self, filtered_df_merchants, selected_member):
+        return self._get_cached_figure("merchants_scatter_plot", filtered_df_merchants,
+                                       self._build_merchants_scatter_plot, selected_member)
+
+    def _build_merchants_scatter_plot(self, filtered_df_merchants, selected_member):
+        bucket_freq, bucket_label = get_time_bucket(filtered_df_merchants['Date'])
+        df_buckets = bucket_by_date(filtered_df_merchants, bucket_freq,
+                                    ['number_of_merchants', 'number_of_new_merchants'])
+        scatter = get_scatter_trace_type(len(df_buckets))
+
         # Plot for merchants
         fig_merchants = go.Figure()
 
-        filtered_df_merchants = filtered_df_merchants.sort_values("Date", ascending=True)
-        fig_merchants.add_trace(go.Scatter(
-            x=filtered_df_merchants['Date'],
-            y=filtered_df_merchants['number_of_merchants'],
+        fig_merchants.add_trace(scatter(
+            x=df_buckets['Date'],
+            y=df_buckets['number_of_merchants'],
             mode='lines+markers',
             name='Number of Merchants',
-            text=filtered_df_merchants['File'],
+            customdata=df_buckets[['Files']],
             hovertemplate=
-            # '\n<b>Date</b>: %{x}<br>' +
-            '<b>Number of Merchants</b>: %{y}<br>',
-            hoverinfo='text+y'
+            '<b>Number of Merchants</b>: %{y}<br>' +
+            '<b>Files</b>: %{customdata[0]}'
         ))
 
-        fig_merchants.add_trace(go.Scatter(
-            x=filtered_df_merchants['Date'],
-            y=filtered_df_merchants['number_of_new_merchants'],
+        fig_merchants.add_trace(scatter(
+            x=df_buckets['Date'],
+            y=df_buckets['number_of_new_merchants'],
             mode='lines+markers',
             name='Number of New Merchants',
-            text=filtered_df_merchants['File'],
+            customdata=df_buckets[['Files']],
             hovertemplate=
-            # '\n<b>Date</b>: %{x}<br>' +
-            '<b>Number of New Merchants</b>: %{y}<br>',
-            hoverinfo='text+y'
+            '<b>Number of New Merchants</b>: %{y}<br>' +
+            '<b>Files</b>: %{customdata[0]}'
         ))
 
         # Customize layout for merchants
         fig_merchants.update_layout(
-            title=f"Progress of {selected_member} - Merchants Over Time",
+            title=f"Progress of {selected_member} - Merchants Over Time ({bucket_label})",
             xaxis_title="Date",
             yaxis_title="Number of Merchants",
             legend_title="Merchants Type",
@@ -133,3 +196,46 @@ class DashboardVisualization:
         )
 
         return fig_merchants
+
+    def plot_sources_coverage_bar_chart(self, overview_df):
+        """ Plot the overall coverage of every source
+        :param overview_df: dataframe with one row per source
+        :return: fig
+        """
+        fig = px.bar(
+            overview_df,
+            x='Source',
+            y='Coverage (%)',
+            hover_data=['Reviewed Transactions', 'Total Transactions', 'Team Members'],
+            title='Coverage by Source'
+        )
+        fig.update_layout(yaxis_range=[0, 100], xaxis_title="Source", yaxis_title="Coverage (%)")
+        return fig
+
+    def plot_coverage_trend(self, trend_df, source_title):
+        """ Plot the daily cumulative reviewed coverage of a source, overall and per member
+        :param trend_df: dataframe with one row per day and member (see coverage_snapshots)
+        :return: fig
+        """
+        return self._get_cached_figure("coverage_trend", trend_df, self._build_coverage_trend, source_title)
+
+    def _build_coverage_trend(self, trend_df, source_title):
+        fig = go.Figure()
+        for member_name, member_df in trend_df.groupby("Team Member", observed=True, sort=True):
+            scatter = get_scatter_trace_type(len(member_df))
+            fig.add_trace(scatter(
+                x=member_df['Date'],
+                y=member_df['Coverage (%)'],
+                mode='lines',
+                name=str(member_name),
+                customdata=member_df[['Reviewed Transactions']],
+                hovertemplate='%{y:.2f}% (%{customdata[0]} transactions)'
+            ))
+        fig.update_layout(
+            title=f"Cumulative Reviewed Coverage of {source_title}",
+            xaxis_title="Date",
+            yaxis_title="Coverage (%)",
+            legend_title="Team Member",
+            hovermode="x unified"
+        )
+        return fig
@@ -1,27 +1,35 @@
 from datetime import datetime, timedelta
 import os
 import time
-import pandas as pd 
 from .categories import genify_category_list
 from .countries import genify_country_list
-import requests
-import io
+from .notion_writer import get_notion_write_queue, NOTION_FLUSH_TIMEOUT
+from .notion_io import query_database
+from .file_reader import read_file, get_file_url_refresher
+from .source_membership import get_source_membership_filter
+from .merchant_index import get_merchant_index, verify_merchant_references
+from .merchant_similarity import get_merchant_similarity_index, find_near_duplicate_merchants
+from .utils import invalidate_cache_tags
 
 
 class FileValidator:
     def __init__(self, notion_client, database_id):
         self.notion_client = notion_client
+        self.notion_writer = get_notion_write_queue(notion_client)
         self.database_id = database_id
         self.categories_list = genify_category_list
         self.new_merchants_columns = ['name', 'id', 'category', 'subcategory', 'website', 'logo_url', 'country', 'validation_date', 'status', 'comment']
         self.trx_review_columns = ['description','extracted_merchant_for_review','merchant_id']
         self.country_list = genify_country_list
         self.allowed_exts = ['.png','.jpg','.jpeg']
+        # Reviewed files with more descriptions missing from their source than this fraction are flagged
+        self.max_unmatched_descriptions = float(os.getenv('MAX_UNMATCHED_DESCRIPTIONS', 0.05))
 
     # Function to get the latest entries
     def get_latest_entries(self, database_id, last_checked):
         print("[get_latest_entries] init...")
-        results = self.notion_client.databases.query(
+        results = query_database(
+            self.notion_client,
             **{
                 "database_id": database_id,
                 "filter": {
@@ -42,8 +50,8 @@ class FileValidator:
                 }
             }
         )
-        print("[get_latest_entries] ", results['results'])
-        return results['results']
+        print("[get_latest_entries] ", results)
+        return results
     # def get_latest_entries(self, database_id, last_checked):
     #     print("[get_latest_entries] init...")
     #     results = self.notion_client.databases.query(
@@ -61,7 +69,7 @@ class FileValidator:
     #     return results['results']
 
     def update_submission_validation(self, page_id, flag):
-        self.notion_client.pages.update(
+        self.notion_writer.update_page(
             page_id=page_id,
             properties={
                 "Submission Validation": {
@@ -79,7 +87,7 @@ class FileValidator:
             comments_labels_to_add.append(
                 {"name": comment}
             )
-        self.notion_client.pages.update(
+        self.notion_writer.update_page(
             page_id=page_id,
             properties={
                 "Validation Comment": {
@@ -103,56 +111,81 @@ class FileValidator:
             try:
                 new_entries = self.get_latest_entries(self.database_id, last_checked)
                 for entry in new_entries:
-                    validation_comments_list = []
-                    if entry['properties']['Type']['select']['name'] == 'Submission':
-                        file_url = entry['properties']['Files & media']['files'][0]['file']['url']
-                        page_id = entry['id']
-                        print("[PAGE_ID] ", page_id)
-                        print("[FILE_URL] ", file_url)
-
-                        ## TODO: 
-                        ## 1. read the csv/excel file
-                        df = self.read_csv_from_url(url=file_url)
-                        print("[dataframe]")
-                        print(df)
-                        print()
-
-                        ## 2. run the validation on the file
-                        file_data_type = entry['properties']['Data Type']['select']['name']
-
-                        if file_data_type == "Reviewed Transactions":
-                            valid_column_names_txns = self.validate_columns_trx_review(df)
-                            if not valid_column_names_txns:
-                                validation_comments_list.append("Invalid Column Name")
-                        elif file_data_type == "Merchants":
-                            valid_column_names_merchants = self.validate_columns_new_merchants(df)
-                            if not valid_column_names_merchants:
-                                validation_comments_list.append("Invalid Column Name")
-
-                            valid_categories = self.validate_category(df)
-                            if not valid_categories:
-                                validation_comments_list.append("Invalid Category")
-
-                            valid_countries = self.validate_country(df)
-                            if not valid_countries:
-                                validation_comments_list.append("Invalid Country")
-
-                            # not important -- the url will be skipped while db population
-                            # valid_logo_urls = self.validate_logo_url(df)
-                            # if not valid_logo_urls:
-                            #     validation_comments_list.append("Invalid Logo URL")
-
-                        ## 3. assign validation comments based on the outcome of the validation
-                        ## and update the validation_comment column of the Notion Db for that entry
-                        if not len(validation_comments_list):
-                            validation_comments_list.append("OK")
-
-                        print("[poll_notion_database] update_validation_comment init...")
-                        if validation_comments_list[0] == "OK":
-                            self.update_submission_validation(page_id, flag="True")
-                        else:
-                            self.update_submission_validation(page_id, flag="False")
-                        self.update_validation_comment(page_id, validation_comments_list)
+                    # One file that can't be read or validated doesn't stop the rest of the entries
+                    try:
+                        validation_comments_list = []
+                        # Warnings are reported in the validation comments without failing the validation
+                        validation_warnings_list = []
+                        if entry['properties']['Type']['select']['name'] == 'Submission':
+                            file_url = entry['properties']['Files & media']['files'][0]['file']['url']
+                            page_id = entry['id']
+                            print("[PAGE_ID] ", page_id)
+                            print("[FILE_URL] ", file_url)
+                            # The file of a new or replaced submission must not be served from the caches
+                            invalidate_cache_tags(f"page:{page_id}")
+
+                            ## TODO: 
+                            ## 1. read the csv/excel file
+                            df = self.read_csv_from_url(url=file_url,
+                                                        refresh_url=get_file_url_refresher(self.notion_client, page_id))
+                            print("[dataframe]")
+                            print(df)
+                            print()
+
+                            ## 2. run the validation on the file
+                            file_data_type = entry['properties']['Data Type']['select']['name']
+
+                            if file_data_type == "Reviewed Transactions":
+                                valid_column_names_txns = self.validate_columns_trx_review(df)
+                                if not valid_column_names_txns:
+                                    validation_comments_list.append("Invalid Column Name")
+
+                                valid_descriptions = self.validate_descriptions_in_source(entry, df)
+                                if not valid_descriptions:
+                                    validation_comments_list.append("Descriptions Not In Source")
+
+                                valid_merchant_references = self.validate_merchant_references(df)
+                                if not valid_merchant_references:
+                                    validation_comments_list.append("Unknown Merchant Reference")
+                            elif file_data_type == "Merchants":
+                                valid_column_names_merchants = self.validate_columns_new_merchants(df)
+                                if not valid_column_names_merchants:
+                                    validation_comments_list.append("Invalid Column Name")
+
+                                valid_categories = self.validate_category(df)
+                                if not valid_categories:
+                                    validation_comments_list.append("Invalid Category")
+
+                                valid_countries = self.validate_country(df)
+                                if not valid_countries:
+                                    validation_comments_list.append("Invalid Country")
+
+                                valid_merchant_names = self.validate_near_duplicate_merchants(df)
+                                if not valid_merchant_names:
+                                    validation_warnings_list.append("Possible Duplicate Merchant")
+
+                                # not important -- the url will be skipped while db population
+                                # valid_logo_urls = self.validate_logo_url(df)
+                                # if not valid_logo_urls:
+                                #     validation_comments_list.append("Invalid Logo URL")
+
+                            ## 3. assign validation comments based on the outcome of the validation
+                            ## and update the validation_comment column of the Notion Db for that entry
+                            if not len(validation_comments_list):
+                                validation_comments_list.append("OK")
+
+                            print("[poll_notion_database] update_validation_comment init...")
+                            if validation_comments_list[0] == "OK":
+                                self.update_submission_validation(page_id, flag="True")
+                            else:
+                                self.update_submission_validation(page_id, flag="False")
+                            self.update_validation_comment(page_id, validation_comments_list + validation_warnings_list)
+                    except Exception as e:
+                        print(f"[poll_notion_database] Error validating entry {entry['id']}: {e}")
+                if new_entries:
+                    # Once the validation flags are written, the dashboard re-queries the pages
+                    self.notion_writer.flush(timeout=NOTION_FLUSH_TIMEOUT)
+                    invalidate_cache_tags(f"database:{self.database_id}")
                 last_checked = datetime.now()
                 # Save the last checked timestamp to file
                 with open("last_checked.txt", "w") as file:
@@ -162,15 +195,9 @@ class FileValidator:
             time.sleep(300)  # Wait for 5 minutes before checking again
             print("Re-check: init..................................................")
     
-    def read_csv_from_url(self, url):
-        response = requests.get(url)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        content = response.content
-        if ".csv" in url:
-            df = pd.read_csv(io.BytesIO(content))
-        else:
-            df = pd.read_excel(io.BytesIO(content))
-        return df
+    def read_csv_from_url(self, url, refresh_url=None):
+        # CSV and Excel files are sniffed and parsed once, then shared with the dashboard and the population
+        return read_file(url, refresh_url=refresh_url)
     
     def validate_logo_url(self, df):
     
@@ -248,6 +275,98 @@ class FileValidator:
 
         return is_valid 
     
+    # Function to get the Source page of a source title
+    def get_source_page(self, source_title):
+        results = query_database(
+            self.notion_client,
+            database_id=self.database_id,
+            filter={
+                "and": [
+                    {"property": "Title", "title": {"equals": source_title}},
+                    {"property": "Type", "select": {"equals": "Source"}}
+                ]
+            }
+        )
+        return results[0] if results else None
+
+    # Function to get the fraction of reviewed descriptions that are not in the source file of the entry
+    def get_unmatched_descriptions_fraction(self, entry, df):
+        source_title = entry['properties']['Title']['title'][0]['text']['content']
+        source_page = self.get_source_page(source_title)
+        if source_page is None:
+            print(f"[get_unmatched_descriptions_fraction] Source not found: {source_title}")
+            return None
+        source_file = source_page['properties']['Files & media']['files'][0]
+        # The page edit time is part of the key, so a replaced source file gets a new filter
+        source_key = (source_title, source_file['name'], source_page.get('last_edited_time'))
+        membership_filter = get_source_membership_filter(
+            source_key, lambda: self.read_csv_from_url(
+                url=source_file['file']['url'],
+                refresh_url=get_file_url_refresher(self.notion_client, source_page['id']))['description'])
+
+        matched = membership_filter.contains(df['description'])
+        if not len(matched):
+            return 0.0
+        return 1 - matched.mean()
+
+    def validate_descriptions_in_source(self, entry, df):
+
+        if 'description' not in df.columns:
+            return True
+
+        unmatched_fraction = self.get_unmatched_descriptions_fraction(entry, df)
+        if unmatched_fraction is None:
+            return True
+
+        print(f"[validate_descriptions_in_source] unmatched descriptions: {unmatched_fraction:.2%}")
+
+        # Validation result
+        is_valid = unmatched_fraction <= self.max_unmatched_descriptions
+
+        return is_valid
+
+    def validate_merchant_references(self, df):
+
+        if not all(column in df.columns for column in ['merchant_id', 'extracted_merchant_for_review']):
+            return True
+
+        # Resolve every distinct merchant id and name of the file at once
+        try:
+            references = verify_merchant_references(df, get_merchant_index())
+        except Exception as e:
+            print(f"[validate_merchant_references] Error verifying merchant references: {e}")
+            return True
+
+        print(f"[validate_merchant_references] checked rows: {references['checked_rows']} | "
+              f"unknown ids: {references['unknown_ids']} | unknown names: {references['unknown_names']} | "
+              f"pending new merchants: {references['pending_new_merchants']}")
+
+        # Validation result
+        is_valid = not references['unknown_ids'] and not references['unknown_names']
+
+        return is_valid
+
+    def validate_near_duplicate_merchants(self, df):
+
+        if 'name' not in df.columns:
+            return True
+
+        # Compare the names with each other and with the merchant table through the near-duplicate index
+        try:
+            near_duplicates = find_near_duplicate_merchants(df['name'], get_merchant_similarity_index())
+        except Exception as e:
+            print(f"[validate_near_duplicate_merchants] Error checking near-duplicate merchants: {e}")
+            return True
+
+        if len(near_duplicates):
+            print("[validate_near_duplicate_merchants] possible duplicates:")
+            print(near_duplicates)
+
+        # Validation result
+        is_valid = near_duplicates.empty
+
+        return is_valid
+
     def validate_new_merchants_file(self, df):
 
         v1 = self.validate_columns_new_merchants(df)
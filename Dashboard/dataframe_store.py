@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from .tagged_cache import get_tags_ttl
+
+DATAFRAME_STORE_BUDGET_MB = int(os.getenv('DATAFRAME_STORE_BUDGET_MB', 2048))
+
+
+# Function to get the in-memory size of a dataframe, including the python strings of object columns
+def get_dataframe_size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# Function to get a zero-copy view of a shared dataframe; new columns set on the view stay private to it, but
+# values must not be modified in place since they are shared with every other session
+def get_dataframe_view(df):
+    view = df.copy(deep=False)
+    view.attrs = dict(df.attrs)
+    return view
+
+
+class SharedDataFrameStore:
+    """ Process-wide store of the source and submission dataframes, shared by every Streamlit session.
+    Each file is downloaded and held once and sessions get zero-copy views of it, to be treated as read-only. The least
+    recently used dataframes are evicted once the store is over its memory budget. Like the tagged cache, dataframes
+    carry tags (source, page, data type) that expire them or invalidate them selectively.
+    """
+
+    def __init__(self, budget_bytes=DATAFRAME_STORE_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._frames = OrderedDict()
+        self._sizes = {}
+        self._tags = {}
+        self._expires_at = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @property
+    def size_bytes(self):
+        return sum(self._sizes.values())
+
+    def get(self, key):
+        """ Get a view of a stored dataframe
+        :return: pd.DataFrame, or None if the key isn't stored
+        """
+        with self._lock:
+            df = self._frames.get(key)
+            if df is not None and self._expires_at.get(key) is not None and self._expires_at[key] <= time.monotonic():
+                self._remove(key)
+                self.stats["expirations"] += 1
+                df = None
+            if df is None:
+                return None
+            self._frames.move_to_end(key)
+            self.stats["hits"] += 1
+            return get_dataframe_view(df)
+
+    def put(self, key, df, tags=()):
+        """ Store a dataframe (it must not be modified by the caller afterwards) and get a view of it """
+        size = get_dataframe_size(df)
+        ttl = get_tags_ttl(tags)
+        with self._lock:
+            self._frames[key] = df
+            self._frames.move_to_end(key)
+            self._sizes[key] = size
+            self._tags[key] = frozenset(tags)
+            self._expires_at[key] = time.monotonic() + ttl if ttl is not None else None
+            self._evict()
+        return get_dataframe_view(df)
+
+    def get_or_load(self, key, load, tags=()):
+        """ Get a view of a stored dataframe, loading it once when concurrent sessions ask for the same key
+        :param key: stable file key
+        :param load: function returning the dataframe
+        :param tags: tags of the dataframe, e.g. ("source:<title>", "data_type:Merchants")
+        """
+        df = self.get(key)
+        if df is not None:
+            return df
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            df = self.get(key)
+            if df is not None:
+                return df
+            self.stats["misses"] += 1
+            try:
+                return self.put(key, load(), tags=tags)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+    def _evict(self):
+        # The most recently stored dataframe is kept even when it's bigger than the whole budget
+        while len(self._frames) > 1 and sum(self._sizes.values()) > self.budget_bytes:
+            key = next(iter(self._frames))
+            size = self._sizes[key]
+            self._remove(key)
+            self.stats["evictions"] += 1
+            print(f"[SharedDataFrameStore] evicted {key} ({size / 1024 / 1024:.1f} MB)")
+
+    def _remove(self, key):
+        del self._frames[key]
+        del self._sizes[key]
+        self._tags.pop(key, None)
+        self._expires_at.pop(key, None)
+
+    def invalidate(self, *tags):
+        """ Drop every dataframe carrying any of the tags
+        :return: number of dataframes dropped
+        """
+        tags = set(tags)
+        with self._lock:
+            keys = [key for key, key_tags in self._tags.items() if key_tags & tags]
+            for key in keys:
+                self._remove(key)
+            self.stats["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._sizes.clear()
+            self._tags.clear()
+            self._expires_at.clear()
+
+
+_dataframe_store = None
+_dataframe_store_lock = threading.Lock()
+
+
+# Function to get the process-wide dataframe store
+def get_dataframe_store():
+    global _dataframe_store
+    with _dataframe_store_lock:
+        if _dataframe_store is None:
+            _dataframe_store = SharedDataFrameStore()
+        return _dataframe_store
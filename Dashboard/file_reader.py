@@ -0,0 +1,333 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+import httpx
+from .notion_io import http_get, http_get_many, retrieve_page
+
+try:
+    import python_calamine  # noqa: F401  (pandas' calamine Excel engine)
+    EXCEL_ENGINE = "calamine"
+except ImportError:  # Excel files are read with openpyxl unless python-calamine is installed
+    EXCEL_ENGINE = None
+
+FILE_ARTIFACTS_DIR = os.getenv('FILE_ARTIFACTS_DIR', "file_artifacts")
+# Artifacts unused for longer than this are removed, then the least recently used ones above the budget
+FILE_ARTIFACTS_BUDGET_MB = int(os.getenv('FILE_ARTIFACTS_BUDGET_MB', 4096))
+FILE_ARTIFACTS_MAX_AGE_DAYS = int(os.getenv('FILE_ARTIFACTS_MAX_AGE_DAYS', 30))
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK\x03\x04"
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+DOWNLOAD_RETRIES = 3
+BACKOFF_BASE_SECONDS = 1
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# S3 error codes of an expired or invalid pre-signed URL
+EXPIRED_URL_MARKERS = (b"ExpiredToken", b"Request has expired", b"SignatureDoesNotMatch", b"AccessDenied")
+
+# Download counters of the process, e.g. to spot a host that keeps timing out
+download_stats = {"downloads": 0, "retried": 0, "resigned": 0, "timeouts": 0, "failed": 0}
+_download_stats_lock = threading.Lock()
+
+
+# Function to detect the format of a file from its first bytes: "gzip", "xlsx", "xls" or "csv"
+def sniff_format(content):
+    if content[:2] == GZIP_MAGIC:
+        return "gzip"
+    if content[:4] == ZIP_MAGIC:
+        return "xlsx"
+    if content[:8] == OLE_MAGIC:
+        return "xls"
+    return "csv"
+
+
+# Function to parse a CSV with the pyarrow reader, keeping the pandas dtypes for the columns pyarrow would read
+# differently (dates stay strings, empty columns are NaN)
+def parse_csv(content):
+    read_options = pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE)
+    convert_options = pa_csv.ConvertOptions(strings_can_be_null=True)
+    try:
+        table = pa_csv.read_csv(io.BytesIO(content), read_options=read_options, convert_options=convert_options)
+        temporal_columns = [field.name for field in table.schema if pa.types.is_temporal(field.type)]
+        if temporal_columns:
+            convert_options.column_types = {column: pa.string() for column in temporal_columns}
+            table = pa_csv.read_csv(io.BytesIO(content), read_options=read_options, convert_options=convert_options)
+        for position, field in enumerate(table.schema):
+            if pa.types.is_null(field.type):
+                table = table.set_column(position, field.name, table.column(position).cast(pa.float64()))
+        return table
+    except pa.ArrowInvalid as e:
+        print(f"[parse_csv] pyarrow could not parse the file, falling back to pandas: {e}")
+        return dataframe_to_table(pd.read_csv(io.BytesIO(content)))
+
+
+# Function to convert a dataframe to an Arrow table; mixed-type object columns (e.g. numeric ids next to "n-" ids
+# in Excel files) get their values as strings, as the CSV reader gives them
+def dataframe_to_table(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].map(lambda value: value if pd.isna(value) else str(value))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def parse_file(content):
+    """ Parse a CSV, gzipped CSV or Excel file, with the format sniffed from its content
+    :param content: bytes of the file
+    :return: pyarrow.Table
+    """
+    file_format = sniff_format(content)
+    if file_format == "gzip":
+        return parse_csv(gzip.decompress(content))
+    if file_format in ("xlsx", "xls"):
+        return dataframe_to_table(pd.read_excel(io.BytesIO(content), engine=EXCEL_ENGINE))
+    return parse_csv(content)
+
+
+# Function to get the key of a Notion file: the path of its URL, which stays the same when the signature rotates
+def get_file_key(url):
+    parts = urlsplit(url)
+    return hashlib.sha256(f"{parts.netloc}{parts.path}".encode()).hexdigest()[:32]
+
+
+def get_artifact_path(url, artifacts_dir=FILE_ARTIFACTS_DIR):
+    return os.path.join(artifacts_dir, f"{get_file_key(url)}.arrow")
+
+
+# Function to get the dataframe of an Arrow table, with the file metadata in its attrs
+def table_to_dataframe(table):
+    df = table.to_pandas()
+    # Missing strings are NaN, as pandas' own readers give them
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].where(df[column].notna(), np.nan)
+    metadata = (table.schema.metadata or {}).get(b"file_metadata")
+    if metadata:
+        df.attrs["file_metadata"] = json.loads(metadata)
+    return df
+
+
+def write_artifact(path, table):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    # Uncompressed, so the artifact can be memory-mapped
+    feather.write_feather(table, temp_path, compression="uncompressed")
+    os.replace(temp_path, path)
+
+
+def evict_files(directory, extension, budget_bytes, max_age_seconds, keep=()):
+    """ Remove the files of a directory unused for longer than max_age_seconds, then the least recently used ones
+    while the directory is over its budget. The modification time of a file is its last use.
+    :param keep: paths never removed (e.g. the file just written)
+    :return: number of files removed
+    """
+    if not os.path.isdir(directory):
+        return 0
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(extension):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+    total_bytes = sum(size for _, size, _ in files)
+    now = time.time()
+    removed = 0
+    for modified_time, size, path in files:
+        if now - modified_time <= max_age_seconds and total_bytes <= budget_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+        removed += 1
+    return removed
+
+
+# Function to mark a cached file as used, so it is evicted last
+def touch_file(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+def _get_key_lock(url):
+    with _key_locks_lock:
+        return _key_locks.setdefault(get_file_key(url), threading.Lock())
+
+
+# Function to read the columnar artifact of a file, None if the file wasn't parsed yet
+def read_artifact(url, artifacts_dir=FILE_ARTIFACTS_DIR):
+    path = get_artifact_path(url, artifacts_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        df = table_to_dataframe(feather.read_table(path, memory_map=True))
+        touch_file(path)
+        return df
+    except Exception as e:
+        print(f"[read_artifact] Error reading {path}: {e}")
+        return None
+
+
+def read_content(url, content, artifacts_dir=FILE_ARTIFACTS_DIR):
+    """ Parse downloaded file content and store it as a columnar artifact for the next readers
+    :param url: file URL (identifies the artifact)
+    :param content: bytes of the file
+    :return: pd.DataFrame with the file metadata in df.attrs["file_metadata"]
+    """
+    started = time.perf_counter()
+    table = parse_file(content)
+    file_metadata = {
+        "size_bytes": len(content),
+        "parse_seconds": round(time.perf_counter() - started, 3),
+        "content_hash": hashlib.sha256(content).hexdigest(),
+    }
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           b"file_metadata": json.dumps(file_metadata).encode()})
+    path = get_artifact_path(url, artifacts_dir)
+    try:
+        write_artifact(path, table)
+        # Re-signed and replaced files get new artifacts, so the unused ones are removed as new ones are written
+        removed = evict_files(artifacts_dir, ".arrow", FILE_ARTIFACTS_BUDGET_MB * 1024 * 1024,
+                              FILE_ARTIFACTS_MAX_AGE_DAYS * 24 * 60 * 60, keep={path})
+        if removed:
+            print(f"[read_content] evicted {removed} file artifacts")
+    except OSError as e:
+        print(f"[read_content] Error writing the artifact of {url}: {e}")
+    return table_to_dataframe(table)
+
+
+def _count(stat):
+    with _download_stats_lock:
+        download_stats[stat] += 1
+
+
+# Function to check if a response is the error of an expired (or otherwise invalid) pre-signed URL
+def is_expired_url_response(response):
+    return response.status_code == 403 or (
+            response.status_code == 400 and any(marker in response.content for marker in EXPIRED_URL_MARKERS))
+
+
+# Function to raise the errors of a failed download
+def check_response(url, response):
+    if response.status_code == 403:
+        raise ValueError(f"Access denied to file: {url}. Please check if the URL is correct and accessible.")
+    if response.status_code != 200:
+        raise ValueError(f"Failed to download file: status code {response.status_code}")
+
+
+# Function to get a function returning a fresh signed URL of the file of a Notion page
+def get_file_url_refresher(notion_client, page_id, file_position=0):
+    def refresh_url():
+        page = retrieve_page(notion_client, page_id)
+        return page['properties']['Files & media']['files'][file_position]['file']['url']
+    return refresh_url
+
+
+def download_file(url, refresh_url=None, max_retries=DOWNLOAD_RETRIES, response=None):
+    """ Download a file, re-signing its URL once when it expired and retrying timeouts, connection errors and
+    server errors with jittered backoff
+    :param url: file URL
+    :param refresh_url: function returning a fresh signed URL of the file, if it can be re-signed
+    :param max_retries: number of retries of transient errors
+    :param response: response (or exception) of a first attempt made elsewhere, e.g. a concurrent batch
+    :return: bytes of the file
+    :raises ValueError: when the file can't be downloaded
+    """
+    attempts = 0
+    resigned = False
+    while True:
+        error = None
+        if response is None:
+            _count("downloads")
+            try:
+                response = http_get(url)
+            except (TimeoutError, httpx.TimeoutException) as e:
+                _count("timeouts")
+                error = e
+            except httpx.TransportError as e:
+                error = e
+        elif isinstance(response, Exception):
+            error = response
+            if isinstance(error, (TimeoutError, httpx.TimeoutException)):
+                _count("timeouts")
+
+        if error is None and response.status_code == 200:
+            return response.content
+        if error is None and refresh_url is not None and not resigned and is_expired_url_response(response):
+            # Expired links are re-signed by fetching the page again, without counting as a retry
+            print(f"[download_file] re-signing expired URL: {url}")
+            _count("resigned")
+            resigned = True
+            try:
+                url = refresh_url()
+            except Exception as e:
+                _count("failed")
+                raise ValueError(f"Failed to re-sign the expired URL: {url}: {e}")
+        elif (error is not None or response.status_code in RETRYABLE_STATUSES) and attempts < max_retries:
+            attempts += 1
+            _count("retried")
+            backoff = BACKOFF_BASE_SECONDS * 2 ** (attempts - 1)
+            time.sleep(backoff / 2 + random.uniform(0, backoff / 2))
+        else:
+            _count("failed")
+            if error is not None:
+                raise ValueError(f"Failed to download file: {url}: {error!r}")
+            check_response(url, response)
+        response = None
+
+
+def read_file(url, refresh_url=None, artifacts_dir=FILE_ARTIFACTS_DIR):
+    """ Read a submission or source file, downloading and parsing it only the first time
+    :param url: file URL
+    :param refresh_url: function returning a fresh signed URL of the file, used when the URL expired
+    :return: pd.DataFrame
+    """
+    with _get_key_lock(url):
+        df = read_artifact(url, artifacts_dir)
+        if df is not None:
+            return df
+        print("[read_file] ", url)
+        return read_content(url, download_file(url, refresh_url=refresh_url), artifacts_dir)
+
+
+def read_files(urls, refresh_urls=None, artifacts_dir=FILE_ARTIFACTS_DIR):
+    """ Read many files, downloading the ones without an artifact concurrently
+    :param urls: list of file URLs
+    :param refresh_urls: list with the URL refresher of every file (or None)
+    :return: list with the dataframe of every URL, or the exception raised reading it
+    """
+    refresh_urls = refresh_urls or [None] * len(urls)
+    dfs = [read_artifact(url, artifacts_dir) for url in urls]
+    missing = [position for position, df in enumerate(dfs) if df is None]
+    responses = http_get_many([urls[position] for position in missing])
+    for position, response in zip(missing, responses):
+        # A failed file is retried on its own, so it doesn't hold back or fail the rest of the batch
+        try:
+            if not isinstance(response, Exception):
+                _count("downloads")
+            content = download_file(urls[position], refresh_url=refresh_urls[position], response=response)
+            with _get_key_lock(urls[position]):
+                dfs[position] = read_content(urls[position], content, artifacts_dir)
+        except Exception as e:
+            dfs[position] = e
+    return dfs
@@ -0,0 +1,78 @@
+import os
+import pickle
+import sqlite3
+import threading
+from datetime import datetime
+
+LEDGER_FILE_PATH = "processed_files.db"
+LEGACY_CACHE_FILE_PATH = "processed_files_cache.pkl"
+
+
+class ProcessedFilesLedger:
+    """ Append-only ledger of the processed submission files, stored in SQLite (WAL mode).
+    Every new file is a single INSERT, and concurrent sessions, threads and processes can read and write it safely.
+    """
+
+    def __init__(self, path=LEDGER_FILE_PATH, legacy_cache_path=LEGACY_CACHE_FILE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed_files (
+                file_type TEXT NOT NULL,
+                file_key TEXT NOT NULL,
+                team_member TEXT,
+                file_name TEXT,
+                file_date TEXT,
+                size_bytes INTEGER,
+                row_count INTEGER,
+                parse_seconds REAL,
+                content_hash TEXT,
+                processed_at TEXT NOT NULL,
+                PRIMARY KEY (file_type, file_key)
+            )
+        """)
+        self._import_legacy_cache(legacy_cache_path)
+
+    # Function to import the entries of the old pickled cache the first time the ledger is created
+    def _import_legacy_cache(self, legacy_cache_path):
+        if not legacy_cache_path or not os.path.exists(legacy_cache_path):
+            return
+        if self._conn.execute("SELECT 1 FROM processed_files LIMIT 1").fetchone():
+            return
+        try:
+            with open(legacy_cache_path, "rb") as file:
+                legacy_cache = pickle.load(file)
+        except Exception as e:
+            print(f"[ProcessedFilesLedger] Could not read the legacy cache {legacy_cache_path}: {e}")
+            return
+        for file_type, entries in legacy_cache.items():
+            for file_key, (team_member, file_name, file_date) in entries.items():
+                self.add(file_type, file_key, team_member, file_name, file_date)
+
+    def add(self, file_type, file_key, team_member, file_name, file_date, size_bytes=None, row_count=None,
+            parse_seconds=None, content_hash=None):
+        """ Record a processed file, keeping the first record if the file is already in the ledger
+        :return: True if the file was new
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO processed_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_type, file_key, team_member, file_name, file_date, size_bytes, row_count, parse_seconds,
+                 content_hash, datetime.now().isoformat()))
+            return cursor.rowcount == 1
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+# Function to get the process-wide ledger instance
+def get_ledger():
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = ProcessedFilesLedger()
+        return _ledger
@@ -0,0 +1,445 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DASHBOARD_SCRIPT = os.path.join(REPO_DIR, "main.py")
+ACTIONS = ["date_range", "source", "member"]
+SERVER_START_TIMEOUT_SECONDS = 60
+RERUN_TIMEOUT_SECONDS = 300
+SAMPLE_INTERVAL_SECONDS = 0.1
+
+
+class FakeBackend:
+    """ Local HTTP server standing in for the Notion API and the signed Notion file URLs, counting every request """
+
+    def __init__(self):
+        self.pages = []
+        self.files = {}
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        backend = self
+
+        class BackendRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path.startswith("/files/"):
+                    backend.count("file_downloads")
+                    self.reply(backend.files.get(path[len("/files/"):]), "text/csv")
+                elif path.startswith("/v1/pages/"):
+                    backend.count("notion_page_retrievals")
+                    page_id = path[len("/v1/pages/"):]
+                    page = next((page for page in backend.pages if page["id"] == page_id), None)
+                    self.reply(json.dumps(page).encode() if page else None, "application/json")
+                else:
+                    self.reply(None, "text/plain")
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.startswith("/v1/databases/") and self.path.endswith("/query"):
+                    backend.count("notion_queries")
+                    results = {"object": "list", "results": backend.pages, "has_more": False, "next_cursor": None}
+                    self.reply(json.dumps(results).encode(), "application/json")
+                else:
+                    self.reply(None, "text/plain")
+
+            def reply(self, body, content_type):
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body or b"")))
+                self.end_headers()
+                self.wfile.write(body or b"")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), BackendRequestHandler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, name="fake-backend", daemon=True).start()
+
+    def count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def add_file(self, name, df):
+        buffer = io.BytesIO()
+        df.to_csv(buffer, index=False)
+        self.files[name] = buffer.getvalue()
+        # Signed like the Notion URLs, so the readers key the files by path and not by the full URL
+        return f"{self.url}/files/{name}?X-Amz-Signature={random.getrandbits(64):x}"
+
+    def close(self):
+        self._server.shutdown()
+
+
+# Function to build a Notion page of the "Data Hub Progress" database
+def build_page(page_id, title, page_type, data_type, file_name, file_url, file_date, team_member=None):
+    return {
+        "object": "page",
+        "id": page_id,
+        "last_edited_time": "2024-01-01T00:00:00.000Z",
+        "properties": {
+            "Title": {"title": [{"text": {"content": title}}]},
+            "Type": {"select": {"name": page_type}},
+            "Data Type": {"select": {"name": data_type}},
+            "Team Member": {"select": {"name": team_member} if team_member else None},
+            "Date": {"date": {"start": file_date.isoformat()}},
+            "Files & media": {"files": [{"name": file_name, "file": {"url": file_url}}]},
+        },
+    }
+
+
+def build_fake_workspace(backend, sources=3, members=4, files_per_member=10, source_rows=20000, reviewed_rows=500,
+                         seed=0):
+    """ Generate sources with reviewed transactions, merchants and ngram submissions of this year, served by the
+    fake backend
+    :return: list of Notion pages
+    """
+    rng = np.random.default_rng(seed)
+    year_start = date.today().replace(month=1, day=1)
+    days = max(1, (date.today() - year_start).days)
+    pages = []
+    for source_position in range(sources):
+        title = f"Source {source_position + 1}"
+        descriptions = np.array([f"PURCHASE MERCHANT{merchant} STORE {store}" for merchant, store in
+                                 zip(rng.integers(0, 2000, source_rows), rng.integers(0, 50, source_rows))])
+        name = f"source_{source_position}.csv"
+        pages.append(build_page(f"source-{source_position}", title, "Source", "Source", name,
+                                backend.add_file(name, pd.DataFrame({"description": descriptions})), year_start))
+        for member_position in range(members):
+            member = f"Member {member_position + 1}"
+            for file_position in range(files_per_member):
+                reviewed = rng.choice(descriptions, reviewed_rows)
+                reviewed_df = pd.DataFrame({
+                    "description": reviewed,
+                    "extracted_merchant_for_review": [description.split()[1] for description in reviewed],
+                    "merchant_id": rng.choice(["1", "2", "?", "0", "n-1"], reviewed_rows),
+                })
+                name = f"reviewed_{source_position}_{member_position}_{file_position}.csv"
+                pages.append(build_page(f"{name}-page", title, "Submission", "Reviewed Transactions", name,
+                                        backend.add_file(name, reviewed_df),
+                                        year_start + timedelta(days=int(rng.integers(0, days))), member))
+            merchants_df = pd.DataFrame({"name": [f"merchant{value}" for value in rng.integers(0, 2000, 50)]})
+            name = f"merchants_{source_position}_{member_position}.csv"
+            pages.append(build_page(f"{name}-page", title, "Submission", "Merchants", name,
+                                    backend.add_file(name, merchants_df), year_start + timedelta(days=days // 2),
+                                    member))
+            ngrams_df = pd.DataFrame({"key": [f"merchant{value}" for value in rng.integers(0, 2000, 100)]})
+            name = f"ngrams_{source_position}_{member_position}.csv"
+            pages.append(build_page(f"{name}-page", title, "Ngram-File", "Ngrams", name,
+                                    backend.add_file(name, ngrams_df), year_start + timedelta(days=days // 2),
+                                    member))
+    return pages
+
+
+# Function to read the resident memory (MB) and thread count of a process
+def get_process_usage(pid):
+    usage = {}
+    with open(f"/proc/{pid}/status") as file:
+        for line in file:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                usage[name] = int(value.split()[0]) / 1024
+            elif name == "Threads":
+                usage[name] = int(value)
+    return usage
+
+
+class DashboardServer:
+    """ The dashboard run by `streamlit run` in a subprocess, with its background workers off, pointed at the fake
+    backend and writing its ledger and artifacts to a scratch directory. Samples the process' RSS and threads.
+    """
+
+    def __init__(self, notion_api_url, workdir, script_path=DASHBOARD_SCRIPT):
+        self.notion_api_url = notion_api_url
+        self.workdir = workdir
+        self.script_path = script_path
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.peak_rss_mb = 0.0
+        self.peak_threads = 0
+        self.process = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        os.makedirs(os.path.join(self.workdir, ".streamlit"), exist_ok=True)
+        with open(os.path.join(self.workdir, ".streamlit", "secrets.toml"), "w") as file:
+            file.write('NOTION_TOKEN = "load-test"\nDATABASE_ID = "load-test-database"\n')
+        env = {**os.environ, "DASHBOARD_BACKGROUND_WORKERS": "0", "NOTION_API_URL": self.notion_api_url,
+               "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")]))}
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", self.script_path, "--server.headless", "true",
+             "--server.port", str(self.port), "--server.fileWatcherType", "none",
+             "--browser.gatherUsageStats", "false"],
+            cwd=self.workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+        while True:
+            try:
+                if httpx.get(f"{self.url}/_stcore/health").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.process.kill()
+                raise RuntimeError(f"The dashboard server didn't start on port {self.port}")
+            time.sleep(0.2)
+        self.threads_at_start = get_process_usage(self.process.pid)["Threads"]
+        threading.Thread(target=self._sample, name="server-sampler", daemon=True).start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL_SECONDS):
+            try:
+                usage = get_process_usage(self.process.pid)
+            except OSError:
+                return
+            self.peak_rss_mb = max(self.peak_rss_mb, usage["VmRSS"])
+            self.peak_threads = max(self.peak_threads, usage["Threads"])
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        try:
+            usage = get_process_usage(self.process.pid)
+            # The kernel's high-water mark catches peaks between two samples
+            self.peak_rss_mb = max(self.peak_rss_mb, usage["VmHWM"])
+            self.threads_at_end = usage["Threads"]
+        except OSError:
+            self.threads_at_end = None
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class DashboardSession:
+    """ Headless browser session: speaks the Streamlit websocket protocol, keeps the widget states like the frontend
+    does, and times every rerun until the script finishes
+    """
+
+    def __init__(self, server_url):
+        self.stream_url = server_url.replace("http://", "ws://") + "/_stcore/stream"
+        self.widgets = {}
+        self._cached_messages = {}
+        self._connection = None
+
+    async def connect(self):
+        from tornado.websocket import websocket_connect
+        self._connection = await websocket_connect(self.stream_url, subprotocols=["streamlit"],
+                                                   max_message_size=1024 ** 3)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+
+    # Function to find a widget of the last run by its label
+    def get_widget(self, label):
+        return next((widget for widget in self.widgets.values() if widget["label"] == label), None)
+
+    async def rerun(self, fragment_id=""):
+        """ Send the widget states and wait for the script (or fragment) run to finish
+        :return: (latency seconds, error message or None)
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        back_msg = BackMsg()
+        back_msg.rerun_script.query_string = ""
+        back_msg.rerun_script.fragment_id = fragment_id
+        back_msg.rerun_script.widget_states.widgets.extend(widget["state"] for widget in self.widgets.values())
+        started = time.perf_counter()
+        await self._connection.write_message(back_msg.SerializeToString(), binary=True)
+
+        seen_widgets, error = set(), None
+        while True:
+            payload = await asyncio.wait_for(self._connection.read_message(), RERUN_TIMEOUT_SECONDS)
+            if payload is None:
+                return None, "The server closed the connection"
+            msg = ForwardMsg()
+            msg.ParseFromString(payload)
+            if msg.WhichOneof("type") == "ref_hash":
+                msg = self._cached_messages[msg.ref_hash]
+            elif msg.metadata.cacheable:
+                self._cached_messages[msg.hash] = msg
+
+            if msg.WhichOneof("type") == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                element = msg.delta.new_element
+                if element.WhichOneof("type") == "exception":
+                    error = error or element.exception.message
+                elif element.WhichOneof("type") in ("selectbox", "checkbox", "date_input"):
+                    seen_widgets.add(self._register_widget(element, msg.delta.fragment_id))
+            elif msg.WhichOneof("type") == "script_finished":
+                if msg.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue
+                if msg.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    error = error or "Compile error"
+                break
+        latency = time.perf_counter() - started
+        # Widgets that weren't rendered by a full run are gone, as the frontend forgets them
+        if not fragment_id:
+            self.widgets = {widget_id: widget for widget_id, widget in self.widgets.items() if widget_id in seen_widgets}
+        return latency, error
+
+    # Function to record a rendered widget, with its default value the first time it appears
+    def _register_widget(self, element, fragment_id):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        widget_type = element.WhichOneof("type")
+        proto = getattr(element, widget_type)
+        if proto.id not in self.widgets:
+            state = WidgetState(id=proto.id)
+            if widget_type == "selectbox":
+                state.int_value = proto.default
+            elif widget_type == "checkbox":
+                state.bool_value = proto.default
+            else:
+                state.string_array_value.data.extend(proto.default)
+            self.widgets[proto.id] = {"label": proto.label, "state": state, "fragment_id": fragment_id,
+                                      "options": list(getattr(proto, "options", []))}
+        else:
+            # The fragment ids are regenerated on every full rerun, the latest one is the one the server knows
+            self.widgets[proto.id]["fragment_id"] = fragment_id
+        return proto.id
+
+    def apply_action(self, action, rng):
+        """ Change a widget like a viewer would: a new date range, another source or another team member
+        :return: id of the fragment to rerun ("" for the whole script), or None if the widget isn't rendered
+        """
+        if action == "date_range":
+            widget = self.get_widget("Select Date Range")
+            if widget is None:
+                return None
+            today = date.today()
+            start = today.replace(month=1, day=1) + timedelta(days=rng.randrange(max(1, today.timetuple().tm_yday)))
+            del widget["state"].string_array_value.data[:]
+            widget["state"].string_array_value.data.extend([start.strftime("%Y/%m/%d"), today.strftime("%Y/%m/%d")])
+            return ""
+        widget = self.get_widget("Select Source File" if action == "source" else "Select Team Member:")
+        if widget is None or not widget["options"]:
+            return None
+        widget["state"].int_value = rng.randrange(len(widget["options"]))
+        return widget["fragment_id"]
+
+
+async def run_session(server_url, session_id, actions, seed, think_seconds):
+    """ Simulate one viewer: open the dashboard, then change the date range, source or team member
+    :return: list of (action, latency seconds, error or None)
+    """
+    rng = random.Random(seed * 100003 + session_id)
+    session = DashboardSession(server_url)
+    results = []
+    try:
+        await session.connect()
+        latency, error = await session.rerun()
+        results.append(("open", latency, error))
+        for action in [rng.choice(ACTIONS) for _ in range(actions)]:
+            await asyncio.sleep(rng.uniform(0, think_seconds))
+            fragment_id = session.apply_action(action, rng)
+            if fragment_id is None:
+                continue
+            latency, error = await session.rerun(fragment_id)
+            results.append((action, latency, error))
+    except Exception as e:
+        results.append(("session", None, repr(e)))
+    finally:
+        session.close()
+    return results
+
+
+# Function to get a latency percentile, rounded to the millisecond
+def get_percentile(latencies, percentile):
+    return round(float(np.percentile(latencies, percentile)), 3) if len(latencies) else None
+
+
+def run_load_test(sessions=10, actions=10, seed=0, think_seconds=1.0, workspace_kwargs=None):
+    """ Run concurrent headless sessions against the dashboard, served offline from fakes of Notion and the files
+    :param sessions: number of concurrent sessions
+    :param actions: number of interactions of every session after it opens the dashboard
+    :param think_seconds: upper bound of the random pause before every interaction
+    :param workspace_kwargs: arguments of build_fake_workspace
+    :return: dict with the rerun latency percentiles, the server's resource peaks and the outbound request counts
+    """
+    backend = FakeBackend()
+    backend.pages = build_fake_workspace(backend, seed=seed, **(workspace_kwargs or {}))
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as workdir, DashboardServer(backend.url, workdir) as server:
+        async def run_sessions():
+            return await asyncio.gather(*(run_session(server.url, session_id, actions, seed, think_seconds)
+                                          for session_id in range(sessions)))
+        session_results = asyncio.run(run_sessions())
+    backend.close()
+
+    results = [result for session in session_results for result in session]
+    succeeded = [(action, latency) for action, latency, error in results if error is None]
+    latencies = np.array([latency for _, latency in succeeded])
+    errors = [error for _, _, error in results if error is not None]
+    return {
+        "sessions": sessions,
+        "reruns": len(results),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "duration_seconds": round(time.perf_counter() - started, 2),
+        "p50_seconds": get_percentile(latencies, 50),
+        "p95_seconds": get_percentile(latencies, 95),
+        "p95_seconds_by_action": {action: get_percentile([latency for name, latency in succeeded if name == action],
+                                                         95)
+                                  for action in sorted({action for action, _ in succeeded})},
+        "peak_rss_mb": round(server.peak_rss_mb, 1),
+        "threads_at_start": server.threads_at_start,
+        "peak_threads": server.peak_threads,
+        "threads_at_end": server.threads_at_end,
+        "outbound_requests": dict(backend.requests),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the dashboard with concurrent headless sessions, "
+                                                 "offline (Notion and the file URLs are faked)")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--actions", type=int, default=10, help="Interactions per session after opening it")
+    parser.add_argument("--think-seconds", type=float, default=1.0, help="Longest pause before an interaction")
+    parser.add_argument("--sources", type=int, default=3)
+    parser.add_argument("--members", type=int, default=4)
+    parser.add_argument("--files-per-member", type=int, default=10)
+    parser.add_argument("--source-rows", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-p95", type=float, help="Fail if the p95 rerun latency (seconds) is above")
+    parser.add_argument("--max-rss-mb", type=float, help="Fail if the server's peak RSS (MB) is above")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    report = run_load_test(sessions=args.sessions, actions=args.actions, seed=args.seed,
+                           think_seconds=args.think_seconds, workspace_kwargs={
+                               "sources": args.sources, "members": args.members,
+                               "files_per_member": args.files_per_member, "source_rows": args.source_rows})
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    failed = report["errors"] > 0
+    failed |= args.max_p95 is not None and (report["p95_seconds"] or 0) > args.max_p95
+    failed |= args.max_rss_mb is not None and report["peak_rss_mb"] > args.max_rss_mb
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import requests
+from PIL import Image, ImageChops
+from fake_useragent import UserAgent
+
+try:
+    import cairosvg
+except ImportError:  # SVG logos are skipped unless cairosvg is installed
+    cairosvg = None
+
+LOGO_MAX_SIZE = int(os.getenv('LOGO_MAX_SIZE', 256))
+LOGO_WEBP = os.getenv('LOGO_WEBP', 'false').lower() == 'true'
+LOGO_WORKERS = int(os.getenv('LOGO_WORKERS', os.cpu_count() or 1))
+FALLBACK_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) ' \
+                      'Chrome/58.0.3029.110 Safari/537.3'
+
+
+def download_logo(logo_url):
+    """ Download a logo with a random browser user agent
+    :param logo_url: str
+    :return: bytes, or None if the download failed
+    """
+    try:
+        headers = {'User-Agent': UserAgent().random}
+    except Exception:
+        headers = {'User-Agent': FALLBACK_USER_AGENT}
+    try:
+        response = requests.get(logo_url, headers=headers, timeout=(5, 30))
+    except Exception as e:
+        print(f"Failed to download image {logo_url}: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Failed to download image: {response.status_code}")
+        return None
+    return response.content
+
+
+# Function to decode any supported image format (PNG, JPEG, WebP, GIF, BMP, ICO and SVG with cairosvg) to RGBA
+def decode_logo(content):
+    if b"<svg" in content[:1024]:
+        if cairosvg is None:
+            raise ValueError("SVG logos need cairosvg to be installed")
+        content = cairosvg.svg2png(bytestring=content, output_width=LOGO_MAX_SIZE * 2)
+    image = Image.open(io.BytesIO(content))
+    # Animated formats (GIF, WebP) keep their first frame
+    image.seek(0)
+    return image.convert("RGBA")
+
+
+# Function to trim a uniform or transparent border around the logo
+def trim_logo(image):
+    alpha_bbox = image.getchannel("A").getbbox()
+    if alpha_bbox and alpha_bbox != (0, 0) + image.size:
+        return image.crop(alpha_bbox)
+    background = Image.new("RGBA", image.size, image.getpixel((0, 0)))
+    bbox = ImageChops.difference(image, background).convert("L").point(lambda value: 255 if value > 8 else 0) \
+        .getbbox()
+    return image.crop(bbox) if bbox else image
+
+
+# Function to encode a logo as an optimized PNG, palette-based when it has few enough colors to stay lossless
+def encode_png(image):
+    buffer = io.BytesIO()
+    # Fully opaque logos don't need an alpha channel
+    if image.getchannel("A").getextrema() == (255, 255):
+        image = image.convert("RGB")
+    if image.getcolors(256) is not None:
+        image.quantize(colors=256, method=Image.Quantize.FASTOCTREE).save(buffer, format="PNG", optimize=True)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def normalize_logo(content, max_size=LOGO_MAX_SIZE, webp=LOGO_WEBP):
+    """ Decode, trim and resize a logo, and encode it as optimized PNG (and optionally WebP)
+    :param content: bytes of the original logo
+    :param max_size: maximum width/height in pixels
+    :param webp: also encode a WebP variant
+    :return: dict with the encoded variants and their sizes
+    """
+    image = trim_logo(decode_logo(content))
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    png_content = encode_png(image)
+
+    # An original PNG that already fits is kept if re-encoding doesn't make it smaller
+    if content[:8] == b"\x89PNG\r\n\x1a\n" and len(content) <= len(png_content):
+        original = Image.open(io.BytesIO(content))
+        if max(original.size) <= max_size:
+            png_content = content
+
+    webp_content = None
+    if webp:
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=85, method=6)
+        webp_content = buffer.getvalue()
+
+    return {
+        "png": png_content,
+        "webp": webp_content,
+        "width": image.width,
+        "height": image.height,
+        "original_bytes": len(content),
+        "png_bytes": len(png_content),
+        "webp_bytes": len(webp_content) if webp_content else None,
+        "bytes_saved": len(content) - len(png_content),
+    }
+
+
+# Function to download and normalize a logo (runs inside a worker process)
+def fetch_and_normalize_logo(logo_url, max_size=LOGO_MAX_SIZE, webp=LOGO_WEBP):
+    if not isinstance(logo_url, str) or not logo_url:
+        return None
+    content = download_logo(logo_url)
+    if content is None:
+        return None
+    try:
+        return normalize_logo(content, max_size=max_size, webp=webp)
+    except Exception as e:
+        print(f"An error occurred during logo normalization of {logo_url}: {e}")
+        return None
+
+
+def fetch_and_normalize_logos(logo_urls, max_workers=LOGO_WORKERS):
+    """ Download and normalize many logos across a process pool
+    :param logo_urls: list of logo URLs (non-string values are skipped)
+    :param max_workers: number of worker processes
+    :return: list with the normalize_logo result of every URL (None when it failed)
+    """
+    if max_workers <= 1 or len(logo_urls) <= 1:
+        return [fetch_and_normalize_logo(logo_url) for logo_url in logo_urls]
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(logo_urls)),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        return list(executor.map(fetch_and_normalize_logo, logo_urls))
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+import pandas as pd
+import psycopg2
+
+MERCHANT_INDEX_REFRESH_SECONDS = int(os.getenv('MERCHANT_INDEX_REFRESH_SECONDS', 30 * 60))
+# merchant_id values of reviewed rows whose ngram has no merchant (counted as invalid ngrams, not references)
+PLACEHOLDER_MERCHANT_IDS = {"0", "?"}
+NEW_MERCHANT_ID_PREFIX = "n-"
+
+
+# Function to connect to the merchants database
+def connect_to_db():
+    return psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST'),
+        user=os.getenv('POSTGRES_USER'),
+        password=os.getenv('POSTGRES_PASSWORD'),
+        database=os.getenv('POSTGRES_DB'),
+    )
+
+
+# Function to normalize a merchant_id cell ("123", 123 and 123.0 are the same id)
+def normalize_merchant_id(value):
+    if pd.isna(value):
+        return None
+    value = str(value).strip()
+    if value.endswith(".0") and value[:-2].isdigit():
+        value = value[:-2]
+    return value or None
+
+
+class MerchantIndex:
+    """ In-memory index of the validated merchants (ids and names), reloaded with one query when stale.
+    References missing from the index are looked up in one batched query, since merchants may have been
+    populated after the last reload.
+    """
+
+    def __init__(self, connect=connect_to_db, refresh_seconds=MERCHANT_INDEX_REFRESH_SECONDS):
+        self.connect = connect
+        self.refresh_seconds = refresh_seconds
+        self.ids = set()
+        self.ids_by_name = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and self.loaded_at is not None and time.monotonic() - self.loaded_at < self.refresh_seconds:
+                return
+            conn = self.connect()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT id, name FROM merchant WHERE validated = True")
+                    rows = cur.fetchall()
+            finally:
+                conn.close()
+            self.ids = {str(merchant_id) for merchant_id, _ in rows}
+            self.ids_by_name = {name: str(merchant_id) for merchant_id, name in rows if name is not None}
+            self.loaded_at = time.monotonic()
+            print(f"[MerchantIndex] loaded {len(rows)} merchants")
+
+    def resolve(self, merchant_ids, merchant_names):
+        """ Resolve merchant ids and names against the validated merchants
+        :param merchant_ids: iterable of numeric merchant id strings
+        :param merchant_names: iterable of merchant names
+        :return: (set of unknown ids, set of unknown names)
+        """
+        self.refresh()
+        missing_ids = {merchant_id for merchant_id in merchant_ids if merchant_id not in self.ids}
+        missing_names = {name for name in merchant_names if name not in self.ids_by_name}
+        if missing_ids or missing_names:
+            self._lookup(missing_ids, missing_names)
+        return ({merchant_id for merchant_id in missing_ids if merchant_id not in self.ids},
+                {name for name in missing_names if name not in self.ids_by_name})
+
+    # Function to look up the references missing from the index with a single query
+    def _lookup(self, merchant_ids, merchant_names):
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, name FROM merchant
+                    WHERE validated = True AND (id::text = ANY(%s) OR name = ANY(%s))
+                """, (list(merchant_ids), list(merchant_names)))
+                rows = cur.fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            for merchant_id, name in rows:
+                self.ids.add(str(merchant_id))
+                if name is not None:
+                    self.ids_by_name[name] = str(merchant_id)
+
+
+def verify_merchant_references(df, merchant_index, id_column="merchant_id",
+                               name_column="extracted_merchant_for_review"):
+    """ Verify the merchant references of a reviewed transactions file.
+    Rows with a numeric merchant_id must reference a validated merchant, by id and by name (the population looks
+    transactions' merchants up by name). Rows with an "n-" id reference new merchants, which are only reported as
+    pending when their name isn't in the database yet. Placeholder ids (0, ?) are skipped.
+    :return: dict with the unknown ids, unknown names, pending new merchants and the number of rows checked
+    """
+    merchant_ids = df[id_column].map(normalize_merchant_id)
+    merchant_names = df[name_column].where(df[name_column].notna(), None)
+    referenced = merchant_ids.notna() & ~merchant_ids.isin(PLACEHOLDER_MERCHANT_IDS)
+    new_merchant = referenced & merchant_ids.str.startswith(NEW_MERCHANT_ID_PREFIX, na=False)
+    existing_merchant = referenced & ~new_merchant
+
+    distinct_ids = set(merchant_ids[existing_merchant])
+    distinct_names = set(merchant_names[referenced].dropna())
+    unknown_ids, unknown_names = merchant_index.resolve(distinct_ids, distinct_names)
+
+    return {
+        "checked_rows": int(referenced.sum()),
+        "unknown_ids": sorted(unknown_ids),
+        "unknown_names": sorted(unknown_names & set(merchant_names[existing_merchant].dropna())),
+        "pending_new_merchants": sorted(unknown_names & set(merchant_names[new_merchant].dropna())),
+    }
+
+
+_merchant_index = None
+_merchant_index_lock = threading.Lock()
+
+
+# Function to get the process-wide merchant index
+def get_merchant_index():
+    global _merchant_index
+    with _merchant_index_lock:
+        if _merchant_index is None:
+            _merchant_index = MerchantIndex()
+        return _merchant_index
@@ -0,0 +1,194 @@
+import os
+import re
+import threading
+import time
+import numpy as np
+import pandas as pd
+from .merchant_index import connect_to_db
+
+MERCHANT_SIMILARITY_REFRESH_SECONDS = int(os.getenv('MERCHANT_SIMILARITY_REFRESH_SECONDS', 30 * 60))
+# Names whose character trigram sets have a Jaccard similarity of at least this are likely duplicates
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.5))
+SHINGLE_SIZE = 3
+# 20 bands of 3 rows: pairs at a 0.5 similarity become candidates with ~0.93 probability, pairs at 0.6 with ~0.99
+LSH_BANDS = 20
+LSH_ROWS = 3
+MINHASH_SEED = 42
+ADD_BATCH_SIZE = 5000
+
+
+# Function to normalize a merchant name for comparison ("Starbucks Coffee, Inc." -> "starbucks coffee inc")
+def normalize_merchant_name(name):
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", str(name).lower()).split())
+
+
+# Function to get the character shingles of a normalized name, padded so short names get shingles too
+def get_shingles(normalized_name, size=SHINGLE_SIZE):
+    padded = f" {normalized_name} "
+    return {padded[i:i + size] for i in range(max(1, len(padded) - size + 1))}
+
+
+def get_jaccard_similarity(shingles, other_shingles):
+    return len(shingles & other_shingles) / len(shingles | other_shingles) if shingles or other_shingles else 0.0
+
+
+class MinHasher:
+    """ MinHash signatures of shingle sets, with one multiply-shift hash function per signature row """
+
+    def __init__(self, num_hashes=LSH_BANDS * LSH_ROWS, seed=MINHASH_SEED):
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(1, 2 ** 63, num_hashes, dtype=np.uint64) | np.uint64(1)
+        self.increments = rng.integers(0, 2 ** 63, num_hashes, dtype=np.uint64)
+
+    def signature(self, shingles):
+        return self.signatures([shingles])[0]
+
+    def signatures(self, shingle_sets):
+        """ Compute the signatures of many shingle sets at once
+        :param shingle_sets: list of non-empty sets of str
+        :return: uint64 array of shape (len(shingle_sets), num_hashes)
+        """
+        lengths = np.array([len(shingles) for shingles in shingle_sets])
+        hashes = pd.util.hash_array(np.array([shingle for shingles in shingle_sets for shingle in shingles],
+                                             dtype=object))
+        # uint64 arithmetic wraps around, which is the modulo of the multiply-shift scheme
+        with np.errstate(over="ignore"):
+            permuted = hashes[None, :] * self.multipliers[:, None] + self.increments[:, None]
+        return np.minimum.reduceat(permuted >> np.uint64(32), np.r_[0, np.cumsum(lengths)[:-1]], axis=1).T
+
+
+class NearDuplicateIndex:
+    """ Locality-sensitive hashing index of merchant names: names sharing one band of their MinHash signature are
+    candidates, and candidates are confirmed with their exact shingle Jaccard similarity. Adding or querying a name
+    costs one signature and LSH_BANDS bucket lookups, independent of the number of indexed names.
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD, bands=LSH_BANDS, rows=LSH_ROWS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.minhasher = MinHasher(bands * rows)
+        self.names = {}
+        self.shingles = {}
+        self.buckets = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.names)
+
+    def _get_band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, key, name):
+        self.add_many([(key, name)])
+
+    def add_many(self, items, batch_size=ADD_BATCH_SIZE):
+        """ Index many (key, name) pairs, computing their signatures in batches """
+        items = [(key, name, normalize_merchant_name(name)) for key, name in items if key not in self.names]
+        items = [(key, name, normalized_name) for key, name, normalized_name in items if normalized_name]
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            shingle_sets = [get_shingles(normalized_name) for _, _, normalized_name in batch]
+            for (key, name, _), shingles, signature in zip(batch, shingle_sets,
+                                                            self.minhasher.signatures(shingle_sets)):
+                self.names[key] = name
+                self.shingles[key] = shingles
+                for band, band_key in enumerate(self._get_band_keys(signature)):
+                    self.buckets[band].setdefault(band_key, []).append(key)
+
+    def query(self, name, exclude=()):
+        """ Find the indexed names that are likely duplicates of a name
+        :param exclude: keys to leave out (e.g. the name's own key)
+        :return: list of (key, indexed name, similarity), the most similar first
+        """
+        normalized_name = normalize_merchant_name(name)
+        if not normalized_name:
+            return []
+        shingles = get_shingles(normalized_name)
+        candidates = set()
+        for band, band_key in enumerate(self._get_band_keys(self.minhasher.signature(shingles))):
+            candidates.update(self.buckets[band].get(band_key, ()))
+        matches = []
+        for key in candidates - set(exclude):
+            similarity = get_jaccard_similarity(shingles, self.shingles[key])
+            if similarity >= self.threshold:
+                matches.append((key, self.names[key], similarity))
+        return sorted(matches, key=lambda match: -match[2])
+
+
+class MerchantSimilarityIndex(NearDuplicateIndex):
+    """ Near-duplicate index of the merchant names in the database. The first refresh loads every merchant, the
+    next ones only the merchants added since (ids are allocated in increasing order).
+    """
+
+    def __init__(self, connect=connect_to_db, refresh_seconds=MERCHANT_SIMILARITY_REFRESH_SECONDS, **kwargs):
+        super().__init__(**kwargs)
+        self.connect = connect
+        self.refresh_seconds = refresh_seconds
+        self.max_merchant_id = None
+        self.refreshed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and self.refreshed_at is not None and \
+                    time.monotonic() - self.refreshed_at < self.refresh_seconds:
+                return
+            conn = self.connect()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT id, name FROM merchant WHERE id > %s ORDER BY id",
+                                (self.max_merchant_id if self.max_merchant_id is not None else -1,))
+                    rows = cur.fetchall()
+            finally:
+                conn.close()
+            super().add_many((merchant_id, name) for merchant_id, name in rows if name is not None)
+            if rows:
+                self.max_merchant_id = max(self.max_merchant_id or rows[-1][0], rows[-1][0])
+            self.refreshed_at = time.monotonic()
+            print(f"[MerchantSimilarityIndex] loaded {len(rows)} merchants ({len(self)} indexed)")
+
+    def add_many(self, items, batch_size=ADD_BATCH_SIZE):
+        with self._lock:
+            super().add_many(items, batch_size)
+
+    def query(self, name, exclude=()):
+        with self._lock:
+            return super().query(name, exclude)
+
+
+def find_near_duplicate_merchants(names, merchant_index=None, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """ Find the likely duplicates of submitted merchant names, among themselves and in the merchant table.
+    Names equal once normalized are left to the exact-match checks.
+    :param names: iterable of merchant names
+    :param merchant_index: MerchantSimilarityIndex of the merchant table, only the submitted names are compared if None
+    :return: pd.DataFrame with the name, the similar merchant, its merchant id (None if submitted) and the similarity
+    """
+    names = pd.Series(list(names), dtype=object).dropna().astype(str).drop_duplicates().tolist()
+    rows = []
+    submitted_index = NearDuplicateIndex(threshold=threshold)
+    for position, name in enumerate(names):
+        normalized_name = normalize_merchant_name(name)
+        if merchant_index is not None:
+            for merchant_id, merchant_name, similarity in merchant_index.query(name):
+                if normalize_merchant_name(merchant_name) != normalized_name:
+                    rows.append((name, merchant_name, merchant_id, similarity))
+        for _, submitted_name, similarity in submitted_index.query(name):
+            if normalize_merchant_name(submitted_name) != normalized_name:
+                rows.append((name, submitted_name, None, similarity))
+        submitted_index.add(position, name)
+    return pd.DataFrame(rows, columns=["Name", "Similar Merchant", "Merchant ID", "Similarity"]) \
+        .astype({"Merchant ID": "Int64"}).sort_values("Similarity", ascending=False, ignore_index=True)
+
+
+_merchant_similarity_index = None
+_merchant_similarity_index_lock = threading.Lock()
+
+
+# Function to get the process-wide merchant similarity index, refreshed with the merchants added since the last load
+def get_merchant_similarity_index():
+    global _merchant_similarity_index
+    with _merchant_similarity_index_lock:
+        if _merchant_similarity_index is None:
+            _merchant_similarity_index = MerchantSimilarityIndex()
+    _merchant_similarity_index.refresh()
+    return _merchant_similarity_index
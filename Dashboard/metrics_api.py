@@ -0,0 +1,267 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+import pandas as pd
+import pyarrow as pa
+from .coverage_snapshots import COVERAGE_SNAPSHOTS_DIR, get_snapshot_dir
+from .file_reader import dataframe_to_table
+from .report import REPORTS_DIR, VALIDATION_STATUS_FILE, slugify, get_report_dir
+from .tagged_cache import get_tagged_cache
+
+# Local only by default, since the API has no authentication
+METRICS_API_HOST = os.getenv('METRICS_API_HOST', "127.0.0.1")
+METRICS_API_PORT = int(os.getenv('METRICS_API_PORT', 8502))
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+# Clients may reuse a response for this long before revalidating it with If-None-Match
+CACHE_MAX_AGE_SECONDS = 60
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+# Report dataframe served by every table endpoint
+TABLE_ENDPOINTS = {
+    "members": "progress_df_transactions",
+    "ngrams": "progress_df_ngrams",
+    "files": "df_ngrams",
+    "merchants": "df_merchants",
+    "overlaps": "overlapped_transactions_df",
+}
+
+
+class MetricsAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Function to get the summary files of the reports of a source, the most recently generated first
+def get_report_summaries(source_title, reports_dir=REPORTS_DIR):
+    paths = glob.glob(os.path.join(reports_dir, slugify(source_title), "*", "summary.json"))
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+# Function to get the summary file of a source's report: the given date range, or the latest report
+def get_report_summary_path(source_title, start=None, end=None, reports_dir=REPORTS_DIR):
+    if start and end:
+        try:
+            start_date, end_date = date.fromisoformat(start), date.fromisoformat(end)
+        except ValueError:
+            raise MetricsAPIError(400, "start and end must be dates (YYYY-MM-DD)")
+        path = os.path.join(get_report_dir(source_title, start_date, end_date, output_dir=reports_dir), "summary.json")
+        summaries = [path] if os.path.exists(path) else []
+    else:
+        summaries = get_report_summaries(source_title, reports_dir)
+    if not summaries:
+        raise MetricsAPIError(404, f"No precomputed report for source {source_title!r}")
+    return summaries[0]
+
+
+# Function to get the version of a set of files from their size and modification time, without reading them
+def get_files_version(paths):
+    version = hashlib.sha256()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        version.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    return version.hexdigest()
+
+
+# Function to load a JSON or Parquet file once per version, shared by every request
+def load_file(path):
+    stat = os.stat(path)
+    key = ("metrics_api", path, stat.st_mtime_ns, stat.st_size)
+    cache = get_tagged_cache()
+    value = cache.get(key)
+    if value is None:
+        if path.endswith(".json"):
+            with open(path) as file:
+                value = json.load(file)
+        else:
+            value = pd.read_parquet(path)
+        cache.set(key, value, tags={"metrics_api", f"metrics_api:{path}"})
+    return value
+
+
+# Function to parse the pagination parameters of a request
+def get_page(query):
+    try:
+        offset = max(0, int(query.get("offset", 0)))
+        limit = min(MAX_PAGE_SIZE, max(1, int(query.get("limit", DEFAULT_PAGE_SIZE))))
+    except ValueError:
+        raise MetricsAPIError(400, "offset and limit must be integers")
+    return offset, limit
+
+
+def serialize_table(df, query, response_format):
+    """ Serialize one page of a dataframe
+    :param df: pd.DataFrame
+    :param query: request parameters, with the optional offset and limit
+    :param response_format: "json" or "arrow"
+    :return: (body bytes, content type, extra headers)
+    """
+    offset, limit = get_page(query)
+    page_df = df.iloc[offset:offset + limit]
+    next_offset = offset + limit if offset + limit < len(df) else None
+    headers = {"X-Total-Count": str(len(df))}
+    if response_format == "arrow":
+        sink = pa.BufferOutputStream()
+        table = dataframe_to_table(page_df.reset_index(drop=True))
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        if next_offset is not None:
+            headers["X-Next-Offset"] = str(next_offset)
+        return sink.getvalue().to_pybytes(), ARROW_CONTENT_TYPE, headers
+    items = page_df.to_json(orient="records", date_format="iso")
+    body = (f'{{"total": {len(df)}, "offset": {offset}, "limit": {limit}, '
+            f'"next_offset": {json.dumps(next_offset)}, "items": {items}}}')
+    return body.encode(), "application/json", headers
+
+
+class MetricsAPI:
+    """ Read-only HTTP API over the precomputed reports, coverage snapshots and validation status.
+    Responses are versioned by the modification time of the files they come from: clients revalidating with
+    If-None-Match get a 304 after a few stat calls, and serialized responses are cached until the files change.
+
+    GET /sources
+    GET /sources/<source>                  report summary (?start=YYYY-MM-DD&end=YYYY-MM-DD, latest report if omitted)
+    GET /sources/<source>/<table>          members, ngrams, files, merchants or overlaps (paginated)
+    GET /sources/<source>/trend            daily cumulative coverage (paginated)
+    GET /validation                        validation status of the submissions (?source=, paginated)
+    Tables are JSON, or Arrow IPC streams with ?format=arrow or "Accept: application/vnd.apache.arrow.stream".
+    """
+
+    def __init__(self, reports_dir=REPORTS_DIR, snapshots_dir=COVERAGE_SNAPSHOTS_DIR):
+        self.reports_dir = reports_dir
+        self.snapshots_dir = snapshots_dir
+
+    # Function to resolve a request to the files it reads and the function building its response from them
+    def route(self, path, query):
+        parts = [unquote(part) for part in path.strip("/").split("/") if part]
+        if parts == ["sources"]:
+            paths = glob.glob(os.path.join(self.reports_dir, "*", "*", "summary.json"))
+            return paths, lambda response_format: self.list_sources(paths)
+        if parts == ["validation"]:
+            path = os.path.join(self.reports_dir, VALIDATION_STATUS_FILE)
+            if not os.path.exists(path):
+                raise MetricsAPIError(404, "No validation status was written yet")
+            return [path], lambda response_format: serialize_table(
+                self.filter_source(load_file(path), query), query, response_format)
+        if len(parts) == 2 and parts[0] == "sources":
+            summary_path = get_report_summary_path(parts[1], query.get("start"), query.get("end"), self.reports_dir)
+            return [summary_path], lambda response_format: self.get_summary(summary_path)
+        if len(parts) == 3 and parts[0] == "sources" and parts[2] == "trend":
+            path = os.path.join(get_snapshot_dir(parts[1], self.snapshots_dir), "trend.parquet")
+            if not os.path.exists(path):
+                raise MetricsAPIError(404, f"No coverage snapshots for source {parts[1]!r}")
+            return [path], lambda response_format: serialize_table(load_file(path), query, response_format)
+        if len(parts) == 3 and parts[0] == "sources" and parts[2] in TABLE_ENDPOINTS:
+            summary_path = get_report_summary_path(parts[1], query.get("start"), query.get("end"), self.reports_dir)
+            path = os.path.join(os.path.dirname(summary_path), f"{TABLE_ENDPOINTS[parts[2]]}.parquet")
+            if not os.path.exists(path):
+                raise MetricsAPIError(404, f"The report of {parts[1]!r} has no {parts[2]}")
+            return [path], lambda response_format: serialize_table(load_file(path), query, response_format)
+        raise MetricsAPIError(404, f"Unknown endpoint: {path}")
+
+    def list_sources(self, summary_paths):
+        sources = {}
+        for summary_path in sorted(summary_paths, key=os.path.getmtime):
+            summary = load_file(summary_path)
+            sources.setdefault(summary["source_title"], []).append(
+                {key: summary.get(key) for key in ["start_date", "end_date", "generated_at",
+                                                   "overall_reviewed_transactions_progress"]})
+        items = [{"source_title": source_title, "reports": reports} for source_title, reports in sorted(sources.items())]
+        return json.dumps({"items": items}).encode(), "application/json", {}
+
+    def get_summary(self, summary_path):
+        summary = {key: value for key, value in load_file(summary_path).items() if key != "dataframes"}
+        return json.dumps(summary, default=str).encode(), "application/json", {}
+
+    @staticmethod
+    def filter_source(df, query):
+        return df[df["Source"] == query["source"]] if query.get("source") else df
+
+    def handle(self, path, query, accept="", if_none_match=None):
+        """ Build the response of a GET request
+        :return: (status, body bytes, headers)
+        """
+        response_format = query.get("format") or ("arrow" if ARROW_CONTENT_TYPE in (accept or "") else "json")
+        try:
+            paths, build = self.route(path, query)
+            etag = '"{}"'.format(hashlib.sha256(
+                f"{get_files_version(paths)}|{path}|{sorted(query.items())}|{response_format}".encode()
+            ).hexdigest()[:32])
+            headers = {"ETag": etag, "Cache-Control": f"max-age={CACHE_MAX_AGE_SECONDS}"}
+            if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+                return 304, b"", headers
+            cache = get_tagged_cache()
+            response = cache.get(("metrics_api_response", etag))
+            if response is None:
+                response = build(response_format)
+                cache.set(("metrics_api_response", etag), response, tags={"metrics_api"})
+            body, content_type, extra_headers = response
+            return 200, body, {**headers, **extra_headers, "Content-Type": content_type}
+        except MetricsAPIError as e:
+            return e.status, json.dumps({"error": str(e)}).encode(), {"Content-Type": "application/json"}
+        except Exception as e:
+            print(f"[MetricsAPI] Error serving {path}: {e}")
+            return 500, json.dumps({"error": "Internal error"}).encode(), {"Content-Type": "application/json"}
+
+
+def get_request_handler(api):
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status, body, headers = api.handle(url.path, query, accept=self.headers.get("Accept"),
+                                               if_none_match=self.headers.get("If-None-Match"))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # Requests aren't logged one by one, polling clients would flood the logs
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsRequestHandler
+
+
+def serve_metrics_api(host=METRICS_API_HOST, port=METRICS_API_PORT, reports_dir=REPORTS_DIR,
+                      snapshots_dir=COVERAGE_SNAPSHOTS_DIR):
+    """ Serve the metrics API until the process exits
+    :return: None, or immediately if the port is taken (e.g. by another dashboard process)
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), get_request_handler(MetricsAPI(reports_dir, snapshots_dir)))
+    except OSError as e:
+        print(f"[serve_metrics_api] Could not listen on {host}:{port}: {e}")
+        return
+    server.daemon_threads = True
+    print(f"[serve_metrics_api] listening on {host}:{port}")
+    server.serve_forever()
+
+
+# Function to start the metrics API in a background thread
+def start_metrics_api(**kwargs):
+    thread = threading.Thread(target=serve_metrics_api, kwargs=kwargs, daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the read-only Data Hub metrics API")
+    parser.add_argument("--host", default=METRICS_API_HOST)
+    parser.add_argument("--port", type=int, default=METRICS_API_PORT)
+    parser.add_argument("--reports-dir", default=REPORTS_DIR)
+    parser.add_argument("--snapshots-dir", default=COVERAGE_SNAPSHOTS_DIR)
+    args = parser.parse_args()
+    serve_metrics_api(args.host, args.port, args.reports_dir, args.snapshots_dir)
+
+
+if __name__ == "__main__":
+    main()
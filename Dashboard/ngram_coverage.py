@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+NGRAM_FILE_COLUMNS = ["key", "ngram", "ngrams", "Ngram", "Ngrams"]
+MATCH_CHUNK_SIZE = 50000
+# Worker processes matching the descriptions of sources with more than MATCH_CHUNK_SIZE distinct descriptions
+NGRAM_MATCH_PROCESSES = int(os.getenv('NGRAM_MATCH_PROCESSES', min(4, os.cpu_count() or 1)))
+# Entries kept by the cached stages, like the other computation stages (see utils.STAGE_CACHE_MAX_ENTRIES)
+STAGE_CACHE_MAX_ENTRIES = int(os.getenv('STAGE_CACHE_MAX_ENTRIES', 64))
+
+
+class NgramAutomaton:
+    """ Aho-Corasick automaton over a set of ngram keys (case-insensitive substring matching) """
+
+    def __init__(self, ngrams):
+        self.ngrams = sorted({str(ngram).strip().lower() for ngram in ngrams
+                              if isinstance(ngram, str) and ngram.strip()})
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for ngram_id, ngram in enumerate(self.ngrams):
+            self._add(ngram, ngram_id)
+        self._build_fail_links()
+
+    def _add(self, ngram, ngram_id):
+        state = 0
+        for char in ngram:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = next_state
+        self.output[state] = self.output[state] + (ngram_id,)
+
+    def _build_fail_links(self):
+        # Breadth-first, so the fail state of every node is final before its children are visited
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                # Merge the outputs of the fail state, so matching never has to walk the fail chain for outputs
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def match(self, text):
+        """ Get the ids of every ngram found in a text
+        :param text: str
+        :return: set of ngram ids
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        matches = set()
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                matches.update(output[state])
+        return matches
+
+    def match_many(self, texts):
+        return [self.match(text) for text in texts]
+
+
+# Automaton of the worker process, sent once per worker by the pool initializer
+_worker_automaton = None
+
+
+# Function to receive the automaton when a worker process starts
+def _init_match_worker(automaton):
+    global _worker_automaton
+    _worker_automaton = automaton
+
+
+# Function to match a chunk of descriptions in a worker process
+def _match_chunk(texts):
+    return _worker_automaton.match_many(texts)
+
+
+def match_descriptions(automaton, descriptions, processes=1, chunk_size=MATCH_CHUNK_SIZE):
+    """ Match every description against the automaton in one linear pass
+    :param automaton: NgramAutomaton
+    :param descriptions: list of str
+    :param processes: number of worker processes, the descriptions are matched in-process if 1
+    :param chunk_size: number of descriptions sent to a worker at a time
+    :return: list with the set of matched ngram ids of every description
+    """
+    if processes <= 1 or len(descriptions) <= chunk_size:
+        return automaton.match_many(descriptions)
+    chunks = [descriptions[i:i + chunk_size] for i in range(0, len(descriptions), chunk_size)]
+    # The automaton is pickled once per worker instead of once per chunk
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_match_worker, initargs=(automaton,)) as executor:
+        results = executor.map(_match_chunk, chunks)
+        return [matches for chunk_matches in results for matches in chunk_matches]
+
+
+# Function to pick the ngram column of an ngram file
+def get_ngram_file_column(ngram_df):
+    for column in NGRAM_FILE_COLUMNS:
+        if column in ngram_df.columns:
+            return column
+    return ngram_df.columns[0]
+
+
+# Function to get the (ngram, member, file) rows of all the submitted ngram files
+def collect_submitted_ngrams(dfs_ngrams):
+    rows = []
+    for member_name, member_filename, submission_date, ngram_df in dfs_ngrams:
+        ngram_col = get_ngram_file_column(ngram_df)
+        for ngram in ngram_df[ngram_col].dropna().astype(str).str.strip().str.lower().unique():
+            if ngram:
+                rows.append((ngram, member_name, member_filename))
+    return pd.DataFrame(rows, columns=["Ngram", "Team Member", "File"])
+
+
+def compute_ngram_coverage(source_df, dfs_ngrams, automaton=None, processes=NGRAM_MATCH_PROCESSES,
+                           validated_descriptions=frozenset()):
+    """ Compute which submitted ngrams cover which source transactions
+    :param source_df: dataframe with a "description" column
+    :param dfs_ngrams: list of (member_name, member_filename, submission_date, ngram_df)
+    :param automaton: compiled NgramAutomaton of the submitted ngrams, compiled here if None
+    :param processes: number of worker processes used for matching
+    :param validated_descriptions: descriptions already validated in the database, covered without being matched
+    :return: dict with the coverage counts, per-ngram hits, uncovered transactions and overlapping ngrams
+    """
+    submitted_ngrams = collect_submitted_ngrams(dfs_ngrams)
+    automaton = automaton or NgramAutomaton(submitted_ngrams["Ngram"])
+
+    # Match every distinct description once, and weight the matches by the number of source rows
+    description_counts = source_df["description"].dropna().astype(str).value_counts()
+    prevalidated = description_counts.index.isin(validated_descriptions)
+    matches = match_descriptions(automaton, description_counts.index[~prevalidated].tolist(), processes=processes)
+
+    hit_counts = np.zeros(len(automaton.ngrams), dtype=np.int64)
+    covered = prevalidated.copy()
+    for position, description_matches, count in zip(np.flatnonzero(~prevalidated), matches,
+                                                    description_counts.values[~prevalidated]):
+        if description_matches:
+            covered[position] = True
+            hit_counts[list(description_matches)] += count
+
+    ngram_members = submitted_ngrams.groupby("Ngram").agg(
+        Members=("Team Member", lambda members: ", ".join(sorted(set(members)))),
+        Member_Count=("Team Member", "nunique"),
+        Files=("File", "nunique"),
+    ).rename(columns={"Member_Count": "Member Count"})
+    ngram_hits_df = pd.DataFrame({"Ngram": automaton.ngrams, "Transactions Hit": hit_counts}).merge(
+        ngram_members, left_on="Ngram", right_index=True, how="left").sort_values("Transactions Hit",
+                                                                                ascending=False, ignore_index=True)
+
+    uncovered_descriptions = description_counts[~covered]
+    uncovered_df = pd.DataFrame({"description": uncovered_descriptions.index,
+                                 "Transactions": uncovered_descriptions.values})
+
+    total_transactions_count = int(description_counts.sum())
+    covered_transactions_count = int(description_counts[covered].sum())
+    return {
+        "total_transactions_count": total_transactions_count,
+        "covered_transactions_count": covered_transactions_count,
+        "prevalidated_transactions_count": int(description_counts[prevalidated].sum()),
+        "coverage": (covered_transactions_count / total_transactions_count * 100) if total_transactions_count else 0.0,
+        "ngram_hits_df": ngram_hits_df,
+        "uncovered_df": uncovered_df,
+        "overlapping_ngrams_df": ngram_hits_df[ngram_hits_df["Member Count"] > 1].reset_index(drop=True),
+    }
+
+
+# Compiled automaton cached per set of ngram files (shared, not copied, between sessions)
+@st.cache_resource(show_spinner=False, max_entries=STAGE_CACHE_MAX_ENTRIES)
+def load_ngram_automaton(_dfs_ngrams, ngram_files_key):
+    print("[load_ngram_automaton] compiling: ", len(ngram_files_key), " ngram files")
+    return NgramAutomaton(collect_submitted_ngrams(_dfs_ngrams)["Ngram"])
+
+
+# Cached ngram coverage stage, keyed by the source and the ngram file keys and versions
+@st.cache_data(show_spinner=False, max_entries=STAGE_CACHE_MAX_ENTRIES)
+def load_ngram_coverage(_source_df, _dfs_ngrams, source_key, ngram_files_key, _validated_descriptions=frozenset(),
+                        validated_key=None, source_version=None):
+    automaton = load_ngram_automaton(_dfs_ngrams, ngram_files_key)
+    return compute_ngram_coverage(_source_df, _dfs_ngrams, automaton=automaton,
+                                  validated_descriptions=_validated_descriptions)
@@ -0,0 +1,275 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from dotenv import load_dotenv
+from .controller import DataManager
+from .ledger import get_ledger
+from .merchant_index import normalize_merchant_id, PLACEHOLDER_MERCHANT_IDS
+from .progress import get_ngram_column, get_merchant_id_column
+from .utils import process_filtered_data
+
+NGRAM_LOOKUP_DIR = os.getenv('NGRAM_LOOKUP_DIR', "ngram_lookup")
+LATEST_VERSION_FILE = "LATEST"
+RESOLUTIONS = ["majority", "latest"]
+# Longest ngram (in words) looked up in the descriptions
+MAX_NGRAM_WORDS = 5
+
+
+# Function to normalize ngrams and descriptions the same way: lower case, single spaces
+def normalize_text(values):
+    return pd.Series(values, dtype=object).fillna("").astype(str).str.lower().str.split().str.join(" ")
+
+
+# Function to hash normalized strings to uint64, vectorized
+def hash_text(values):
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+# Function to get the (ngram, merchant_id, date) rows of the reviewed transactions files with a merchant id
+def collect_ngram_mappings(dfs_reviewed_transactions):
+    frames = []
+    for member_name, member_filename, submission_date, member_df in dfs_reviewed_transactions:
+        ngram_col = get_ngram_column(member_df)
+        merchant_id_col = get_merchant_id_column(member_df)
+        if ngram_col not in member_df.columns or merchant_id_col not in member_df.columns:
+            continue
+        frames.append(pd.DataFrame({
+            "ngram": normalize_text(member_df[ngram_col].values),
+            "merchant_id": member_df[merchant_id_col].map(normalize_merchant_id).values,
+            "date": pd.Timestamp(str(submission_date)[:10]),
+        }))
+    mappings = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["ngram", "merchant_id",
+                                                                                        "date"])
+    # New merchants ("n-" ids) and placeholders (0, ?) have no merchant id yet
+    valid = (mappings["ngram"] != "") & mappings["merchant_id"].notna() & \
+        ~mappings["merchant_id"].isin(PLACEHOLDER_MERCHANT_IDS) & mappings["merchant_id"].astype(str).str.isdigit()
+    # Typed even without any file, so the dates can be aggregated on an empty workspace
+    return mappings[valid].astype({"merchant_id": "int64", "date": "datetime64[ns]"})
+
+
+def build_ngram_lookup(dfs_reviewed_transactions, resolution="majority"):
+    """ Consolidate the ngram -> merchant mappings of reviewed transactions files into a lookup table
+    :param dfs_reviewed_transactions: list of (member_name, member_filename, submission_date, member_df)
+    :param resolution: "majority" keeps the merchant of most rows (ties: latest), "latest" the most recently
+    submitted one (ties: most rows)
+    :return: pyarrow.Table sorted by ngram hash, with the build metadata
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}, expected one of {RESOLUTIONS}")
+    mappings = collect_ngram_mappings(dfs_reviewed_transactions)
+    counts = mappings.groupby(["ngram", "merchant_id"], sort=False).agg(
+        support=("date", "size"), last_date=("date", "max")).reset_index()
+    order = ["support", "last_date"] if resolution == "majority" else ["last_date", "support"]
+    resolved = counts.sort_values(["ngram", *order, "merchant_id"], ascending=[True, False, False, True]) \
+        .drop_duplicates("ngram").reset_index(drop=True)
+    resolved["merchants"] = resolved["ngram"].map(counts.groupby("ngram").size())
+    resolved["ngram_hash"] = hash_text(resolved["ngram"].values)
+    resolved = resolved.sort_values("ngram_hash", ignore_index=True)
+
+    table = pa.table({
+        "ngram_hash": pa.array(resolved["ngram_hash"].values, pa.uint64()),
+        "ngram": pa.array(resolved["ngram"].values, pa.string()),
+        "merchant_id": pa.array(resolved["merchant_id"].values, pa.int64()),
+        "support": pa.array(resolved["support"].values, pa.int32()),
+        "merchants": pa.array(resolved["merchants"].values, pa.int16()),
+        "last_date": pa.array(resolved["last_date"].dt.date.values, pa.date32()),
+    })
+    # The version is the content hash of the mappings, so rebuilding unchanged submissions gives the same artifact
+    version = hashlib.sha256(pd.util.hash_pandas_object(resolved[["ngram", "merchant_id"]], index=False)
+                             .values.tobytes()).hexdigest()[:16]
+    metadata = {
+        "version": version,
+        "built_at": datetime.now().isoformat(),
+        "resolution": resolution,
+        "files": len(dfs_reviewed_transactions),
+        "max_words": int(resolved["ngram"].str.count(" ").max() + 1) if len(resolved) else 0,
+    }
+    return table.replace_schema_metadata({b"ngram_lookup": json.dumps(metadata).encode()})
+
+
+def write_ngram_lookup(table, lookup_dir=NGRAM_LOOKUP_DIR):
+    """ Write a lookup table as a versioned, memory-mappable artifact and make it the latest version
+    :return: path of the artifact
+    """
+    version = json.loads(table.schema.metadata[b"ngram_lookup"])["version"]
+    os.makedirs(lookup_dir, exist_ok=True)
+    path = os.path.join(lookup_dir, f"{version}.arrow")
+    if not os.path.exists(path):
+        # Uncompressed, so the artifact can be memory-mapped
+        feather.write_feather(table, path + ".tmp", compression="uncompressed")
+        os.replace(path + ".tmp", path)
+    latest_path = os.path.join(lookup_dir, LATEST_VERSION_FILE)
+    with open(latest_path + ".tmp", "w") as file:
+        file.write(version)
+    os.replace(latest_path + ".tmp", latest_path)
+    return path
+
+
+class NgramLookup:
+    """ Memory-mapped ngram -> merchant lookup artifact. Ngrams are found by binary search on their sorted hashes,
+    and confirmed against the stored ngram, so loading it reads no data and lookups are vectorized.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.metadata = json.loads(table.schema.metadata[b"ngram_lookup"])
+        self.version = self.metadata["version"]
+        self.ngram_hashes = table.column("ngram_hash").to_numpy()
+        self.merchant_ids = table.column("merchant_id").to_numpy()
+        self.support = table.column("support").to_numpy()
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @classmethod
+    def load(cls, version=None, lookup_dir=NGRAM_LOOKUP_DIR):
+        version = version or get_latest_version(lookup_dir)
+        if version is None:
+            return None
+        return cls(feather.read_table(os.path.join(lookup_dir, f"{version}.arrow"), memory_map=True))
+
+    def find(self, ngrams):
+        """ Find normalized ngrams in the lookup
+        :param ngrams: array of normalized ngrams
+        :return: int64 array with the row of every ngram, -1 if it isn't in the lookup
+        """
+        ngrams = np.asarray(ngrams, dtype=object)
+        if not len(ngrams) or not len(self):
+            return np.full(len(ngrams), -1, dtype=np.int64)
+        hashes = hash_text(ngrams)
+        rows = np.searchsorted(self.ngram_hashes, hashes)
+        rows[rows == len(self)] = 0
+        found = self.ngram_hashes[rows] == hashes
+        # Hash collisions are ruled out by comparing the stored ngrams of the (few) found rows
+        candidates = np.flatnonzero(found)
+        stored = self.table.column("ngram").take(pa.array(rows[candidates])).to_numpy(zero_copy_only=False)
+        found[candidates[stored != ngrams[candidates]]] = False
+        return np.where(found, rows, -1)
+
+    def lookup(self, ngrams):
+        """ Get the merchant id of ngrams
+        :return: pd.Series of merchant ids (Int64, missing if the ngram isn't in the lookup)
+        """
+        rows = self.find(normalize_text(ngrams).values)
+        if not len(self):
+            return pd.Series(pd.NA, index=range(len(rows)), dtype="Int64")
+        return pd.Series(np.where(rows >= 0, self.merchant_ids[rows], 0), dtype="Int64").mask(rows < 0)
+
+    def match_descriptions(self, descriptions, max_words=MAX_NGRAM_WORDS):
+        """ Label descriptions with the merchant of the longest ngram (in words) they contain, the most supported
+        one on ties. Every word ngram of every distinct description is looked up in one vectorized pass.
+        :param descriptions: iterable of descriptions
+        :return: pd.DataFrame aligned with the descriptions: description, ngram, merchant_id (missing if unmatched)
+        """
+        descriptions = pd.Series(list(descriptions), dtype=object)
+        distinct = pd.Series(descriptions.dropna().unique(), dtype=object)
+        tokens = normalize_text(distinct.values).str.split().explode().dropna()
+        tokens = tokens[tokens != ""]
+        positions, words = tokens.index.to_numpy(), tokens.to_numpy(dtype=object)
+
+        candidates = []
+        max_words = min(max_words, self.metadata.get("max_words") or max_words)
+        for size in range(1, max_words + 1):
+            if len(words) < size:
+                break
+            starts = np.arange(len(words) - size + 1)
+            same_description = positions[starts] == positions[starts + size - 1]
+            starts = starts[same_description]
+            ngrams = pd.Series(words[starts], dtype=object)
+            for offset in range(1, size):
+                ngrams = ngrams + " " + words[starts + offset]
+            rows = self.find(ngrams.values)
+            matched = rows >= 0
+            candidates.append(pd.DataFrame({"position": positions[starts][matched], "size": size,
+                                            "ngram": ngrams.values[matched], "row": rows[matched]}))
+
+        matches = pd.concat(candidates, ignore_index=True) if candidates else \
+            pd.DataFrame(columns=["position", "size", "ngram", "row"])
+        matches["support"] = self.support[matches["row"].to_numpy(dtype=np.int64)]
+        best = matches.sort_values(["position", "size", "support"], ascending=[True, False, False]) \
+            .drop_duplicates("position").set_index("position")
+        labels = pd.DataFrame({"description": distinct})
+        labels["ngram"] = best["ngram"].reindex(labels.index)
+        labels["merchant_id"] = pd.Series(self.merchant_ids[best["row"].to_numpy(dtype=np.int64)],
+                                          index=best.index, dtype="Int64").reindex(labels.index)
+        return descriptions.to_frame("description").merge(labels, on="description", how="left")
+
+
+# Function to get the latest version of the lookup artifact, None if it was never built
+def get_latest_version(lookup_dir=NGRAM_LOOKUP_DIR):
+    latest_path = os.path.join(lookup_dir, LATEST_VERSION_FILE)
+    if not os.path.exists(latest_path):
+        return None
+    with open(latest_path) as file:
+        return file.read().strip() or None
+
+
+_ngram_lookup = None
+_ngram_lookup_lock = threading.Lock()
+
+
+# Function to get the process-wide lookup, reloaded when a new version is built; None if none was built yet
+def get_ngram_lookup(lookup_dir=NGRAM_LOOKUP_DIR):
+    global _ngram_lookup
+    with _ngram_lookup_lock:
+        version = get_latest_version(lookup_dir)
+        if version is not None and (_ngram_lookup is None or _ngram_lookup.version != version):
+            _ngram_lookup = NgramLookup.load(version, lookup_dir)
+        return _ngram_lookup
+
+
+def compile_ngram_lookup(notion_client, database_id, resolution="majority", lookup_dir=NGRAM_LOOKUP_DIR):
+    """ Build the lookup artifact from every reviewed transactions submission. Files whose merchant references
+    failed validation are left out.
+    :return: path of the artifact
+    """
+    data = DataManager().get_notion_data(notion_client, database_id)
+    pages = []
+    for record in DataManager().get_catalog(data).by_data_type('Reviewed Transactions'):
+        comments = (record.page['properties'].get('Validation Comment') or {}).get('multi_select') or []
+        if record.type == 'Submission' and "Unknown Merchant Reference" not in [comment['name'] for comment in comments]:
+            pages.append(record.page)
+    _, dfs_reviewed_transactions, _ = process_filtered_data(pages, get_ledger(), notion_client)
+    table = build_ngram_lookup(dfs_reviewed_transactions, resolution=resolution)
+    path = write_ngram_lookup(table, lookup_dir)
+    print(f"[compile_ngram_lookup] {table.num_rows} ngrams from {len(dfs_reviewed_transactions)} files: {path}")
+    return path
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Compile the ngram -> merchant lookup of the reviewed submissions")
+    parser.add_argument("--resolution", choices=RESOLUTIONS, default="majority",
+                        help="How an ngram mapped to several merchants is resolved")
+    parser.add_argument("--lookup-dir", default=NGRAM_LOOKUP_DIR)
+    parser.add_argument("--match", metavar="SOURCE_CSV",
+                        help="Label the descriptions of a source file with the latest lookup instead of compiling it")
+    parser.add_argument("--output", help="Where the labeled descriptions are written (default: <SOURCE_CSV>_labeled.csv)")
+    args = parser.parse_args()
+
+    if args.match:
+        lookup = get_ngram_lookup(args.lookup_dir)
+        if lookup is None:
+            parser.error(f"No lookup was compiled in {args.lookup_dir}")
+        labels = lookup.match_descriptions(pd.read_csv(args.match)["description"])
+        output = args.output or os.path.splitext(args.match)[0] + "_labeled.csv"
+        labels.to_csv(output, index=False)
+        print(f"[match_descriptions] {labels['merchant_id'].notna().sum()}/{len(labels)} descriptions matched with "
+              f"version {lookup.version}: {output}")
+        return
+
+    from notion_client import Client
+    notion_client = Client(auth=os.getenv("NOTION_TOKEN"))
+    print(compile_ngram_lookup(notion_client, os.getenv("DATABASE_ID"), resolution=args.resolution,
+                               lookup_dir=args.lookup_dir))
+
+
+if __name__ == "__main__":
+    main()
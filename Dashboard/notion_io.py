@@ -0,0 +1,141 @@
+import asyncio
+import os
+import threading
+from urllib.parse import urlsplit
+import httpx
+from notion_client import AsyncClient
+
+MAX_CONNECTIONS = 200
+MAX_KEEPALIVE_CONNECTIONS = 50
+MAX_CONNECTIONS_PER_HOST = 16
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+# Upper bound of a whole download, since the read timeout only applies between two chunks
+DOWNLOAD_TIMEOUT_SECONDS = 300
+NOTION_PAGE_SIZE = 100
+# Overridable to point the dashboard at a Notion stand-in, e.g. the load test harness
+NOTION_API_URL = os.getenv('NOTION_API_URL', "https://api.notion.com")
+
+
+class AsyncIOLayer:
+    """ asyncio-based I/O for Notion queries and file downloads.
+    One event loop runs in a background thread and owns a pooled HTTP client, so any thread can keep many
+    requests in flight through the sync adapters while every host is held to MAX_CONNECTIONS_PER_HOST.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_connections_per_host=MAX_CONNECTIONS_PER_HOST):
+        self.max_connections_per_host = max_connections_per_host
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-io-layer", daemon=True)
+        self._thread.start()
+        self._host_semaphores = {}
+        self._notion_clients = {}
+        self._http = self.run(self._create_http_client(max_connections))
+
+    async def _create_http_client(self, max_connections):
+        return httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+        )
+
+    # Function to run a coroutine on the I/O loop and wait for its result (the sync adapter)
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def _get_host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return self._host_semaphores[host]
+
+    # The Notion client gets its own connection pool, since AsyncClient sets the Notion base URL and
+    # Authorization header on the httpx client it is given
+    def _get_notion_client(self, auth):
+        if auth not in self._notion_clients:
+            notion_http = httpx.AsyncClient(limits=httpx.Limits(max_connections=self.max_connections_per_host))
+            self._notion_clients[auth] = AsyncClient(auth=auth, client=notion_http, base_url=NOTION_API_URL)
+        return self._notion_clients[auth]
+
+    async def iter_database_query(self, auth, database_id, **query):
+        """ Iterate over every page of a Notion database query, following the pagination cursor
+        :param auth: Notion integration token
+        :param database_id: Notion database id
+        :param query: filter/sorts of the query
+        """
+        notion = self._get_notion_client(auth)
+        start_cursor = None
+        while True:
+            if start_cursor:
+                query["start_cursor"] = start_cursor
+            async with self._get_host_semaphore(NOTION_API_URL):
+                response = await notion.databases.query(database_id=database_id, page_size=NOTION_PAGE_SIZE, **query)
+            for page in response["results"]:
+                yield page
+            if not response.get("has_more"):
+                break
+            start_cursor = response["next_cursor"]
+
+    async def query_database_async(self, auth, database_id, **query):
+        return [page async for page in self.iter_database_query(auth, database_id, **query)]
+
+    async def retrieve_page_async(self, auth, page_id):
+        async with self._get_host_semaphore(NOTION_API_URL):
+            return await self._get_notion_client(auth).pages.retrieve(page_id=page_id)
+
+    async def get_async(self, url, headers=None, timeout=DOWNLOAD_TIMEOUT_SECONDS):
+        """ Download a URL, streaming the body, within the per-host connection limit
+        :return: httpx.Response with the body read
+        :raises TimeoutError: when the whole download takes longer than timeout seconds
+        """
+        async with self._get_host_semaphore(url):
+            return await asyncio.wait_for(self._download(url, headers), timeout)
+
+    async def _download(self, url, headers):
+        async with self._http.stream("GET", url, headers=headers) as response:
+            await response.aread()
+            return response
+
+    async def get_many_async(self, urls, headers=None):
+        return await asyncio.gather(*(self.get_async(url, headers=headers) for url in urls), return_exceptions=True)
+
+
+_io_layer = None
+_io_layer_lock = threading.Lock()
+
+
+# Function to get the process-wide I/O layer
+def get_io_layer():
+    global _io_layer
+    with _io_layer_lock:
+        if _io_layer is None:
+            _io_layer = AsyncIOLayer()
+        return _io_layer
+
+
+# Function to get the integration token of a (sync) notion_client.Client
+def get_notion_auth(notion_client):
+    return notion_client.options.auth
+
+
+# Sync adapter: all the pages of a Notion database query
+def query_database(notion_client, database_id, **query):
+    io_layer = get_io_layer()
+    return io_layer.run(io_layer.query_database_async(get_notion_auth(notion_client), database_id, **query))
+
+
+# Sync adapter: retrieve one Notion page (e.g. to get fresh signed file URLs)
+def retrieve_page(notion_client, page_id):
+    io_layer = get_io_layer()
+    return io_layer.run(io_layer.retrieve_page_async(get_notion_auth(notion_client), page_id))
+
+
+# Sync adapter: download one URL
+def http_get(url, headers=None):
+    io_layer = get_io_layer()
+    return io_layer.run(io_layer.get_async(url, headers=headers))
+
+
+# Sync adapter: download many URLs concurrently (failed downloads are returned as exceptions)
+def http_get_many(urls, headers=None):
+    io_layer = get_io_layer()
+    return io_layer.run(io_layer.get_many_async(urls, headers=headers))
@@ -0,0 +1,134 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from notion_client import APIResponseError
+
+# Notion allows an average of three requests per second per integration
+NOTION_REQUESTS_PER_SECOND = 3
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+RETRYABLE_STATUSES = {409, 429, 500, 502, 503, 504}
+# Seconds the workers wait for their queued updates before invalidating the cached pages
+NOTION_FLUSH_TIMEOUT = 60
+
+
+class NotionWriteQueue:
+    """ Process-wide write-behind queue for Notion page property updates.
+    Pending updates are merged per page (a later value of a property replaces the earlier one), written by a
+    single background thread at the API rate limit, and retried with backoff on rate limiting and server errors.
+    """
+
+    def __init__(self, notion_client, requests_per_second=NOTION_REQUESTS_PER_SECOND, max_retries=MAX_RETRIES):
+        self.notion_client = notion_client
+        self.min_interval = 1 / requests_per_second
+        self.max_retries = max_retries
+        self.stats = {"enqueued": 0, "coalesced": 0, "written": 0, "retried": 0, "failed": 0}
+        self._pending = OrderedDict()
+        self._attempts = {}
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._last_request = 0.0
+        self._thread = threading.Thread(target=self._run, name="notion-write-queue", daemon=True)
+        self._thread.start()
+
+    def update_page(self, page_id, properties):
+        """ Queue a property update of a page, merged with any pending update of the same page
+        :param page_id: Notion page id
+        :param properties: Notion properties payload
+        """
+        with self._condition:
+            self.stats["enqueued"] += 1
+            if page_id in self._pending:
+                self.stats["coalesced"] += 1
+                self._pending[page_id].update(properties)
+            else:
+                self._pending[page_id] = dict(properties)
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """ Wait until every queued update is written (or dropped after its retries)
+        :return: True if the queue drained before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                page_id, properties = self._pending.popitem(last=False)
+                self._in_flight += 1
+            try:
+                self._write(page_id, properties)
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
+
+    def _wait_for_rate_limit(self):
+        wait = self._last_request + self.min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_request = time.monotonic()
+
+    def _write(self, page_id, properties):
+        self._wait_for_rate_limit()
+        try:
+            self.notion_client.pages.update(page_id=page_id, properties=properties)
+            self.stats["written"] += 1
+            self._attempts.pop(page_id, None)
+            print(f"[NotionWriteQueue] updated page {page_id}: {list(properties)}")
+        except Exception as e:
+            status = getattr(e, "status", None)
+            attempts = self._attempts.get(page_id, 0) + 1
+            if (isinstance(e, APIResponseError) and status not in RETRYABLE_STATUSES) or attempts > self.max_retries:
+                self.stats["failed"] += 1
+                self._attempts.pop(page_id, None)
+                print(f"[NotionWriteQueue] Error updating page {page_id}: {e}")
+                return
+            self._attempts[page_id] = attempts
+            self.stats["retried"] += 1
+            time.sleep(self._get_backoff(e, attempts))
+            self._requeue(page_id, properties)
+
+    # Function to get the backoff delay, honouring the Retry-After header of a 429 response
+    def _get_backoff(self, error, attempts):
+        headers = getattr(error, "headers", None) or {}
+        retry_after = headers.get("retry-after") if hasattr(headers, "get") else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    # Function to put a failed update back, under any newer pending values of the same page
+    def _requeue(self, page_id, properties):
+        with self._condition:
+            newer_properties = self._pending.pop(page_id, {})
+            self._pending[page_id] = {**properties, **newer_properties}
+            self._pending.move_to_end(page_id, last=False)
+            self._condition.notify_all()
+
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+# Function to get the process-wide Notion write queue
+def get_notion_write_queue(notion_client):
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = NotionWriteQueue(notion_client)
+        return _write_queue
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import streamlit as st
+from .page_catalog import load_page_catalog
+from .report import compute_source_report, get_source_files
+
+OVERVIEW_COLUMNS = ['Source', 'Total Transactions', 'Reviewed Transactions', 'Coverage (%)', 'Team Members',
+                    'Reviewed Files', 'Merchant Files', 'Duration (s)', 'Error']
+
+
+# Function to get the Notion pages that belong to a source, so every worker only receives its own pages. The catalog
+# indexes the titles once, and pages with an empty or missing title are left out
+def get_source_pages(data, source_title):
+    return [record.page for record in load_page_catalog(data).by_title(source_title)]
+
+
+def compute_source_overview(source_pages, source_file, start_date, end_date):
+    """ Compute the progress summary of one source (runs inside a worker process)
+    :param source_pages: Notion pages of the source (the source page and its submissions)
+    :param source_file: (source_title, source_file_url, source_filename)
+    :param start_date: date
+    :param end_date: date
+    :return: dict with one row of the overview table
+    """
+    started = time.perf_counter()
+    row = {'Source': source_file[0], 'Total Transactions': 0, 'Reviewed Transactions': 0, 'Coverage (%)': 0.0,
+           'Team Members': 0, 'Reviewed Files': 0, 'Merchant Files': 0, 'Error': None}
+    try:
+        report = compute_source_report(source_pages, source_file, start_date, end_date)
+        row.update({
+            'Total Transactions': report["total_transactions_count"],
+            'Reviewed Transactions': report["overall_reviewed_transactions_count"],
+            'Coverage (%)': report["overall_reviewed_transactions_progress"],
+            'Team Members': len({member_name for member_name, _, _ in report["reviewed_transactions_files"]}),
+            'Reviewed Files': len(report["reviewed_transactions_files"]),
+            'Merchant Files': len(report["merchants_files"]),
+        })
+    except Exception as e:
+        print(f"[compute_source_overview] Error computing {source_file[0]}: {e}")
+        row['Error'] = str(e)
+    row['Duration (s)'] = round(time.perf_counter() - started, 2)
+    return row
+
+
+def compute_sources_overview(data, start_date, end_date, max_workers=None):
+    """ Compute the progress of every source in parallel across a process pool
+    :param data: list of Notion pages
+    :param start_date: date
+    :param end_date: date
+    :param max_workers: number of worker processes, the number of cores if None
+    :return: dataframe with one row per source
+    """
+    source_files = get_source_files(data)
+    if not source_files:
+        return pd.DataFrame(columns=OVERVIEW_COLUMNS)
+    max_workers = min(max_workers or os.cpu_count() or 1, len(source_files))
+
+    rows = []
+    # Spawned workers don't inherit the Streamlit server threads of the parent process
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(compute_source_overview, get_source_pages(data, source_file[0]), source_file,
+                                   start_date, end_date)
+                   for source_file in source_files]
+        for future in as_completed(futures):
+            rows.append(future.result())
+
+    return pd.DataFrame(rows, columns=OVERVIEW_COLUMNS).sort_values("Coverage (%)", ascending=False,
+                                                                   ignore_index=True)
+
+
+# Cached overview stage, shared by every session looking at the same pages and date range
+@st.cache_data(show_spinner="Computing progress for every source...")
+def load_sources_overview(_data, pages_key, start_date, end_date):
+    return compute_sources_overview(_data, start_date, end_date)
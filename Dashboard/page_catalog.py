@@ -0,0 +1,119 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+
+# Number of fetched page lists whose catalog is kept (a new list is fetched when the Notion query cache expires)
+PAGE_CATALOGS_MAX_ENTRIES = 4
+
+
+class PageRecord:
+    """ Compact typed view of a "Data Hub Progress" Notion page """
+    __slots__ = ("page_id", "title", "type", "data_type", "date", "team_member", "file_name", "last_edited_time",
+                 "page")
+
+    def __init__(self, page):
+        properties = page["properties"]
+        self.page_id = page.get("id")
+        self.last_edited_time = page.get("last_edited_time")
+        self.title = _get_value(lambda: properties["Title"]["title"][0]["text"]["content"])
+        self.type = _get_value(lambda: properties["Type"]["select"]["name"])
+        self.data_type = _get_value(lambda: properties["Data Type"]["select"]["name"])
+        self.team_member = _get_value(lambda: properties["Team Member"]["select"]["name"])
+        self.file_name = _get_value(lambda: properties["Files & media"]["files"][0]["name"])
+        date_start = _get_value(lambda: properties["Date"]["date"]["start"])
+        self.date = datetime.strptime(date_start[:10], "%Y-%m-%d").date() if date_start else None
+        self.page = page
+
+    # The signed file URL is read from the page on every access, since it rotates
+    @property
+    def file_url(self):
+        return _get_value(lambda: self.page["properties"]["Files & media"]["files"][0]["file"]["url"])
+
+
+# Function to read a nested page property, None if any level is missing
+def _get_value(getter):
+    try:
+        return getter()
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+class PageCatalog:
+    """ Pages parsed once, with hash indexes on title/type/data type and a sorted date index per title """
+
+    def __init__(self, pages):
+        self.records = [PageRecord(page) for page in pages]
+        self._by_title = {}
+        self._by_type = {}
+        self._by_data_type = {}
+        for position, record in enumerate(self.records):
+            self._by_title.setdefault(record.title, []).append(position)
+            self._by_type.setdefault(record.type, []).append(position)
+            self._by_data_type.setdefault(record.data_type, []).append(position)
+
+        # Per title, the dated record positions sorted by date, so date ranges are two binary searches
+        self._dates_by_title = {}
+        for title, positions in self._by_title.items():
+            dated = sorted((self.records[position].date, position) for position in positions
+                           if self.records[position].date is not None)
+            self._dates_by_title[title] = ([date for date, _ in dated], [position for _, position in dated])
+
+    def __len__(self):
+        return len(self.records)
+
+    def by_title(self, title):
+        return [self.records[position] for position in self._by_title.get(title, [])]
+
+    def by_type(self, page_type):
+        return [self.records[position] for position in self._by_type.get(page_type, [])]
+
+    def by_data_type(self, data_type):
+        return [self.records[position] for position in self._by_data_type.get(data_type, [])]
+
+    def by_date_range(self, title, start_date, end_date, exclude_type='Source'):
+        """ Get the records of a title dated within [start_date, end_date]
+        :param title: source title
+        :param start_date: date
+        :param end_date: date
+        :param exclude_type: page type to leave out (the source page itself)
+        :return: list of PageRecord sorted by date, with a type and a data type
+        """
+        dates, positions = self._dates_by_title.get(title, ([], []))
+        first, last = bisect_left(dates, start_date), bisect_right(dates, end_date)
+        records = [self.records[position] for position in positions[first:last]]
+        # Pages without a Type or Data Type can't be processed, so they are left out
+        return [record for record in records if record.type is not None and record.data_type is not None
+                and record.type != exclude_type]
+
+    @property
+    def source_files(self):
+        return [(record.title, record.file_url, record.file_name) for record in self.by_type('Source')]
+
+
+# Function to get a cheap key of the Notion pages across reruns (signed file URLs rotate): adding, deleting or
+# editing a page changes the number of pages or the latest edit time
+def get_pages_key(data):
+    return len(data), max((item.get("last_edited_time") or "" for item in data), default="")
+
+
+_page_catalogs = OrderedDict()
+_page_catalogs_lock = threading.Lock()
+
+
+# Function to get the catalog of a fetched page list. The list is the shared value of the Notion query cache, so its
+# catalog is built once per fetch and found by identity, without hashing the pages on every call
+def load_page_catalog(data):
+    with _page_catalogs_lock:
+        entry = _page_catalogs.get(id(data))
+        # The list is kept with its catalog, so its id can't be reused by another list while the entry exists
+        if entry is not None and entry[0] is data:
+            _page_catalogs.move_to_end(id(data))
+            return entry[1]
+    print("[load_page_catalog] pages: ", len(data))
+    catalog = PageCatalog(data)
+    with _page_catalogs_lock:
+        _page_catalogs[id(data)] = (data, catalog)
+        while len(_page_catalogs) > PAGE_CATALOGS_MAX_ENTRIES:
+            _page_catalogs.popitem(last=False)
+    return catalog
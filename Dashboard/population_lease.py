@@ -0,0 +1,124 @@
+import os
+import socket
+import threading
+import uuid
+
+LEASE_SECONDS = int(os.getenv('POPULATION_LEASE_SECONDS', 15 * 60))
+HEARTBEAT_SECONDS = LEASE_SECONDS / 3
+# Advisory lock keys shared by every population worker
+MERCHANT_ID_LOCK_KEY = 731_001
+
+
+# Function to get a worker id that is unique across hosts and processes
+def get_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class EntryLeaseManager:
+    """ Claims Notion entries for one population worker through the population_lease control table.
+    A claim is a lease that the heartbeat thread keeps extending; when a worker dies its leases expire and
+    another worker can claim the entries again. Entries marked done are never claimed again.
+    """
+
+    def __init__(self, connect, worker_id=None, lease_seconds=LEASE_SECONDS):
+        self.worker_id = worker_id or get_worker_id()
+        self.lease_seconds = lease_seconds
+        self._conn = connect()
+        self._conn.autocommit = True
+        self._lock = threading.Lock()
+        self._held = set()
+        self._stop = threading.Event()
+        self._heartbeat_thread = None
+        self._create_table()
+
+    def _execute(self, query, params=()):
+        with self._lock, self._conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall() if cur.description else None
+
+    def _create_table(self):
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS population_lease (
+                entry_id TEXT PRIMARY KEY,
+                worker_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                lease_expires_at TIMESTAMPTZ NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+
+    def claim(self, entry_id):
+        """ Claim an entry, unless another worker holds a live lease on it or it is already done
+        :return: True if this worker now holds the entry
+        """
+        rows = self._execute("""
+            INSERT INTO population_lease (entry_id, worker_id, status, lease_expires_at)
+            VALUES (%s, %s, 'claimed', now() + make_interval(secs => %s))
+            ON CONFLICT (entry_id) DO UPDATE
+                SET worker_id = EXCLUDED.worker_id,
+                    status = 'claimed',
+                    attempts = population_lease.attempts + 1,
+                    lease_expires_at = EXCLUDED.lease_expires_at,
+                    updated_at = now()
+                WHERE population_lease.status <> 'done' AND population_lease.lease_expires_at < now()
+            RETURNING entry_id
+        """, (entry_id, self.worker_id, self.lease_seconds))
+        if rows:
+            self._held.add(entry_id)
+            return True
+        return False
+
+    def release(self, entry_id, status):
+        """ Release a held entry as 'done' (never claimed again), or 'failed' or 'waiting' (claimable again right
+        away, 'waiting' when it wasn't populated because it waits for entries of other workers)
+        """
+        self._execute("""
+            UPDATE population_lease SET status = %s, lease_expires_at = now(), updated_at = now()
+            WHERE entry_id = %s AND worker_id = %s
+        """, (status, entry_id, self.worker_id))
+        self._held.discard(entry_id)
+
+    def get_statuses(self, entry_ids):
+        """ Get the lease status of entries ('claimed', 'done', 'failed' or 'waiting')
+        :return: dict of entry id -> status, for the entries ever claimed
+        """
+        if not entry_ids:
+            return {}
+        rows = self._execute("SELECT entry_id, status FROM population_lease WHERE entry_id = ANY(%s)",
+                             (list(entry_ids),))
+        return dict(rows)
+
+    def heartbeat(self):
+        if not self._held:
+            return
+        self._execute("""
+            UPDATE population_lease SET lease_expires_at = now() + make_interval(secs => %s), updated_at = now()
+            WHERE worker_id = %s AND entry_id = ANY(%s) AND status = 'claimed'
+        """, (self.lease_seconds, self.worker_id, list(self._held)))
+
+    def _run_heartbeat(self):
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"[EntryLeaseManager] Heartbeat error: {e}")
+
+    def __enter__(self):
+        self._stop.clear()
+        self._heartbeat_thread = threading.Thread(target=self._run_heartbeat, name="population-lease-heartbeat",
+                                                  daemon=True)
+        self._heartbeat_thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        # Entries still held (e.g. the run was interrupted) become claimable again
+        for entry_id in list(self._held):
+            try:
+                self.release(entry_id, status="failed")
+            except Exception as e:
+                print(f"[EntryLeaseManager] Error releasing {entry_id}: {e}")
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+POPULATION_WORKERS = int(os.getenv('POPULATION_WORKERS', 4))
+MERCHANT_NAME_COLUMN = "name"
+TRANSACTION_MERCHANT_COLUMN = "extracted_merchant_for_review"
+
+
+class PopulationTask:
+    """ One Notion submission entry to populate, with the entries it has to wait for """
+
+    def __init__(self, entry, data_type, df):
+        self.entry = entry
+        self.entry_id = entry["id"]
+        self.data_type = data_type
+        self.df = df
+        self.file_name = entry['properties']['Files & media']['files'][0]['name']
+        self.dependencies = set()
+        self.dependents = set()
+        self.started_at = None
+        self.finished_at = None
+        self.status = "pending"
+        self.error = None
+
+    @property
+    def duration(self):
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+
+# Function to get the distinct non-empty string values of a column
+def get_column_values(df, column):
+    if df is None or column not in df.columns:
+        return set()
+    return set(df[column].dropna().astype(str).str.strip()) - {""}
+
+
+def find_merchant_dependencies(tasks):
+    """ Find the merchant tasks whose merchant names every transactions task references
+    :param tasks: list of PopulationTask
+    :return: dict of transactions entry id -> set of merchant entry ids
+    """
+    merchant_tasks_by_name = {}
+    for task in tasks:
+        if task.data_type == "Merchants":
+            for merchant_name in get_column_values(task.df, MERCHANT_NAME_COLUMN):
+                merchant_tasks_by_name.setdefault(merchant_name, set()).add(task.entry_id)
+
+    dependencies = {}
+    for task in tasks:
+        if task.data_type != "Reviewed Transactions":
+            continue
+        dependencies[task.entry_id] = set()
+        for merchant_name in get_column_values(task.df, TRANSACTION_MERCHANT_COLUMN):
+            dependencies[task.entry_id].update(merchant_tasks_by_name.get(merchant_name, ()))
+    return dependencies
+
+
+def build_population_dag(tasks):
+    """ Link every transactions task to the merchant tasks whose merchant names it references
+    :param tasks: list of PopulationTask
+    :return: dict of entry id -> PopulationTask
+    """
+    tasks_by_id = {task.entry_id: task for task in tasks}
+    for entry_id, dependency_ids in find_merchant_dependencies(tasks).items():
+        tasks_by_id[entry_id].dependencies.update(dependency_ids)
+        for dependency_id in dependency_ids:
+            tasks_by_id[dependency_id].dependents.add(entry_id)
+    return tasks_by_id
+
+
+# Function to get the longest chain of dependent tasks by duration
+def get_critical_path(tasks_by_id):
+    finish_times = {}
+    previous = {}
+
+    def finish_time(entry_id):
+        if entry_id not in finish_times:
+            task = tasks_by_id[entry_id]
+            best_dependency = max(task.dependencies, key=finish_time, default=None)
+            previous[entry_id] = best_dependency
+            finish_times[entry_id] = task.duration + (finish_time(best_dependency) if best_dependency else 0.0)
+        return finish_times[entry_id]
+
+    if not tasks_by_id:
+        return [], 0.0
+    last_id = max(tasks_by_id, key=finish_time)
+    path = []
+    entry_id = last_id
+    while entry_id is not None:
+        path.append(entry_id)
+        entry_id = previous[entry_id]
+    return list(reversed(path)), finish_times[last_id]
+
+
+class PopulationScheduler:
+    """ Runs population tasks on a thread pool as soon as the merchant entries they depend on are done """
+
+    def __init__(self, run_task, max_workers=POPULATION_WORKERS):
+        self.run_task = run_task
+        self.max_workers = max_workers
+
+    def run(self, tasks):
+        """ Run every task, respecting the dependencies
+        :param tasks: list of PopulationTask
+        :return: dict with the per-entry durations and the critical path summary
+        """
+        tasks_by_id = build_population_dag(tasks)
+        remaining_dependencies = {entry_id: len(task.dependencies) for entry_id, task in tasks_by_id.items()}
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="population") as executor:
+            running = {}
+
+            def submit_ready():
+                for entry_id, count in list(remaining_dependencies.items()):
+                    if count == 0:
+                        del remaining_dependencies[entry_id]
+                        running[executor.submit(self._run_task, tasks_by_id[entry_id])] = entry_id
+
+            submit_ready()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = tasks_by_id[running.pop(future)]
+                    # Dependents still run when a merchant entry fails, as they did in the sequential pipeline
+                    for dependent_id in task.dependents:
+                        remaining_dependencies[dependent_id] -= 1
+                submit_ready()
+
+        return self.get_report(tasks_by_id, time.perf_counter() - started)
+
+    def _run_task(self, task):
+        task.started_at = time.perf_counter()
+        task.status = "running"
+        try:
+            self.run_task(task)
+            task.status = "done"
+        except Exception as e:
+            task.status = "failed"
+            task.error = str(e)
+            print(f"[PopulationScheduler] Error populating {task.file_name}: {e}")
+        finally:
+            task.finished_at = time.perf_counter()
+            print(f"[PopulationScheduler] {task.status} {task.data_type} | {task.file_name} | "
+                  f"{task.duration:.1f}s | worker: {threading.current_thread().name}")
+
+    def get_report(self, tasks_by_id, wall_time):
+        critical_path, critical_path_duration = get_critical_path(tasks_by_id)
+        report = {
+            "entries": [{
+                "entry_id": task.entry_id,
+                "file_name": task.file_name,
+                "data_type": task.data_type,
+                "status": task.status,
+                "error": task.error,
+                "duration": round(task.duration, 2),
+                "dependencies": sorted(task.dependencies),
+            } for task in tasks_by_id.values()],
+            "wall_time": round(wall_time, 2),
+            "total_task_time": round(sum(task.duration for task in tasks_by_id.values()), 2),
+            "critical_path": [tasks_by_id[entry_id].file_name for entry_id in critical_path],
+            "critical_path_duration": round(critical_path_duration, 2),
+        }
+        print(f"[PopulationScheduler] {len(tasks_by_id)} entries in {report['wall_time']}s "
+              f"(task time {report['total_task_time']}s) | critical path {report['critical_path_duration']}s: "
+              f"{' -> '.join(report['critical_path'])}")
+        return report
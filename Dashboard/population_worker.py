@@ -0,0 +1,30 @@
+import argparse
+import os
+import time
+from dotenv import load_dotenv
+from notion_client import Client
+from .transaction_population import TxnPopulationManager
+
+POPULATION_INTERVAL_SECONDS = 60 * 60 * 2
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run a standalone Data Hub population worker")
+    parser.add_argument("--once", action="store_true", help="Run the population pipeline once and exit")
+    parser.add_argument("--interval", type=int, default=POPULATION_INTERVAL_SECONDS,
+                        help="Seconds between population runs")
+    args = parser.parse_args()
+
+    notion_client = Client(auth=os.getenv("NOTION_TOKEN"))
+    txn_population_manager = TxnPopulationManager(notion_client=notion_client, database_id=os.getenv("DATABASE_ID"))
+    while True:
+        txn_population_manager.run_population_pipeline()
+        txn_population_manager.notion_writer.flush()
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import pandas as pd
+import streamlit as st
+from .utils import find_overlapping_descriptions, get_submissions_key, STAGE_CACHE_MAX_ENTRIES
+
+
+# Function to pick the merchant id column used by a reviewed transactions file
+def get_merchant_id_column(member_df):
+    merchant_id_col = "merchant_id"
+    if merchant_id_col not in member_df:
+        merchant_id_col = "merchant_Id"
+    if merchant_id_col not in member_df:
+        merchant_id_col = "Merchant ID"
+    return merchant_id_col
+
+
+# Function to pick the ngram column used by a reviewed transactions file
+def get_ngram_column(member_df):
+    ngram_col = "key"
+    if ngram_col not in member_df.columns.tolist():
+        if "extracted_merchant_for_review" in member_df.columns.tolist():
+            ngram_col = "extracted_merchant_for_review"
+        elif "merchant_for_review" in member_df.columns.tolist():
+            ngram_col = "merchant_for_review"
+    return ngram_col
+
+
+def compute_team_progress(source_df, dfs_reviewed_transactions, validated_descriptions=frozenset()):
+    """ Compute the team progress of the reviewed transactions against a source file
+    :param source_df: dataframe with a "description" column
+    :param dfs_reviewed_transactions: list of (member_name, member_filename, submission_date, member_df)
+    :param validated_descriptions: descriptions already validated in the database before review, counted as covered
+    and not credited to the members
+    :return: dict with the overall counts and the progress dataframes
+    """
+    team_progress_transactions = {}
+    overall_reviewed_transactions = []
+    team_progress_ngrams = {}
+    team_progress_ngram_transactions = {}
+    overlapped_members = {}
+
+    source_descriptions = source_df["description"]
+    total_transactions_count = len(source_descriptions)
+
+    # This is a list of dataframes for reviewed transactions used to check for overlap in reviews
+    overall_reviewed_ngram_transactions_dfs = [member_df for
+                                               member_name, member_filename, submission_date, member_df in
+                                               dfs_reviewed_transactions]
+    unique_overlapped_reviewed_transactions = find_overlapping_descriptions(
+        dfs=overall_reviewed_ngram_transactions_dfs)
+    prevalidated_transactions = source_descriptions.isin(validated_descriptions)
+    overlapped_reviewed_transactions = source_descriptions[
+        source_descriptions.isin(unique_overlapped_reviewed_transactions) & ~prevalidated_transactions].values.tolist()
+    overlapped_reviewed_transactions_count = len(overlapped_reviewed_transactions)
+    overlapped_reviewed_transactions_set = set(overlapped_reviewed_transactions)
+
+    for member_name, member_filename, submission_date, member_df in dfs_reviewed_transactions:
+        # The submitted dataframes are shared between reruns, so the overlap flag is kept as a mask
+        overlapping_txn = member_df['description'].isin(overlapped_reviewed_transactions_set)
+        prevalidated_txn = member_df['description'].isin(validated_descriptions)
+        member_reviewed_transactions = member_df[~overlapping_txn & ~prevalidated_txn]['description'].values.tolist()
+        for description in member_df[overlapping_txn]['description'].unique():
+            overlapped_members.setdefault(description, set()).add(member_name)
+
+        merchant_id_col = get_merchant_id_column(member_df)
+        ngram_col = get_ngram_column(member_df)
+        invalid_ngram_query = (
+                (member_df[merchant_id_col].isin([0, "0", "?"])) |
+                (member_df[merchant_id_col].isna())
+        )
+        # Member Valid Ngrams
+        member_valid_ngrams = member_df[~invalid_ngram_query][ngram_col].unique().tolist()
+
+        # Member Invalid Ngrams
+        member_invalid_ngrams = member_df[invalid_ngram_query][ngram_col].unique().tolist()
+
+        # Valid Ngrams Transactions and Coverage
+        member_valid_ngrams_transactions = member_df[~invalid_ngram_query]["description"]
+        member_valid_ngrams_transactions_coverage = len(member_valid_ngrams_transactions) / len(member_df)
+
+        # Invalid Ngrams Transactions and Coverage
+        member_invalid_ngrams_transactions = member_df[invalid_ngram_query]["description"]
+        member_invalid_ngrams_transactions_coverage = len(member_invalid_ngrams_transactions) / len(member_df)
+
+        # Number of merchants
+        number_of_merchants = member_df[~invalid_ngram_query][ngram_col].nunique()
+
+        # Number of new merchants
+        number_of_new_merchants = member_df[
+            (~member_df[merchant_id_col].isna()) &
+            (member_df[merchant_id_col].astype(str).str.startswith("n-"))
+            ][ngram_col].nunique()
+
+        # Store the calculated metrics per member, date and file
+        team_progress_ngram_transactions.setdefault(member_name, {}).setdefault(submission_date, {})[
+            member_filename] = {
+            "valid_ngrams_transactions": len(member_valid_ngrams_transactions),
+            "invalid_ngrams_transactions": len(member_invalid_ngrams_transactions),
+            "valid_ngrams_transactions_coverage": member_valid_ngrams_transactions_coverage,
+            "invalid_ngrams_transactions_coverage": member_invalid_ngrams_transactions_coverage,
+            "number_of_merchants": number_of_merchants,
+            "number_of_new_merchants": number_of_new_merchants
+        }
+
+        # Calculate individual progress
+        reviewed_transactions_count = int(source_descriptions.isin(member_reviewed_transactions).sum())
+        team_progress_transactions[member_name] = team_progress_transactions.get(member_name,
+                                                                                 0) + reviewed_transactions_count
+
+        if member_name not in team_progress_ngrams:
+            team_progress_ngrams[member_name] = {
+                "valid_ngrams": len(member_valid_ngrams),
+                "invalid_ngrams": len(member_invalid_ngrams)
+            }
+        else:
+            team_progress_ngrams[member_name]["valid_ngrams"] += len(member_valid_ngrams)
+            team_progress_ngrams[member_name]["invalid_ngrams"] += len(member_invalid_ngrams)
+
+        # Update overall reviewed transactions
+        overall_reviewed_transactions += member_reviewed_transactions
+
+    # Update overall reviewed transactions by adding the overlapped transactions if any
+    overall_reviewed_transactions += overlapped_reviewed_transactions
+
+    # Calculate overall progress, the already validated transactions being covered without review
+    prevalidated_transactions_count = int(prevalidated_transactions.sum())
+    overall_reviewed_transactions_count = int((source_descriptions.isin(overall_reviewed_transactions) |
+                                               prevalidated_transactions).sum())
+    overall_reviewed_transactions_progress = (overall_reviewed_transactions_count / total_transactions_count) * 100
+
+    progress_df_transactions = pd.DataFrame(list(team_progress_transactions.items()),
+                                            columns=['Team Member', 'Reviewed Transactions'])
+    if overlapped_reviewed_transactions:
+        progress_df_transactions.loc[-1, "Team Member"] = "Overlapped Reviewed Transactions"
+        progress_df_transactions.loc[-1, "Reviewed Transactions"] = overlapped_reviewed_transactions_count
+    if prevalidated_transactions_count:
+        progress_df_transactions.loc[-2, "Team Member"] = "Previously Validated Transactions"
+        progress_df_transactions.loc[-2, "Reviewed Transactions"] = prevalidated_transactions_count
+    progress_df_transactions['Coverage (%)'] = (progress_df_transactions[
+                                                    'Reviewed Transactions'] / total_transactions_count) * 100
+
+    # Create Ngram progress DataFrame
+    ngrams_rows = [(member, info['valid_ngrams'], info['invalid_ngrams']) for member, info in
+                   team_progress_ngrams.items()]
+    progress_df_ngrams = pd.DataFrame(ngrams_rows, columns=['Team Member', 'Valid Ngrams', 'Invalid Ngrams'])
+    progress_df_ngrams["Total Ngrams"] = progress_df_ngrams["Valid Ngrams"] + progress_df_ngrams["Invalid Ngrams"]
+
+    df_ngrams, df_merchants = flatten_ngram_transactions_progress(team_progress_ngram_transactions)
+
+    # Overlapped descriptions with their number of source transactions and the members who reviewed them
+    overlapped_counts = pd.Series(overlapped_reviewed_transactions, dtype=object).value_counts()
+    overlapped_transactions_df = pd.DataFrame({
+        "description": overlapped_counts.index,
+        "Transactions": overlapped_counts.values,
+        "Team Members": [", ".join(sorted(overlapped_members.get(description, ()))) for description in
+                         overlapped_counts.index],
+    })
+
+    return {
+        "total_transactions_count": total_transactions_count,
+        "overall_reviewed_transactions_count": overall_reviewed_transactions_count,
+        "overall_reviewed_transactions_progress": overall_reviewed_transactions_progress,
+        "prevalidated_transactions_count": prevalidated_transactions_count,
+        "progress_df_transactions": progress_df_transactions,
+        "progress_df_ngrams": progress_df_ngrams,
+        "df_ngrams": df_ngrams,
+        "df_merchants": df_merchants,
+        "overlapped_transactions_df": overlapped_transactions_df,
+    }
+
+
+# Function to flatten the nested member/date/file metrics into the ngrams and merchants dataframes
+def flatten_ngram_transactions_progress(team_progress_ngram_transactions):
+    data_ngrams = []
+    data_merchants = []
+
+    for member_name, dates in team_progress_ngram_transactions.items():
+        for date, files in dates.items():
+            for filename, metrics in files.items():
+                # Data for ngrams transactions
+                data_ngrams.append({
+                    "Team Member": member_name,
+                    "Date": date,
+                    "File": filename,
+                    "valid_ngrams_transactions": metrics["valid_ngrams_transactions"],
+                    "invalid_ngrams_transactions": metrics["invalid_ngrams_transactions"],
+                    "valid_ngrams_transactions_coverage": metrics["valid_ngrams_transactions_coverage"],
+                    "invalid_ngrams_transactions_coverage": metrics["invalid_ngrams_transactions_coverage"]
+                })
+                # Data for merchants
+                data_merchants.append({
+                    "Team Member": member_name,
+                    "Date": date,
+                    "File": filename,
+                    "number_of_merchants": metrics["number_of_merchants"],
+                    "number_of_new_merchants": metrics["number_of_new_merchants"]
+                })
+
+    df_ngrams = pd.DataFrame(data_ngrams, columns=["Team Member", "Date", "File", "valid_ngrams_transactions",
+                                                   "invalid_ngrams_transactions",
+                                                   "valid_ngrams_transactions_coverage",
+                                                   "invalid_ngrams_transactions_coverage"])
+    df_merchants = pd.DataFrame(data_merchants, columns=["Team Member", "Date", "File", "number_of_merchants",
+                                                         "number_of_new_merchants"])
+
+    # Convert the Date columns to datetime type
+    df_ngrams['Date'] = pd.to_datetime(df_ngrams['Date'])
+    df_merchants['Date'] = pd.to_datetime(df_merchants['Date'])
+    return df_ngrams, df_merchants
+
+
+# Cached computation stage: keyed by the source and submission keys and file versions, not by the (unhashed)
+# dataframes, so the results are shared by every session and widget rerun that looks at the same files
+@st.cache_data(show_spinner=False, max_entries=STAGE_CACHE_MAX_ENTRIES)
+def load_team_progress(_source_df, _dfs_reviewed_transactions, source_key, submissions_key,
+                       _validated_descriptions=frozenset(), validated_key=None, source_version=None):
+    print("[load_team_progress] computing: ", source_key)
+    return compute_team_progress(_source_df, _dfs_reviewed_transactions,
+                                 validated_descriptions=_validated_descriptions)
@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import re
+import time
+from datetime import datetime, date, timedelta
+import pandas as pd
+import streamlit as st
+from dotenv import load_dotenv
+from .controller import DataManager
+from .dashboard_visualization import DashboardVisualization
+from .progress import compute_team_progress, get_submissions_key
+from .validated_transactions import load_validated_descriptions
+from .ledger import get_ledger
+from .utils import process_filtered_data, read_file_by_key, compute_new_merchants_progress, \
+    compute_near_duplicate_merchants, fetch_notion_data, get_page_url_refresher
+
+REPORTS_DIR = "reports"
+REPORT_DATAFRAMES = ["progress_df_transactions", "progress_df_ngrams", "df_ngrams", "df_merchants",
+                     "collected_merchants_df", "progress_df_merchants", "overlapped_transactions_df",
+                     "near_duplicate_merchants_df"]
+VALIDATION_STATUS_FILE = "validation_status.parquet"
+NIGHTLY_RUN_HOUR = 2
+
+
+# Function to get the default dashboard date range (start of the year until today)
+def get_default_date_range():
+    today = datetime.now().date()
+    return today.replace(month=1, day=1), today
+
+
+# Function to turn a source title into a directory name
+def slugify(value):
+    # Leading dots are stripped too, so a title can't name a parent or hidden directory
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(value)).strip("_.") or "source"
+
+
+# Function to get the directory that holds the report of a source for a date range
+def get_report_dir(source_title, start_date, end_date, output_dir=REPORTS_DIR):
+    return os.path.join(output_dir, slugify(source_title), f"{start_date.isoformat()}_{end_date.isoformat()}")
+
+
+# Function to list the (title, url, filename) of every source in the Notion data
+def get_source_files(data):
+    return [(item['properties']['Title']['title'][0]['text']['content'],
+             item['properties']['Files & media']['files'][0]['file']['url'],
+             item['properties']['Files & media']['files'][0]['name'])
+            for item in data if item['properties']['Type']['select']['name'] == 'Source']
+
+
+def compute_source_report(data, source_file, start_date, end_date, ledger=None, notion_client=None):
+    """ Compute the full team-progress report of one source for a date range, without any Streamlit output
+    :param data: list of Notion pages
+    :param source_file: (source_title, source_file_url, source_filename)
+    :param start_date: date
+    :param end_date: date
+    :param ledger: processed files ledger, the process-wide ledger if not given
+    :param notion_client: Notion client used to re-sign expired file URLs, if given
+    :return: dict with the summary and the report dataframes
+    """
+    source_title, source_file_url, source_filename = source_file
+    ledger = ledger or get_ledger()
+    filtered_data = DataManager().filter_data_by_datae_range(data, start_date=start_date, end_date=end_date,
+                                                             source_title=source_title)
+    dfs_new_merchants, dfs_reviewed_transactions, dfs_ngrams = process_filtered_data(filtered_data, ledger,
+                                                                                     notion_client)
+    source_page = next((item for item in data if item['properties']['Type']['select']['name'] == 'Source'
+                        and item['properties']['Title']['title'][0]['text']['content'] == source_title), None)
+    source_page_id = source_page['id'] if source_page else None
+    source_key = f"{source_title}_{source_filename}"
+    source_df = read_file_by_key(source_file_url, source_key,
+                                 refresh_url=get_page_url_refresher(notion_client, source_page_id),
+                                 tags={f"source:{source_title}", "data_type:Source", f"file:{source_key}"})
+
+    report = {
+        "source_title": source_title,
+        "source_filename": source_filename,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "generated_at": datetime.now().isoformat(),
+        "reviewed_transactions_files": [list(key) for key in get_submissions_key(dfs_reviewed_transactions)],
+        "merchants_files": [list(key) for key in get_submissions_key(dfs_new_merchants)],
+        "total_transactions_count": len(source_df),
+        "overall_reviewed_transactions_count": 0,
+        "overall_reviewed_transactions_progress": 0.0,
+    }
+    validated_descriptions = load_validated_descriptions(source_df, (source_title, source_filename), source_page)
+    report["prevalidated_transactions_count"] = int(source_df["description"].isin(validated_descriptions).sum())
+    if dfs_reviewed_transactions:
+        report.update(compute_team_progress(source_df, dfs_reviewed_transactions,
+                                            validated_descriptions=validated_descriptions))
+    if dfs_new_merchants:
+        report["collected_merchants_df"], report["progress_df_merchants"] = compute_new_merchants_progress(
+            dfs_new_merchants)
+        report["near_duplicate_merchants_df"] = compute_near_duplicate_merchants(dfs_new_merchants)
+    return report
+
+
+# Function to write a computed report as JSON/Parquet data plus static Plotly HTML charts
+def write_report(report, report_dir, visualizer=None):
+    visualizer = visualizer or DashboardVisualization()
+    charts_dir = os.path.join(report_dir, "charts")
+    os.makedirs(charts_dir, exist_ok=True)
+
+    summary = {key: value for key, value in report.items() if key not in REPORT_DATAFRAMES}
+    summary["dataframes"] = []
+    for name in REPORT_DATAFRAMES:
+        if name in report:
+            report[name].to_parquet(os.path.join(report_dir, f"{name}.parquet"))
+            summary["dataframes"].append(name)
+
+    if "progress_df_transactions" in report:
+        fig = visualizer.plot_detailed_pie_chart(report["progress_df_transactions"],
+                                                 total_txn_count=report["total_transactions_count"])
+        fig.write_html(os.path.join(charts_dir, "progress_pie.html"), include_plotlyjs="cdn")
+        for member_name in report["df_ngrams"]["Team Member"].unique():
+            member_df_ngrams = report["df_ngrams"][report["df_ngrams"]["Team Member"] == member_name]
+            member_df_merchants = report["df_merchants"][report["df_merchants"]["Team Member"] == member_name]
+            fig_ngrams = visualizer.plot_reviewed_txns_scatter_plot(member_df_ngrams.sort_values("Date"), member_name)
+            fig_merchants = visualizer.plot_merchants_scatter_plot(member_df_merchants, member_name)
+            fig_ngrams.write_html(os.path.join(charts_dir, f"{slugify(member_name)}_ngrams.html"),
+                                  include_plotlyjs="cdn")
+            fig_merchants.write_html(os.path.join(charts_dir, f"{slugify(member_name)}_merchants.html"),
+                                     include_plotlyjs="cdn")
+
+    # Write the summary last, so a report directory with a summary is always complete
+    summary_path = os.path.join(report_dir, "summary.json")
+    with open(summary_path + ".tmp", "w") as file:
+        json.dump(summary, file, indent=2, default=str)
+    os.replace(summary_path + ".tmp", summary_path)
+    return summary_path
+
+
+# Function to get the validation status of every submission page
+def get_validation_status(data):
+    rows = []
+    for record in DataManager().get_catalog(data).by_type('Submission'):
+        properties = record.page['properties']
+        submission_validation = ((properties.get('Submission Validation') or {}).get('select') or {}).get('name')
+        validation_comments = (properties.get('Validation Comment') or {}).get('multi_select') or []
+        rows.append((record.page_id, record.title, record.team_member, record.data_type, record.file_name,
+                     record.date.isoformat() if record.date else None, submission_validation,
+                     ", ".join(comment['name'] for comment in validation_comments)))
+    return pd.DataFrame(rows, columns=['Page ID', 'Source', 'Team Member', 'Data Type', 'File', 'Date',
+                                       'Submission Validation', 'Validation Comment'])
+
+
+# Function to write the validation status of the submissions next to the reports
+def write_validation_status(data, output_dir=REPORTS_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, VALIDATION_STATUS_FILE)
+    get_validation_status(data).to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def generate_reports(notion_client, database_id, source_titles=None, date_ranges=None, output_dir=REPORTS_DIR):
+    """ Compute and write the team-progress reports for many sources and date ranges
+    :param notion_client: Notion client
+    :param database_id: id of the "Data Hub Progress" Notion database
+    :param source_titles: source titles to report on, all sources if None
+    :param date_ranges: list of (start_date, end_date), the default dashboard range if None
+    :param output_dir: directory the reports are written to
+    :return: list of written summary paths
+    """
+    data = DataManager().get_notion_data(notion_client, database_id)
+    date_ranges = date_ranges or [get_default_date_range()]
+    ledger = get_ledger()
+    visualizer = DashboardVisualization()
+
+    try:
+        write_validation_status(data, output_dir=output_dir)
+    except Exception as e:
+        print(f"[generate_reports] Error writing the validation status: {e}")
+
+    summary_paths = []
+    for source_file in get_source_files(data):
+        if source_titles and source_file[0] not in source_titles:
+            continue
+        for start_date, end_date in date_ranges:
+            print(f"[generate_reports] {source_file[0]} | {start_date} - {end_date}")
+            try:
+                report = compute_source_report(data, source_file, start_date, end_date, ledger=ledger,
+                                               notion_client=notion_client)
+                report_dir = get_report_dir(source_file[0], start_date, end_date, output_dir=output_dir)
+                summary_paths.append(write_report(report, report_dir, visualizer=visualizer))
+            except Exception as e:
+                print(f"[generate_reports] Error generating report for {source_file[0]}: {e}")
+    return summary_paths
+
+
+# Function to load a precomputed report snapshot, or None if it was never generated
+def load_report_snapshot(source_title, start_date, end_date, output_dir=REPORTS_DIR):
+    summary_path = os.path.join(get_report_dir(source_title, start_date, end_date, output_dir=output_dir),
+                                "summary.json")
+    if not os.path.exists(summary_path):
+        return None
+    return _load_report_snapshot(summary_path, os.path.getmtime(summary_path))
+
+
+# Function to check that a snapshot was generated after the latest edit of the pages it covers (a newer submission
+# or validation makes it stale)
+def is_report_snapshot_current(snapshot, pages):
+    edited_times = [page.get("last_edited_time") for page in pages if page.get("last_edited_time")]
+    if not edited_times:
+        return True
+    last_edited = max(datetime.fromisoformat(edited_time.replace("Z", "+00:00")) for edited_time in edited_times)
+    return datetime.fromisoformat(snapshot["generated_at"]).astimezone() >= last_edited
+
+
+# The file modification time is part of the cache key, so a regenerated snapshot is picked up
+@st.cache_data(show_spinner=False)
+def _load_report_snapshot(summary_path, modified_time):
+    with open(summary_path) as file:
+        report = json.load(file)
+    report_dir = os.path.dirname(summary_path)
+    for name in report.pop("dataframes"):
+        report[name] = pd.read_parquet(os.path.join(report_dir, f"{name}.parquet"))
+    return report
+
+
+# Function to get the seconds until the next nightly run
+def seconds_until_next_run(run_hour=NIGHTLY_RUN_HOUR, now=None):
+    now = now or datetime.now()
+    next_run = now.replace(hour=run_hour, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+# Function to pre-warm the reports every night
+def run_reports_nightly(notion_client, database_id, output_dir=REPORTS_DIR, run_hour=NIGHTLY_RUN_HOUR):
+    while True:
+        time.sleep(seconds_until_next_run(run_hour))
+        try:
+            # Notion query results are cached by the dashboard, so drop them to report on the latest pages
+            fetch_notion_data.clear()
+            generate_reports(notion_client, database_id, output_dir=output_dir)
+            # Imported here, since the lookup is built from the reviewed submissions read by the dashboard modules
+            from .ngram_lookup import compile_ngram_lookup
+            compile_ngram_lookup(notion_client, database_id)
+        except Exception as e:
+            print(f"[run_reports_nightly] Error: {e}")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Generate the Data Hub team-progress reports")
+    parser.add_argument("--source", action="append", help="Source title to report on (repeatable), all if omitted")
+    parser.add_argument("--start", type=date.fromisoformat, help="Start date (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="End date (YYYY-MM-DD)")
+    parser.add_argument("--output-dir", default=REPORTS_DIR)
+    parser.add_argument("--nightly", action="store_true", help="Keep running and regenerate the reports nightly")
+    args = parser.parse_args()
+
+    from notion_client import Client
+    notion_client = Client(auth=os.getenv("NOTION_TOKEN"))
+    database_id = os.getenv("DATABASE_ID")
+
+    default_start, default_end = get_default_date_range()
+    date_ranges = [(args.start or default_start, args.end or default_end)]
+    for summary_path in generate_reports(notion_client, database_id, source_titles=args.source,
+                                         date_ranges=date_ranges, output_dir=args.output_dir):
+        print(summary_path)
+    if args.nightly:
+        run_reports_nightly(notion_client, database_id, output_dir=args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
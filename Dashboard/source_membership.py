@@ -0,0 +1,125 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from .file_reader import evict_files, touch_file
+
+MEMBERSHIP_FILTERS_DIR = "membership_filters"
+# Filters unused for longer than this are removed from disk, then the least recently used ones above the budget
+MEMBERSHIP_FILTERS_BUDGET_MB = int(os.getenv('MEMBERSHIP_FILTERS_BUDGET_MB', 2048))
+MEMBERSHIP_FILTERS_MAX_AGE_DAYS = int(os.getenv('MEMBERSHIP_FILTERS_MAX_AGE_DAYS', 30))
+# Filters held in memory by the process
+MEMBERSHIP_FILTERS_MAX_ENTRIES = int(os.getenv('MEMBERSHIP_FILTERS_MAX_ENTRIES', 16))
+# Sources with more distinct descriptions than this get a Bloom filter instead of the exact hash set
+EXACT_SET_MAX_DESCRIPTIONS = int(os.getenv('MEMBERSHIP_EXACT_SET_MAX', 5_000_000))
+BLOOM_FALSE_POSITIVE_RATE = 0.001
+# Second hash key of the Bloom filter (hash_pandas_object keys are 16 characters)
+BLOOM_HASH_KEY = "data-hub-bloom-2"
+
+
+# Function to hash normalized descriptions to uint64, vectorized
+def hash_descriptions(descriptions, hash_key=None):
+    descriptions = pd.Series(descriptions).dropna().astype(str).str.strip()
+    kwargs = {"hash_key": hash_key} if hash_key else {}
+    return pd.util.hash_pandas_object(descriptions, index=False, **kwargs).to_numpy(dtype=np.uint64)
+
+
+class SourceMembershipFilter:
+    """ Membership structure of the descriptions of a source file.
+    Holds the sorted distinct description hashes (exact up to 64-bit collisions), or a Bloom filter for very
+    large sources. Checking a reviewed file costs O(rows) hashing plus a lookup per row.
+    """
+
+    def __init__(self, kind, hashes=None, bits=None, num_hashes=0):
+        self.kind = kind
+        self.hashes = hashes
+        self.bits = bits
+        self.num_hashes = num_hashes
+
+    @classmethod
+    def build(cls, descriptions, exact_max=EXACT_SET_MAX_DESCRIPTIONS, false_positive_rate=BLOOM_FALSE_POSITIVE_RATE):
+        hashes = np.unique(hash_descriptions(descriptions))
+        if len(hashes) <= exact_max:
+            return cls("exact", hashes=hashes)
+
+        # Optimal Bloom filter size and number of hash functions for the expected items and error rate
+        num_bits = int(np.ceil(-len(hashes) * np.log(false_positive_rate) / np.log(2) ** 2))
+        num_hashes = max(1, int(round(num_bits / len(hashes) * np.log(2))))
+        membership_filter = cls("bloom", bits=np.zeros((num_bits + 7) // 8, dtype=np.uint8), num_hashes=num_hashes)
+        positions = membership_filter._get_bit_positions(pd.Series(descriptions).drop_duplicates()).ravel()
+        np.bitwise_or.at(membership_filter.bits, positions // 8, (1 << (positions % 8)).astype(np.uint8))
+        return membership_filter
+
+    # Function to get the Bloom filter bit positions of every description (double hashing)
+    def _get_bit_positions(self, descriptions):
+        num_bits = np.uint64(len(self.bits) * 8)
+        first = hash_descriptions(descriptions)
+        second = hash_descriptions(descriptions, hash_key=BLOOM_HASH_KEY) | np.uint64(1)
+        return np.concatenate([(first + np.uint64(i) * second) % num_bits for i in range(self.num_hashes)]) \
+            .reshape(self.num_hashes, -1)
+
+    def contains(self, descriptions):
+        """ Check which descriptions belong to the source
+        :param descriptions: iterable of descriptions (missing values are dropped)
+        :return: boolean numpy array, one value per non-missing description
+        """
+        if self.kind == "exact":
+            hashes = hash_descriptions(descriptions)
+            positions = np.searchsorted(self.hashes, hashes)
+            positions[positions == len(self.hashes)] = 0
+            return (self.hashes[positions] == hashes) if len(self.hashes) else np.zeros(len(hashes), dtype=bool)
+        positions = self._get_bit_positions(descriptions)
+        is_set = (self.bits[positions // 8] >> (positions % 8).astype(np.uint8)) & 1
+        return is_set.all(axis=0)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.tmp.npz"
+        np.savez(temp_path, kind=self.kind, hashes=self.hashes if self.hashes is not None else np.empty(0, np.uint64),
+                 bits=self.bits if self.bits is not None else np.empty(0, np.uint8), num_hashes=self.num_hashes)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            kind = str(saved["kind"])
+            return cls(kind, hashes=saved["hashes"] if kind == "exact" else None,
+                       bits=saved["bits"] if kind == "bloom" else None, num_hashes=int(saved["num_hashes"]))
+
+
+# Function to get the file a membership filter is persisted to, keyed by the source file and its Notion page version
+def get_membership_filter_path(source_key, filters_dir=MEMBERSHIP_FILTERS_DIR):
+    return os.path.join(filters_dir, f"{hashlib.sha256(str(source_key).encode()).hexdigest()[:24]}.npz")
+
+
+_membership_filters = OrderedDict()
+_membership_filters_lock = threading.Lock()
+
+
+def get_source_membership_filter(source_key, load_descriptions, filters_dir=MEMBERSHIP_FILTERS_DIR):
+    """ Get the membership filter of a source file, built once and persisted on disk
+    :param source_key: stable key of the source file, e.g. (title, filename, last edited time)
+    :param load_descriptions: function returning the source descriptions, called only to build the filter
+    :return: SourceMembershipFilter
+    """
+    with _membership_filters_lock:
+        if source_key in _membership_filters:
+            _membership_filters.move_to_end(source_key)
+            return _membership_filters[source_key]
+        path = get_membership_filter_path(source_key, filters_dir)
+        if os.path.exists(path):
+            membership_filter = SourceMembershipFilter.load(path)
+            touch_file(path)
+        else:
+            membership_filter = SourceMembershipFilter.build(load_descriptions())
+            membership_filter.save(path)
+            print(f"[get_source_membership_filter] built {membership_filter.kind} filter for {source_key}")
+            # Every new version of a source page gets a new filter, so the unused ones are removed
+            evict_files(filters_dir, ".npz", MEMBERSHIP_FILTERS_BUDGET_MB * 1024 * 1024,
+                        MEMBERSHIP_FILTERS_MAX_AGE_DAYS * 24 * 60 * 60, keep={path})
+        _membership_filters[source_key] = membership_filter
+        while len(_membership_filters) > MEMBERSHIP_FILTERS_MAX_ENTRIES:
+            _membership_filters.popitem(last=False)
+        return membership_filter
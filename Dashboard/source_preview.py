@@ -0,0 +1,132 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+PAGE_SIZES = [25, 50, 100, 500]
+SEARCH_COLUMN = "description"
+TOKEN_PATTERN = re.compile(r"\w+")
+# The search indexes hold a python list per token, so only the recently searched sources are kept
+SEARCH_INDEX_MAX_ENTRIES = int(os.getenv('SEARCH_INDEX_MAX_ENTRIES', 8))
+SEARCH_INDEX_TTL = int(os.getenv('SEARCH_INDEX_TTL', 60 * 60))
+
+
+# Function to compute the summary statistics of a source file once per source version
+@st.cache_data(show_spinner=False)
+def get_source_summary(_source_df, source_key, source_version=None):
+    summary_df = pd.DataFrame({
+        "dtype": _source_df.dtypes.astype(str),
+        "non_null": _source_df.notna().sum(),
+        "nulls": _source_df.isna().sum(),
+        "unique": _source_df.nunique(),
+    })
+    summary_df.index.name = "column"
+    return {
+        "rows": len(_source_df),
+        "columns": len(_source_df.columns),
+        "summary_df": summary_df.reset_index(),
+    }
+
+
+# Function to build an inverted token index (token -> sorted row positions) over a text column
+@st.cache_resource(show_spinner=False, max_entries=SEARCH_INDEX_MAX_ENTRIES, ttl=SEARCH_INDEX_TTL)
+def build_search_index(_source_df, source_key, column=SEARCH_COLUMN, source_version=None):
+    print("[build_search_index] ", source_key, column)
+    postings = {}
+    for position, text in enumerate(_source_df[column].astype(str).str.lower().values):
+        for token in set(TOKEN_PATTERN.findall(text)):
+            postings.setdefault(token, []).append(position)
+    return {token: np.asarray(positions, dtype=np.int64) for token, positions in postings.items()}
+
+
+# Function to get the row positions whose text column contains every token of the query
+def search_source(search_index, query):
+    tokens = TOKEN_PATTERN.findall(query.lower())
+    if not tokens:
+        return None
+    postings = []
+    for token in tokens:
+        if token not in search_index:
+            return np.empty(0, dtype=np.int64)
+        postings.append(search_index[token])
+    # Intersect the shortest posting lists first
+    postings.sort(key=len)
+    positions = postings[0]
+    for other in postings[1:]:
+        positions = np.intersect1d(positions, other, assume_unique=True)
+    return positions
+
+
+# Function to get the row positions of a random or stratified sample of the source file
+@st.cache_data(show_spinner=False)
+def sample_source(_source_df, source_key, sample_size, stratify_by=None, seed=0, source_version=None):
+    rng = np.random.default_rng(seed)
+    if stratify_by is None:
+        sample_size = min(sample_size, len(_source_df))
+        return np.sort(rng.choice(len(_source_df), size=sample_size, replace=False))
+    # Proportional allocation, with at least one row per stratum
+    groups = pd.Series(np.arange(len(_source_df))).groupby(_source_df[stratify_by].values, dropna=False)
+    fraction = min(sample_size / max(len(_source_df), 1), 1.0)
+    positions = []
+    for _, group_positions in groups:
+        group_positions = group_positions.values
+        group_size = min(len(group_positions), max(1, int(round(len(group_positions) * fraction))))
+        positions.append(rng.choice(group_positions, size=group_size, replace=False))
+    return np.sort(np.concatenate(positions)) if positions else np.empty(0, dtype=np.int64)
+
+
+# Function to slice a single page out of the selected row positions and columns
+def get_preview_page(source_df, positions, page, page_size, columns=None):
+    start = (page - 1) * page_size
+    if positions is None:
+        window = source_df.iloc[start:start + page_size]
+    else:
+        window = source_df.iloc[positions[start:start + page_size]]
+    if columns:
+        window = window[columns]
+    return window
+
+
+# Renders the source preview; paging, sampling and search only rerun this fragment and only the
+# visible window is serialized and sent to the browser. The source version (the last edit time of its page) keeps
+# the cached summary, sample and search index of a replaced file from being reused
+@st.experimental_fragment
+def render_source_preview(source_df, source_key, source_version=None):
+    summary = get_source_summary(source_df, source_key, source_version=source_version)
+    st.write(f"- **Rows:** {summary['rows']} | **Columns:** {summary['columns']}")
+    with st.expander("Column summary"):
+        st.dataframe(summary["summary_df"], hide_index=True)
+
+    all_columns = source_df.columns.tolist()
+    columns = st.multiselect("Columns", all_columns, default=all_columns, key=f"preview_columns_{source_key}")
+
+    control_cols = st.columns(4)
+    sample_mode = control_cols[0].selectbox("Rows", ["All", "Random sample", "Stratified sample"],
+                                            key=f"preview_mode_{source_key}")
+    query = control_cols[1].text_input(f"Search {SEARCH_COLUMN}", key=f"preview_query_{source_key}") \
+        if SEARCH_COLUMN in all_columns else ""
+    page_size = control_cols[2].selectbox("Page size", PAGE_SIZES, key=f"preview_page_size_{source_key}")
+
+    positions = None
+    if sample_mode != "All":
+        sample_size = st.number_input("Sample size", min_value=1, max_value=max(len(source_df), 1),
+                                      value=min(1000, max(len(source_df), 1)), key=f"preview_sample_{source_key}")
+        stratify_by = None
+        if sample_mode == "Stratified sample":
+            stratify_by = st.selectbox("Stratify by", all_columns, key=f"preview_stratify_{source_key}")
+        positions = sample_source(source_df, source_key, int(sample_size), stratify_by=stratify_by,
+                                  source_version=source_version)
+
+    if query:
+        matches = search_source(build_search_index(source_df, source_key, source_version=source_version), query)
+        if matches is not None:
+            positions = matches if positions is None else np.intersect1d(positions, matches, assume_unique=True)
+
+    total_rows = len(source_df) if positions is None else len(positions)
+    total_pages = max(1, -(-total_rows // page_size))
+    # The label carries the page count, so the page input resets when the filtered row count changes
+    page = control_cols[3].number_input(f"Page (of {total_pages})", min_value=1, max_value=total_pages, value=1)
+
+    st.dataframe(get_preview_page(source_df, positions, int(page), page_size, columns))
+    st.caption(f"Showing page {int(page)} of {total_pages} ({total_rows} matching rows)")
@@ -0,0 +1,127 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TAGGED_CACHE_MAX_ENTRIES = int(os.getenv('TAGGED_CACHE_MAX_ENTRIES', 256))
+# TTL in seconds of the entries carrying a tag, by tag kind (the part before ":"); the shortest one applies.
+# The Notion queries expire before the signed file URLs they contain (one hour), and the validated transactions
+# lookups with the population runs of other processes (every two hours)
+DEFAULT_TAG_TTLS = {"notion_query": 30 * 60, "validated_transactions": 2 * 60 * 60}
+TAG_TTLS = {**DEFAULT_TAG_TTLS, **json.loads(os.getenv('CACHE_TAG_TTLS', '{}'))}
+
+
+# Function to get the TTL of a set of tags, None if none of them expires
+def get_tags_ttl(tags, tag_ttls=None):
+    tag_ttls = TAG_TTLS if tag_ttls is None else tag_ttls
+    ttls = [tag_ttls[tag.split(":", 1)[0]] for tag in tags if tag.split(":", 1)[0] in tag_ttls]
+    ttls += [tag_ttls[tag] for tag in tags if tag in tag_ttls]
+    return min(ttls) if ttls else None
+
+
+class TaggedCache:
+    """ Process-wide cache whose entries carry tags (e.g. "source:<title>", "page:<id>", "data_type:Merchants"),
+    so an update only invalidates the entries it affects. Entries expire after the TTL of their tags and the least
+    recently used ones are evicted above max_entries.
+    """
+
+    def __init__(self, max_entries=TAGGED_CACHE_MAX_ENTRIES, tag_ttls=None):
+        self.max_entries = max_entries
+        self.tag_ttls = TAG_TTLS if tag_ttls is None else tag_ttls
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._entries = OrderedDict()
+        self._keys_by_tag = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                self.stats["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key, value, tags=()):
+        tags = frozenset(tags)
+        ttl = get_tags_ttl(tags, self.tag_ttls)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, tags, time.monotonic() + ttl if ttl is not None else None)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def invalidate(self, *tags):
+        """ Drop every entry carrying any of the tags
+        :return: number of entries dropped
+        """
+        with self._lock:
+            keys = set().union(*(self._keys_by_tag.get(tag, set()) for tag in tags)) if tags else set()
+            for key in keys:
+                self._remove(key)
+            self.stats["invalidations"] += len(keys)
+        if keys:
+            print(f"[TaggedCache] invalidated {len(keys)} entries tagged {list(tags)}")
+        return len(keys)
+
+    def _remove(self, key):
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+_tagged_cache = None
+_tagged_cache_lock = threading.Lock()
+
+
+# Function to get the process-wide tagged cache
+def get_tagged_cache():
+    global _tagged_cache
+    with _tagged_cache_lock:
+        if _tagged_cache is None:
+            _tagged_cache = TaggedCache()
+        return _tagged_cache
+
+
+def cache_with_tags(get_tags):
+    """ Decorator caching a function in the process-wide tagged cache, like st.cache_data but invalidated by tag.
+    Arguments starting with "_" are left out of the key, as with st.cache_data. The cached value is shared, not
+    copied, so callers must not modify it.
+    :param get_tags: function of the call's arguments returning the tags of the entry
+    """
+    def decorator(function):
+        function_tag = f"function:{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            arg_names = function.__code__.co_varnames[:function.__code__.co_argcount]
+            call_args = {**dict(zip(arg_names, args)), **kwargs}
+            key = (function_tag,) + tuple(sorted((name, value) for name, value in call_args.items()
+                                                 if not name.startswith("_")))
+            cache = get_tagged_cache()
+            missing = object()
+            value = cache.get(key, missing)
+            if value is missing:
+                value = function(*args, **kwargs)
+                cache.set(key, value, tags={function_tag, *get_tags(*args, **kwargs)})
+            return value
+
+        # Drops every cached call of the function, like st.cache_data's clear()
+        wrapper.clear = lambda: get_tagged_cache().invalidate(function_tag)
+        return wrapper
+    return decorator
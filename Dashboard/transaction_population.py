@@ -1,15 +1,20 @@
-import pandas as pd
 import psycopg2
 import boto3
 import uuid
 from datetime import datetime
 import os
-from PIL import Image
-import requests
+import threading
 import time
-from fake_useragent import UserAgent
-import io
 from dotenv import load_dotenv
+from .notion_writer import get_notion_write_queue, NOTION_FLUSH_TIMEOUT
+from .notion_io import query_database
+from .file_reader import read_file, read_files, get_file_url_refresher
+from .population_scheduler import PopulationScheduler, PopulationTask, find_merchant_dependencies
+from .population_lease import EntryLeaseManager, MERCHANT_ID_LOCK_KEY
+from .merchant_similarity import get_merchant_similarity_index
+from .validated_transactions import find_validated_descriptions, invalidate_validated_descriptions
+from .utils import invalidate_cache_tags
+from .logo_processing import fetch_and_normalize_logo, fetch_and_normalize_logos, download_logo, normalize_logo
 
 load_dotenv()
 
@@ -40,14 +45,40 @@ class TxnPopulationManager:
     def __init__(self, notion_client, database_id) -> None:
         self.database_id = database_id
         self.notion_client=notion_client
-
-    def add_merchant_to_db(self, row, logo_id):
+        self.notion_writer = get_notion_write_queue(notion_client)
+        self.logo_stats = {"logos": 0, "original_bytes": 0, "png_bytes": 0, "bytes_saved": 0}
+        self._merchant_id_lock = threading.Lock()
+        self.lease_manager = None
+
+    def add_merchant_to_db(self, row, logo_id, conn=None):
+        conn = conn or db
+        # The merchant ids are allocated with MAX(id), so concurrent entries add their merchants one at a time:
+        # the thread lock covers entries sharing a connection, the advisory lock covers every worker instance
+        with self._merchant_id_lock:
+            return self._add_merchant_to_db(row, logo_id, conn)
+
+    def _add_merchant_to_db(self, row, logo_id, conn):
         try:
-            country_id, next_genify_merchant_id = self.get_country_id_and_genify_merchant_id(country_name=row["country"].lower())
-            category_id, genify_category_id = self.get_category_id_and_genify_category_id(category_name=row["category"])
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (MERCHANT_ID_LOCK_KEY,))
+
+            country_id, next_genify_merchant_id = self.get_country_id_and_genify_merchant_id(country_name=row["country"].lower(), conn=conn)
+
+            with conn.cursor() as cur:
+                # A merchant already inserted (e.g. by an earlier, interrupted run) is reused; merchants sharing a
+                # name in other countries are different merchants
+                cur.execute("""
+                    SELECT id FROM merchant WHERE name = %s AND country_id IS NOT DISTINCT FROM %s AND validated = True
+                """, (row["name"], country_id))
+                existing_merchant = cur.fetchone()
+                if existing_merchant:
+                    conn.commit()
+                    print(f"Merchant '{row['name']}' already exists. Skipping insertion.")
+                    return existing_merchant[0]
+            category_id, genify_category_id = self.get_category_id_and_genify_category_id(category_name=row["category"], conn=conn)
             row_website = row["website"] if not isinstance(row["website"], float) else ""
 
-            with db.cursor() as cur:
+            with conn.cursor() as cur:
                 cur.execute("SELECT MAX(id) FROM merchant")
                 next_merchant_id = cur.fetchone()[0] + 1
                 cur.execute("""
@@ -70,23 +101,39 @@ class TxnPopulationManager:
                     category_id,
                     genify_category_id,
                 ))
-                db.commit()
-                return next_merchant_id
+                conn.commit()
+            self.register_new_merchant(next_merchant_id, row["name"])
+            return next_merchant_id
         except Exception as e:
             print("An error occurred while adding merchant to database:", e)
-            db.rollback()
+            conn.rollback()
             return None
 
-    def insert_logo_to_db(self, logo_url):
+    # Function to report the likely duplicates of a new merchant and add it to the near-duplicate index
+    def register_new_merchant(self, merchant_id, name):
+        try:
+            merchant_similarity_index = get_merchant_similarity_index()
+            near_duplicates = merchant_similarity_index.query(name, exclude=[merchant_id])
+            if near_duplicates:
+                print(f"[register_new_merchant] '{name}' may duplicate: {near_duplicates[:5]}")
+            merchant_similarity_index.add(merchant_id, name)
+        except Exception as e:
+            print(f"[register_new_merchant] Error updating the near-duplicate index: {e}")
+
+    def insert_logo_to_db(self, logo_url, conn=None):
+        conn = conn or db
         try:
-            with db.cursor() as cur:
+            with conn.cursor() as cur:
                 file_url = "logos/" + os.path.basename(logo_url)
+                # Serialize workers inserting the same logo
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (file_url,))
                 # Check if the logo with the same file_url already exists
                 cur.execute("SELECT id FROM logo WHERE file_url = %s", (file_url,))
                 existing_logo_id = cur.fetchone()
                 
                 if existing_logo_id:
                     # Handle the case where the logo with the same file_url already exists
+                    conn.commit()
                     print("Logo with file_url already exists. Skipping insertion.")
                     return existing_logo_id[0]  # Return the ID of the existing logo
                 
@@ -95,33 +142,50 @@ class TxnPopulationManager:
                 new_logo_id = cur.fetchone()[0]
                 
                 # Commit the transaction
-                db.commit()
+                conn.commit()
                 
                 return new_logo_id  # Return the ID of the newly inserted logo
 
         except Exception as e:
             print("An error occurred while inserting logo to database:", e)
-            db.rollback()
+            conn.rollback()
             return None
 
-    def upload_logo_to_s3(self, row):
+    def upload_logo_to_s3(self, row, logo=None):
+        """
+        Upload the normalized logo of a merchant row to S3.
+
+        :param row: merchant row with "name" and "logo_url".
+        :param logo: normalize_logo result for the row, downloaded and normalized here if not given.
+        :return: The public S3 URL of the PNG logo, or None.
+        """
         try:
             if isinstance(row["logo_url"], float):
                 return None
             print("Attempting to upload logo with URL:", row["logo_url"])
             logo_ext = ".png" # extract_logo_extension(row["logo_url"])
             logo_key = f"logos/{row['name']}{logo_ext}"
-    #         logo_content = requests.get(logo_url, headers=headers).content
-            
-            logo_content = self.convert_jpeg_to_png(logo_url=row["logo_url"])
+
+            logo = logo or fetch_and_normalize_logo(row["logo_url"])
+            if logo is None:
+                return None
+            self.record_logo_savings(logo)
 
             print("[uploading] init...")
+            if logo["webp"] is not None:
+                s3.put_object(
+                    Bucket=bucket_name,
+                    Key=f"logos/{row['name']}.webp",
+                    Body=logo["webp"],
+                    ACL="public-read",
+                    ContentType="image/webp",
+                )
             response = s3.put_object(
                 Bucket=bucket_name,
                 Key=logo_key,
-                Body=logo_content,
+                Body=logo["png"],
                 ACL="public-read",
-                ContentType="image/png",  # Assuming PNG format, change if necessary
+                ContentType="image/png",
             )
             if response["ResponseMetadata"]["HTTPStatusCode"] == 200:
                 return f"https://{bucket_name}.s3.eu-central-1.amazonaws.com/{logo_key}"
@@ -150,47 +214,33 @@ class TxnPopulationManager:
 
     def convert_jpeg_to_png(self, logo_url):
         try:
-            # Download the JPEG image
-            try:
-                ua = UserAgent()
-                headers = {'User-Agent': ua.random}
-                response = requests.get(logo_url, headers=headers)
-            except Exception as e:
-                print("Error: Exception 1")
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-                response = requests.get(logo_url, headers=headers)
-
-            if response.status_code != 200:
-                print(f"Failed to download image: {response.status_code}")
-                return None
-            if logo_url.lower().endswith(".png"):
-                png_content = response.content
-                return png_content
-
-            # Open the image using PIL
-            image = Image.open(io.BytesIO(response.content))
-            
-            # Convert the image to PNG format
-            if image.format in ['JPEG', 'JPG']:
-                # Create an in-memory byte stream to hold the PNG image
-                png_buffer = io.BytesIO()
-                # Convert the image to PNG and save it to the byte stream
-                image.save(png_buffer, format='PNG')
-                # Get the content of the byte stream
-                png_content = png_buffer.getvalue()
-                return png_content
-            else:
-                print("The image is not in JPEG format.")
+            logo_content = download_logo(logo_url)
+            if logo_content is None:
                 return None
+            return normalize_logo(logo_content, webp=False)["png"]
         except Exception as e:
             print("An error occurred during image conversion:", e)
             return None
 
-    def get_country_id_and_genify_merchant_id(self, country_name):
+    def record_logo_savings(self, logo):
+        """
+        Add the byte savings of a normalized logo to the running logo stats.
+
+        :param logo: normalize_logo result.
+        """
+        self.logo_stats["logos"] += 1
+        self.logo_stats["original_bytes"] += logo["original_bytes"]
+        self.logo_stats["png_bytes"] += logo["png_bytes"]
+        self.logo_stats["bytes_saved"] += logo["bytes_saved"]
+        print(f"[logo] {logo['original_bytes']} -> {logo['png_bytes']} bytes "
+              f"({logo['width']}x{logo['height']}) | total saved: {self.logo_stats['bytes_saved']} bytes")
+
+    def get_country_id_and_genify_merchant_id(self, country_name, conn=None):
+        conn = conn or db
         try:
             country_id, next_genify_merchant_id = None, None
             # Query the country table to retrieve the country_id
-            cur = db.cursor()
+            cur = conn.cursor()
             cur.execute(f"SELECT id, iso_2 FROM country WHERE name = %s", (country_name,))
             result = cur.fetchone()
             if result:
@@ -216,9 +266,10 @@ class TxnPopulationManager:
             print("An error occurred while retrieving country ID:", e)
             return country_id, next_genify_merchant_id
 
-    def get_category_id_and_genify_category_id(self, category_name):
+    def get_category_id_and_genify_category_id(self, category_name, conn=None):
+        conn = conn or db
         try:
-            cur = db.cursor()
+            cur = conn.cursor()
             cur.execute("SELECT id, genify_category_id FROM category WHERE name_eng = %s", (category_name,))
             result = cur.fetchone()
             if result:
@@ -231,22 +282,26 @@ class TxnPopulationManager:
             print("An error occurred while retrieving category information:", e)
             return None, None
 
-    def populate_logos_and_merchants(self, df):
+    def populate_logos_and_merchants(self, df, conn=None):
+        conn = conn or db
         # failed_merchants = []
         # failed_logos = []
+        # Download and normalize all the logos of the file up front, across a process pool
+        logos = dict(zip(df.index, fetch_and_normalize_logos(df["logo_url"].tolist())))
+
         # Iterate over each row
         for index, row in df.iterrows():
             print(f"[index] {index}")
             # Upload logo to S3 and retrieve S3 URL
-            s3_logo_url = self.upload_logo_to_s3(row)
+            s3_logo_url = self.upload_logo_to_s3(row, logo=logos.get(index))
             print(f"[s3_logo_url] {s3_logo_url}")
             if s3_logo_url is not None:
                 # Insert logo URL into the logo table and retrieve logo ID
-                logo_id = self.insert_logo_to_db(s3_logo_url)
+                logo_id = self.insert_logo_to_db(s3_logo_url, conn=conn)
                 print(f"[logo_id] {logo_id}")
                 if logo_id is not None:
                     # Add merchant to database with the obtained logo ID
-                    merchant_id = self.add_merchant_to_db(row, logo_id)
+                    merchant_id = self.add_merchant_to_db(row, logo_id, conn=conn)
                     if merchant_id is not None:
                         # Update DataFrame with merchant ID
                         df.at[index, "merchant_id"] = merchant_id
@@ -258,7 +313,7 @@ class TxnPopulationManager:
                     print("Failed to insert logo to database.")
                     # failed_logos.append(index)
             else:
-                merchant_id = self.add_merchant_to_db(row, logo_id=None)
+                merchant_id = self.add_merchant_to_db(row, logo_id=None, conn=conn)
                 if merchant_id is not None:
                     # Update DataFrame with merchant ID
                     df.at[index, "merchant_id"] = merchant_id
@@ -317,8 +372,9 @@ class TxnPopulationManager:
         genify_clean_description = merchant_name
 
         try:
-            # Insert transaction into the database
+            # Insert transaction into the database, unless another worker already inserted it
             with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (description,))
                 cur.execute("""
                     INSERT INTO transaction (
                         raw_description, category_id, uuid, country, category_name, 
@@ -326,15 +382,18 @@ class TxnPopulationManager:
                         date, clean_description, subcategory_name, display_description, 
                         validated, validation_date, validation_comment, merchant_ids, 
                         logo_status, genify_clean_description
-                    ) VALUES (
+                    ) SELECT
                         %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM transaction WHERE raw_description = %s AND validated = True
                     )
                 """, (
                     description, category_id, txn_uuid, country, category, 
                     website, logo_url, carbon_footprint, client_id, status, 
                     date, clean_description, subcategory_name, display_description, 
                     validated, validation_date, validation_comment, merchant_ids, 
-                    logo_status, genify_clean_description
+                    logo_status, genify_clean_description,
+                    description
                 ))
                 conn.commit()
         except Exception as e:
@@ -342,6 +401,10 @@ class TxnPopulationManager:
             conn.rollback()
     
     def populate_validated_transaction(self, transaction_df):
+        # The already validated transactions are found with one join instead of one query per row
+        validated_descriptions = find_validated_descriptions(transaction_df["description"], connect=self.connect_to_db)
+        print(f"[populate_validated_transaction] {len(validated_descriptions)} descriptions already validated")
+
         # Connect to the database
         conn = self.connect_to_db()
 
@@ -349,10 +412,10 @@ class TxnPopulationManager:
         for index, row in transaction_df.iterrows():
         #     if index < 362:
         #         continue
-            time.sleep(0.25)
             description = row["description"]
-            if type(description) == float:
+            if type(description) == float or description in validated_descriptions:
                 continue
+            time.sleep(0.25)
             merchant_name = row["extracted_merchant_for_review"]
             print(f"{index} - [description] {description}")
             print(f"[merchant_name] {merchant_name}")
@@ -364,17 +427,17 @@ class TxnPopulationManager:
             print(f"[merchant_details] {merchant_details}")
             
             if merchant_details:
-                # Check if the transaction exists and is validated
-                if not self.transaction_exists_and_validated(conn, description):
-                    # Insert a new transaction record
-                    self.insert_transaction(conn, description, merchant_name, merchant_details)
+                # Insert a new transaction record, unless another worker validated it since the pre-pass
+                self.insert_transaction(conn, description, merchant_name, merchant_details)
+                validated_descriptions.add(description)
             print()
         # Close the database connection
         conn.close()
     
     def get_entries_to_populate(self, database_id):
         print("[get_entries_to_populate] init...")
-        results = self.notion_client.databases.query(
+        results = query_database(
+            self.notion_client,
             **{
                 "database_id": database_id,
                 "filter": {
@@ -390,6 +453,13 @@ class TxnPopulationManager:
                             "select": {
                                 "is_empty": True
                             }
+                        },
+                        {
+                            # Files with unresolvable merchant references are held back until they are fixed
+                            "property": "Validation Comment",
+                            "multi_select": {
+                                "does_not_contain": "Unknown Merchant Reference"
+                            }
                         }
                     ]
                 },
@@ -401,69 +471,127 @@ class TxnPopulationManager:
                 ]
             }
         )
-        print("[get_entries_to_populate] ", results['results'])
-        return results['results']
+        print("[get_entries_to_populate] ", results)
+        return results
 
     def read_csv_from_url(self, url):
-        response = requests.get(url)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        content = response.content
-        if ".csv" in url:
-            df = pd.read_csv(io.BytesIO(content))
-        else:
-            df = pd.read_excel(io.BytesIO(content))
-        return df
+        return read_file(url)
+
+    def read_entries_files(self, entries):
+        """
+        Read the files of many entries, downloading the ones not parsed yet concurrently.
+
+        :param entries: Notion submission entries.
+        :return: dict of entry id -> dataframe (None when the file could not be read).
+        """
+        urls = [entry['properties']['Files & media']['files'][0]['file']['url'] for entry in entries]
+        # Entries queried long ago may have expired URLs, which are re-signed by fetching the entry again
+        refresh_urls = [get_file_url_refresher(self.notion_client, entry["id"]) for entry in entries]
+        dfs = {}
+        for entry, url, df in zip(entries, urls, read_files(urls, refresh_urls=refresh_urls)):
+            if isinstance(df, Exception):
+                print(f"[read_entries_files] Error reading {url}: {df}")
+                df = None
+            dfs[entry["id"]] = df
+        return dfs
 
     def update_population_flag(self, page_id: str, comment: str) -> None:
         """
-        Update the Population flag of a given Notion page with a comment.
+        Queue an update of the Population flag of a given Notion page with a comment.
+        The update is written by the shared Notion write queue, so a pending "Processing" flag is
+        superseded by a later "Done" for the same page.
 
         :param page_id: The ID of the Notion page to update.
-        :param comment: The comment to set for the Population flag.
+        :param comment: The comment to set for the Population flag, None to clear it.
         """
-        try:
-            print("[update_population_flag] page_id:", page_id)
-            response = self.notion_client.pages.update(
-                page_id=page_id,
-                properties={
-                    "Populated": {
-                        "select": {
-                            "name": comment
-                        }
-                    }
+        print("[update_population_flag] page_id:", page_id)
+        self.notion_writer.update_page(
+            page_id=page_id,
+            properties={
+                "Populated": {
+                    "select": {
+                        "name": comment
+                    } if comment is not None else None
                 }
-            )
-            print("[update_population_flag] Success:", response)
-        except Exception as e:
-            print(f"[update_population_flag] Error updating page {page_id}: {e}")
+            }
+        )
+
 
+    def get_lease_manager(self):
+        if self.lease_manager is None:
+            self.lease_manager = EntryLeaseManager(connect=self.connect_to_db)
+        return self.lease_manager
 
     def run_population_pipeline(self):
         print("[run_population_pipeline] init...")
         entries = self.get_entries_to_populate(database_id=self.database_id)
+        lease_manager = self.get_lease_manager()
+
+        entries = [entry for entry in entries
+                   if entry['properties']['Data Type']['select']['name'] in ("Merchants", "Reviewed Transactions")]
+        # Every candidate is read (not only the claimed ones), since transactions entries depend on the merchant
+        # entries whatever worker populates them
+        dfs = self.read_entries_files(entries)
+        candidates = []
+        for entry in entries:
+            if dfs[entry["id"]] is None:
+                print(f"[run_population_pipeline] skipping unreadable entry {entry['id']}")
+                continue
+            candidates.append(PopulationTask(entry, entry['properties']['Data Type']['select']['name'],
+                                             dfs[entry["id"]]))
+        dependencies = find_merchant_dependencies(candidates)
+
+        with lease_manager:
+            # Only the entries this worker claims are populated, other workers get the rest
+            tasks = [task for task in candidates if lease_manager.claim(task.entry_id)]
+            print(f"[run_population_pipeline] worker {lease_manager.worker_id} claimed {len(tasks)} entries")
+
+            # A transactions entry whose merchant entries are held by other workers only runs once they are done,
+            # otherwise it is handed back for a later run
+            claimed_ids = {task.entry_id for task in tasks}
+            other_dependencies = {dependency_id for task in tasks
+                                  for dependency_id in dependencies.get(task.entry_id, ())} - claimed_ids
+            statuses = lease_manager.get_statuses(other_dependencies)
+            ready_tasks = []
+            for task in tasks:
+                waiting_for = {dependency_id for dependency_id in dependencies.get(task.entry_id, ())
+                               if dependency_id not in claimed_ids and statuses.get(dependency_id) != "done"}
+                if waiting_for:
+                    print(f"[run_population_pipeline] {task.entry_id} waits for {len(waiting_for)} merchant entries")
+                    lease_manager.release(task.entry_id, status="waiting")
+                else:
+                    ready_tasks.append(task)
 
-        merchants_entries = []
-        reviewed_transactions_entries = []
+            # Transactions entries only wait for the merchant entries whose merchants they reference
+            results = PopulationScheduler(run_task=self.populate_entry).run(ready_tasks)
 
-        for entry in entries:
-            file_data_type = entry['properties']['Data Type']['select']['name']
-            if file_data_type == "Merchants":
-                merchants_entries.append(entry)
-            elif file_data_type == "Reviewed Transactions":
-                reviewed_transactions_entries.append(entry)
-
-        # Process "Merchants" entries first
-        for entry in merchants_entries:
-            file_url = entry['properties']['Files & media']['files'][0]['file']['url']
-            df_merchants = self.read_csv_from_url(file_url)
-            self.update_population_flag(page_id=entry["id"], comment="Processing")
-            self.populate_logos_and_merchants(df=df_merchants)
-            self.update_population_flag(page_id=entry["id"], comment="Done")
-
-        # Process "Reviewed Transactions" entries next
-        for entry in reviewed_transactions_entries:
-            file_url = entry['properties']['Files & media']['files'][0]['file']['url']
-            df_transactions = self.read_csv_from_url(file_url)
-            self.update_population_flag(page_id=entry["id"], comment="Processing")
-            self.populate_validated_transaction(df_transactions)
-            self.update_population_flag(page_id=entry["id"], comment="Done")
+        # The dashboard's pre-review passes are recomputed with the newly validated transactions, and its pages
+        # re-queried once the population flags are written
+        invalidate_validated_descriptions()
+        self.notion_writer.flush(timeout=NOTION_FLUSH_TIMEOUT)
+        invalidate_cache_tags(f"database:{self.database_id}")
+        return results
+
+    def populate_entry(self, task):
+        """
+        Populate one submission entry in its own database connection.
+
+        :param task: PopulationTask of the entry.
+        """
+        self.update_population_flag(page_id=task.entry_id, comment="Processing")
+        try:
+            if task.data_type == "Merchants":
+                conn = self.connect_to_db()
+                try:
+                    self.populate_logos_and_merchants(df=task.df, conn=conn)
+                finally:
+                    conn.close()
+            else:
+                self.populate_validated_transaction(task.df)
+        except Exception:
+            self.get_lease_manager().release(task.entry_id, status="failed")
+            # Only entries without a Population flag are candidates, so a failed entry is retried on the next run
+            self.update_population_flag(page_id=task.entry_id, comment=None)
+            raise
+        self.get_lease_manager().release(task.entry_id, status="done")
+        self.update_population_flag(page_id=task.entry_id, comment="Done")
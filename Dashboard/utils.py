@@ -1,131 +1,115 @@
-import io
-import pickle
 import os
 import pandas as pd
-import requests
 import streamlit as st
+from .source_preview import render_source_preview
+from .notion_io import query_database
+from .dataframe_store import get_dataframe_store
+from .tagged_cache import cache_with_tags, get_tagged_cache
+from .file_reader import read_file, get_file_url_refresher
+from .merchant_similarity import get_merchant_similarity_index, find_near_duplicate_merchants
 
+# Entries kept by each cached computation stage; the keys carry the file versions, so older ones are never hit again
+STAGE_CACHE_MAX_ENTRIES = int(os.getenv('STAGE_CACHE_MAX_ENTRIES', 64))
 
-# Function to fetch data from Notion
-@st.cache_data
+
+# Function to fetch data from Notion, cached until its TTL or until the database's tag is invalidated
+@cache_with_tags(lambda _notion_client, database_id: {"notion_query", f"database:{database_id}"})
 def fetch_notion_data(_notion_client, database_id):
-    response = _notion_client.databases.query(database_id=database_id)
-    return response['results']
+    return query_database(_notion_client, database_id)
+
+
+# Function to read a Notion file keyed by a stable file key instead of its signed URL, since the
+# signed URLs rotate and would otherwise re-download the same file on every cache miss. The dataframe is held
+# once per process in the shared store and every session gets a read-only view of it instead of its own copy
+def read_file_by_key(url, file_key, refresh_url=None, tags=()):
+    return get_dataframe_store().get_or_load(file_key, lambda: download_file_from_url(url, refresh_url), tags=tags)
+
+
+# Function to download a CSV/Excel file and read it into a dataframe (parsed once into a columnar artifact)
+def download_file_from_url(url, refresh_url=None):
+    df = read_file(url, refresh_url=refresh_url)
+    print("[download_file_from_url] | dataframe columns: ", df.columns)
+    return df
+
+
+# Function to drop the cached data carrying any of the tags, in the tagged cache and the dataframe store
+def invalidate_cache_tags(*tags):
+    return get_tagged_cache().invalidate(*tags) + get_dataframe_store().invalidate(*tags)
+
+
+# Function to get the key of the file of a Notion page; file names and dates aren't unique across members and sources
+def get_file_key(page_id, file_name, file_date=None):
+    return f"{page_id}/{file_name}" if page_id else f"{file_name}_{file_date}"
+
 
+# Function to get the version of a downloaded file: its page and content hash, so a replaced file gets a new key
+def get_file_version(df):
+    return df.attrs.get("page_id"), df.attrs.get("file_metadata", {}).get("content_hash")
 
-# Function to read gzipped CSV file from a URL
-@st.cache_data
-def read_gzipped_csv_file(file_path):
+
+# Function to get the submission keys that identify a list of submitted dataframes across reruns
+def get_submissions_key(dfs):
+    return tuple((member_name, member_filename, submission_date, *get_file_version(member_df)) for
+                 member_name, member_filename, submission_date, member_df in dfs)
+
+
+# Function to get the cache tags of the file of a Notion page
+def get_file_tags(properties, data_type, file_key, page_id=None):
+    tags = {f"data_type:{data_type}", f"file:{file_key}"}
     try:
-        # Read the gzipped content as binary
-        with requests.get(file_path, stream=True) as response:
-            response.raise_for_status()
-            df = pd.read_csv(io.BytesIO(response.content), compression='gzip')
-        return df
-    except Exception as e:
-        print(f"Error reading {file_path}: {e}")
+        tags.add(f"source:{properties['Title']['title'][0]['text']['content']}")
+    except (KeyError, IndexError):
+        pass
+    if page_id:
+        tags.add(f"page:{page_id}")
+    return tags
+
+
+# Function to get the function that re-signs the expired file URL of a Notion page (None without a Notion client)
+def get_page_url_refresher(notion_client, page_id):
+    if notion_client is None or page_id is None:
         return None
+    return get_file_url_refresher(notion_client, page_id)
 
 
-# Function to download and read CSV/Excel files from URLs
-@st.cache_data
-def read_file_from_url(url):
-    print("[read_file_from_url] ", url)
-    response = requests.get(url)
-    if response.status_code == 200:
-        content_type = response.headers['Content-Type']
-        if 'text/csv' in content_type or url.endswith('.csv'):
-            df = pd.read_csv(io.StringIO(response.text))
-        elif 'application/gzip' in content_type or url.endswith('.csv.gz'):
-            df = read_gzipped_csv_file(file_path=url)
-        elif 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' in content_type or url.endswith(
-                '.xlsx'):
-            df = pd.read_excel(io.BytesIO(response.content))
-        else:
-            raise ValueError("Unsupported file format")
-        print("[read_file_from_url] | dataframe columns: ", df.columns)
-        return df
-    elif response.status_code == 403:
-        raise ValueError(f"Access denied to file: {url}. Please check if the URL is correct and accessible.")
-    else:
-        raise ValueError(f"Failed to download file: status code {response.status_code}")
-
-
-# Function to fetch data from Notion and process it
-@st.cache_data(ttl=60 * 5, show_spinner=True)
-def get_processed_files_cache():
-    return {
-        'Merchants': set(),
-        'Reviewed Transactions': set(),
-        'Ngrams': set()
-    }
-
-
-# Function to update the cache
-def update_processed_files_cache(cache, file_type, file_name, file_date):
-    cache[file_type].add((file_name, file_date))
-    st.cache_data.clear()  # Clear the cache to ensure updates
-
-
-# Function to check if a file is already processed
-def is_file_processed(cache, file_type, file_name, file_date):
-    return (file_name, file_date) in cache[file_type]
-
-
-CACHE_FILE_PATH = "processed_files_cache.pkl"
-
-
-# Function to load cache
-def load_cache():
-    if os.path.exists(CACHE_FILE_PATH):
-        with open(CACHE_FILE_PATH, "rb") as file:
-            return pickle.load(file)
-    else:
-        return {
-            'Merchants': {},
-            'Reviewed Transactions': {},
-            'Ngrams': {}
-        }
-
-
-# Function to save cache
-def save_cache(cache):
-    with open(CACHE_FILE_PATH, "wb") as file:
-        pickle.dump(cache, file)
-
-
-# Function to get dataframes and properties, updating the cache
-def get_dataframes_and_properties(properties, df_list, cache, cache_type):
+# Function to get dataframes and properties, recording new files in the processed files ledger
+def get_dataframes_and_properties(properties, df_list, ledger, cache_type, refresh_url=None, page_id=None):
     team_member = properties['Team Member']['select']['name']
     file_name = properties['Files & media']['files'][0]['name']
     file_date = properties['Date']['date']['start']
     file_url = properties['Files & media']['files'][0]['file']['url']
-    file_key = f"{file_name}_{file_date}"
+    file_key = get_file_key(page_id, file_name, file_date)
 
     try:
-        df = read_file_from_url(file_url)
+        df = read_file_by_key(file_url, file_key, refresh_url=refresh_url,
+                              tags=get_file_tags(properties, cache_type, file_key, page_id))
+        # The view's attrs are private to it, so the page of the file is kept with the dataframe
+        df.attrs["page_id"] = page_id
         df_list.append((team_member, file_name, file_date, df))  # Include additional info
-        if file_key not in cache[cache_type]:
-            cache[cache_type][file_key] = (team_member, file_name, file_date)  # Store relevant info in cache
-            save_cache(cache)  # Save the updated cache
+        # Files already in the ledger are ignored by the insert
+        ledger.add(cache_type, file_key, team_member, file_name, file_date, row_count=len(df),
+                   **df.attrs.get("file_metadata", {}))
     except ValueError as e:
         st.error(f"Error reading file from {file_url}: {e}")
 
 
-def read_and_display_source_file(source_file_url, source_title, source_filename):
+def read_and_display_source_file(source_file_url, source_title, source_filename, refresh_url=None,
+                                 source_version=None):
     try:
-        source_df = read_file_from_url(source_file_url)
+        source_key = f"{source_title}_{source_filename}"
+        source_df = read_file_by_key(source_file_url, source_key, refresh_url=refresh_url,
+                                     tags={f"source:{source_title}", "data_type:Source", f"file:{source_key}"})
         st.write("### Source Data")
         st.write(f"#### {source_title}")
         st.write(f"##### Source filename: {source_filename}")
-        st.dataframe(source_df)
+        render_source_preview(source_df, source_key, source_version=source_version)
         return source_df
     except ValueError as e:
         st.error(f"Error reading source file: {e}")
         return None
 
 
-def process_new_merchants_data(dfs_new_merchants):
+def compute_new_merchants_progress(dfs_new_merchants):
     team_progress_merchants = {}
     overall_collected = set()
 
@@ -138,22 +122,62 @@ def process_new_merchants_data(dfs_new_merchants):
         # Update overall collected merchants
         overall_collected.update(member_merchant_names)
 
-    # Calculate overall progress
-    collected_merchants = len(overall_collected)
-    st.write("## Overall Progress")
-    st.write(f"- **Total Merchants Collected:** {collected_merchants}")
-
     overall_collected_merchants_df = pd.DataFrame(columns=["Merchant Name"])
     overall_collected_merchants_df["Merchant Name"] = [merchant.title() for merchant in list(overall_collected)]
+    progress_df_merchants = pd.DataFrame(list(team_progress_merchants.items()),
+                                         columns=['Team Member', 'Collected Merchants'])
+    return overall_collected_merchants_df, progress_df_merchants
+
+
+# Cached stage for the collected merchants progress, keyed by the submission keys
+@st.cache_data(show_spinner=False, max_entries=STAGE_CACHE_MAX_ENTRIES)
+def load_new_merchants_progress(_dfs_new_merchants, submissions_key):
+    return compute_new_merchants_progress(_dfs_new_merchants)
+
+
+# Function to find the likely duplicates among the collected merchants and against the merchant table
+def compute_near_duplicate_merchants(dfs_new_merchants):
+    names = [name for member_name, member_filename, submission_date, member_df in dfs_new_merchants
+             if 'name' in member_df.columns for name in member_df['name'].dropna()]
+    try:
+        merchant_similarity_index = get_merchant_similarity_index()
+    except Exception as e:
+        # Without the database the collected merchants are still compared with each other
+        print(f"[compute_near_duplicate_merchants] Merchant table not available: {e}")
+        merchant_similarity_index = None
+    return find_near_duplicate_merchants(names, merchant_similarity_index)
+
+
+# Cached near-duplicate check of the collected merchants, keyed by the submission keys
+@st.cache_data(show_spinner=False, max_entries=STAGE_CACHE_MAX_ENTRIES)
+def load_near_duplicate_merchants(_dfs_new_merchants, submissions_key):
+    return compute_near_duplicate_merchants(_dfs_new_merchants)
+
+
+def process_new_merchants_data(dfs_new_merchants):
+    submissions_key = get_submissions_key(dfs_new_merchants)
+    overall_collected_merchants_df, progress_df_merchants = load_new_merchants_progress(dfs_new_merchants,
+                                                                                        submissions_key)
+    near_duplicate_merchants_df = load_near_duplicate_merchants(dfs_new_merchants, submissions_key)
+    render_new_merchants_progress(overall_collected_merchants_df, progress_df_merchants, near_duplicate_merchants_df)
+
+
+def render_new_merchants_progress(overall_collected_merchants_df, progress_df_merchants,
+                                  near_duplicate_merchants_df=None):
+    # Calculate overall progress
+    st.write("## Overall Progress")
+    st.write(f"- **Total Merchants Collected:** {len(overall_collected_merchants_df)}")
     st.dataframe(overall_collected_merchants_df)
 
     # Display individual progress
     st.write("## Individual Progress")
     st.write("### Merchants")
-    progress_df_merchants = pd.DataFrame(list(team_progress_merchants.items()),
-                                         columns=['Team Member', 'Collected Merchants'])
     st.dataframe(progress_df_merchants)
 
+    if near_duplicate_merchants_df is not None and len(near_duplicate_merchants_df):
+        st.write("### Possible Duplicate Merchants")
+        st.dataframe(near_duplicate_merchants_df, hide_index=True)
+
 
 # Function to find overlapping transaction descriptions between any two or more dataframes
 def find_overlapping_descriptions(dfs):
@@ -176,7 +200,7 @@ def find_overlapping_descriptions(dfs):
 
 
 # Main function to filter data and process files
-def process_filtered_data(filtered_data, cache):
+def process_filtered_data(filtered_data, ledger, notion_client=None):
     # Lists to store dataframes
     dfs_new_merchants = []
     dfs_reviewed_transactions = []
@@ -186,13 +210,17 @@ def process_filtered_data(filtered_data, cache):
         properties = item['properties']
         file_type = properties['Type']['select']['name']
         data_type = properties['Data Type']['select']['name']
+        page_id = item.get('id')
+        refresh_url = get_page_url_refresher(notion_client, page_id)
 
         if file_type == 'Submission':
             if data_type == 'Merchants':
-                get_dataframes_and_properties(properties, dfs_new_merchants, cache, 'Merchants')
+                get_dataframes_and_properties(properties, dfs_new_merchants, ledger, 'Merchants', refresh_url,
+                                              page_id)
             elif data_type == 'Reviewed Transactions':
-                get_dataframes_and_properties(properties, dfs_reviewed_transactions, cache, 'Reviewed Transactions')
+                get_dataframes_and_properties(properties, dfs_reviewed_transactions, ledger,
+                                              'Reviewed Transactions', refresh_url, page_id)
         elif file_type == 'Ngram-File' and data_type == 'Ngrams':
-            get_dataframes_and_properties(properties, dfs_ngrams, cache, 'Ngrams')
+            get_dataframes_and_properties(properties, dfs_ngrams, ledger, 'Ngrams', refresh_url, page_id)
 
     return dfs_new_merchants, dfs_reviewed_transactions, dfs_ngrams
@@ -0,0 +1,94 @@
+import io
+from datetime import datetime
+import pandas as pd
+from .merchant_index import connect_to_db
+from .tagged_cache import cache_with_tags, get_tagged_cache
+
+# Tag of the cached lookups, invalidated when the population workers validate new transactions
+VALIDATED_TRANSACTIONS_TAG = "validated_transactions"
+
+
+def find_validated_descriptions(descriptions, validated_before=None, connect=connect_to_db):
+    """ Find which descriptions already have a validated transaction, with a single join: the distinct descriptions
+    are copied into a temporary table and joined against the validated raw_descriptions
+    :param descriptions: iterable of descriptions
+    :param validated_before: datetime, only the transactions validated before it count if given
+    :param connect: function returning a new database connection
+    :return: set of the descriptions with a validated transaction
+    """
+    descriptions = pd.Series(list(descriptions), dtype=object).dropna().astype(str)
+    descriptions = descriptions[descriptions != ""].drop_duplicates()
+    if descriptions.empty:
+        return set()
+    buffer = io.StringIO()
+    descriptions.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE source_description (raw_description text) ON COMMIT DROP")
+            cur.copy_expert("COPY source_description (raw_description) FROM STDIN WITH (FORMAT csv)", buffer)
+            cur.execute("ANALYZE source_description")
+            cur.execute("""
+                SELECT s.raw_description FROM source_description s
+                WHERE EXISTS (
+                    SELECT 1 FROM transaction t WHERE t.raw_description = s.raw_description AND t.validated = True
+                    AND (%(validated_before)s IS NULL OR t.validation_date < %(validated_before)s)
+                )
+            """, {"validated_before": validated_before})
+            rows = cur.fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+    return {raw_description for raw_description, in rows}
+
+
+# Function to get when a source was registered, as the local time the population workers write validation dates in
+def get_source_registered_at(source_page):
+    created_time = (source_page or {}).get("created_time")
+    if not created_time:
+        return None
+    return datetime.fromisoformat(created_time.replace("Z", "+00:00")).astimezone().replace(tzinfo=None)
+
+
+# Cached pre-review pass of a source file, keyed by (source title, source filename) and its registration time
+@cache_with_tags(lambda _source_df, source_key, registered_at: {VALIDATED_TRANSACTIONS_TAG, f"source:{source_key[0]}"})
+def compute_validated_descriptions(_source_df, source_key, registered_at):
+    print("[compute_validated_descriptions] computing: ", source_key)
+    return frozenset(find_validated_descriptions(_source_df["description"].unique(), validated_before=registered_at))
+
+
+def load_validated_descriptions(source_df, source_key, source_page):
+    """ Get the descriptions of a source file validated before the source was registered. The transactions the team
+    reviewed and populated since are left out, so they stay credited to the members.
+    :param source_df: dataframe with a "description" column
+    :param source_key: (source title, source filename)
+    :param source_page: Notion page of the source
+    :return: frozenset of descriptions, empty without a registration time or a database (errors aren't cached)
+    """
+    registered_at = get_source_registered_at(source_page)
+    if registered_at is None:
+        return frozenset()
+    try:
+        return compute_validated_descriptions(source_df, source_key, registered_at)
+    except Exception as e:
+        print(f"[load_validated_descriptions] Error: {e}")
+        return frozenset()
+
+
+# Function to drop the cached pre-review passes, once new transactions were validated
+def invalidate_validated_descriptions():
+    get_tagged_cache().invalidate(VALIDATED_TRANSACTIONS_TAG)
+
+
+# Function to get the source rows left to review, without the already validated descriptions
+def get_transactions_to_review(source_df, validated_descriptions):
+    return source_df[~source_df["description"].isin(validated_descriptions)]
+
+
+# CSV of the rows left to review, cached since the download is rendered on every rerun
+@cache_with_tags(lambda _source_df, _validated_descriptions, source_key, validated_key: {
+    VALIDATED_TRANSACTIONS_TAG, f"source:{source_key[0]}"})
+def get_transactions_to_review_csv(_source_df, _validated_descriptions, source_key, validated_key):
+    return get_transactions_to_review(_source_df, _validated_descriptions).to_csv(index=False)
@@ -1,16 +1,29 @@
+import os
 import threading
 import time
 import streamlit as st
-import pandas as pd
-from pprint import pprint
 from notion_client import Client
 from Dashboard.dashboard_visualization import DashboardVisualization
 from Dashboard.data_validation import FileValidator
-from Dashboard.transaction_population import TxnPopulationManager
-from Dashboard.utils import read_file_from_url, get_dataframes_and_properties, read_and_display_source_file, \
-    process_new_merchants_data, find_overlapping_descriptions, process_filtered_data, load_cache
+from Dashboard.utils import read_and_display_source_file, process_new_merchants_data, process_filtered_data, \
+    render_new_merchants_progress, get_page_url_refresher, get_file_version
+from Dashboard.ledger import get_ledger
+from Dashboard.report import load_report_snapshot, is_report_snapshot_current, run_reports_nightly
+from Dashboard.coverage_snapshots import load_coverage_trend, run_coverage_snapshots_nightly
+from Dashboard.metrics_api import start_metrics_api
+from Dashboard.overview import load_sources_overview
+from Dashboard.page_catalog import get_pages_key
+from Dashboard.ngram_coverage import load_ngram_coverage
+from Dashboard.progress import load_team_progress, get_submissions_key
+from Dashboard.validated_transactions import load_validated_descriptions, get_transactions_to_review_csv
 from Dashboard.dashboard_generator import DashboardGenerator
 from Dashboard.controller import DataManager
+from Dashboard.tagged_cache import get_tagged_cache
+from Dashboard.dataframe_store import get_dataframe_store
+from Dashboard.file_reader import download_stats
+
+# Streamlit page configuration
+st.set_page_config(page_title="Data Hub Team Progress", layout="wide")
 
 # Read secrets
 notion_token = st.secrets["NOTION_TOKEN"]
@@ -26,35 +39,54 @@ dashboard_generator = DashboardGenerator()
 data_manager = DataManager()
 
 # Initialize the Notion client
-notion_client = Client(auth=notion_token)
+@st.cache_resource
+def get_notion_client():
+    return Client(auth=notion_token)
 
-# Initialize the Data Validator
-validator = FileValidator(notion_client=notion_client, database_id=database_id)
 
-# Initialize the txn population manager
-txn_population_manager = TxnPopulationManager(notion_client=notion_client, database_id=database_id)
+notion_client = get_notion_client()
 
-# Start the polling in a separate thread
-threading.Thread(target=validator.poll_notion_database_and_validate, daemon=True).start()
 
 # Function to run the population pipeline periodically
-def run_population_periodically():
+def run_population_periodically(txn_population_manager):
     while True:
         txn_population_manager.run_population_pipeline()
         time.sleep(60 * 60 * 2)  # Sleep for 2 hours
 
-# Start the periodic population thread
-periodic_thread = threading.Thread(target=run_population_periodically)
-periodic_thread.daemon = True
-periodic_thread.start()
 
+# Start the background workers once per process instead of on every script rerun
+@st.cache_resource
+def start_background_workers():
+    # Initialize the Data Validator
+    validator = FileValidator(notion_client=notion_client, database_id=database_id)
 
-# Start the polling in a separate thread
-# threading.Thread(target=txn_population_manager.run_population_pipeline, daemon=True).start()
+    # Initialize the txn population manager (imported here, since it connects to Postgres when imported)
+    from Dashboard.transaction_population import TxnPopulationManager
+    txn_population_manager = TxnPopulationManager(notion_client=notion_client, database_id=database_id)
 
+    # Start the polling in a separate thread
+    validation_thread = threading.Thread(target=validator.poll_notion_database_and_validate, daemon=True)
+    validation_thread.start()
+
+    # Start the periodic population thread
+    periodic_thread = threading.Thread(target=run_population_periodically, args=(txn_population_manager,))
+    periodic_thread.daemon = True
+    periodic_thread.start()
+
+    # Start the nightly report pre-warming thread
+    threading.Thread(target=run_reports_nightly, args=(notion_client, database_id), daemon=True).start()
+
+    # Start the nightly coverage snapshots thread
+    threading.Thread(target=run_coverage_snapshots_nightly, args=(notion_client, database_id), daemon=True).start()
+
+    # Serve the precomputed results to other teams over HTTP
+    start_metrics_api()
+    return validator, txn_population_manager
 
-# Streamlit page configuration
-st.set_page_config(page_title="Data Hub Team Progress", layout="wide")
+
+# The background workers can be left to dedicated processes, or turned off (e.g. for load tests)
+if os.getenv("DASHBOARD_BACKGROUND_WORKERS", "1") != "0":
+    validator, txn_population_manager = start_background_workers()
 
 # Fetch and process data from the "Data Hub Progress" Notion Database
 data = data_manager.get_notion_data(notion_client, database_id)
@@ -65,239 +97,183 @@ source_title, source_file_url, source_filename = source_file_selection
 # Filter data based on source title
 data_in_scope = data_manager.get_data_in_scope(data, source_title)
 
-# Initialize or load the processed files cache
-if 'processed_files_cache' not in st.session_state:
-    st.session_state.processed_files_cache = load_cache()
-processed_files_cache = st.session_state.processed_files_cache
-
-# Filter data based on date range and also get all Ngrams, Merchants, and Reviewed Transactions files
-filtered_data = data_manager.filter_data_by_datae_range(data, start_date=start_date, end_date=end_date,
-                                                        source_title=source_title)
-
-# Process the fetched data to extract file URLs and read them into DataFrames
-dfs_new_merchants, dfs_reviewed_transactions, dfs_ngrams = process_filtered_data(filtered_data, processed_files_cache)
-
-# Process the source file
-if source_file_url:
+# Renders the member scatter plots; changing the selected member only reruns this fragment
+@st.experimental_fragment
+def render_member_progress(df_ngrams, df_merchants):
+    # Filter data for a specific team member if needed
+    selected_member = st.selectbox("Select Team Member:", df_ngrams["Team Member"].unique())
+    filtered_df_ngrams = df_ngrams[df_ngrams["Team Member"] == selected_member]
+    filtered_df_merchants = df_merchants[df_merchants["Team Member"] == selected_member]
+
+    filtered_df_ngrams = filtered_df_ngrams.sort_values("Date", ascending=True)
+
+    # Plot for reviewed ngrams transactions
+    fig_ngrams = visualizer.plot_reviewed_txns_scatter_plot(filtered_df_ngrams, selected_member)
+
+    # Plot for merchants
+    fig_merchants = visualizer.plot_merchants_scatter_plot(filtered_df_merchants, selected_member)
+
+    # Show the plots in Streamlit
+    st.plotly_chart(fig_ngrams)
+    st.plotly_chart(fig_merchants)
+
+
+# Renders the overall and per-member progress from the precomputed team progress results
+def render_team_progress(team_progress):
+    total_transactions_count = team_progress["total_transactions_count"]
+    overall_reviewed_transactions_count = team_progress["overall_reviewed_transactions_count"]
+    overall_reviewed_transactions_progress = team_progress["overall_reviewed_transactions_progress"]
+    progress_df_transactions = team_progress["progress_df_transactions"]
+
+    st.write("## Overall Reviewed Transactions Progress")
+    st.write(
+        f"- **Total Reviewed Transactions:** {overall_reviewed_transactions_count} out of {total_transactions_count}")
+    st.write(f"- **Overall Coverage:** {overall_reviewed_transactions_progress:.2f}%")
+    if team_progress.get("prevalidated_transactions_count"):
+        st.write(f"- **Already Validated Before Review:** {team_progress['prevalidated_transactions_count']}")
+
+    st.write("### Reviewed Transactions")
+    st.dataframe(progress_df_transactions)
+
+    st.write("### Reviewed Ngrams")
+    st.dataframe(team_progress["progress_df_ngrams"])
+
+    # Plotting the progress on Pie Chart
+    st.write("## Progress Charts")
+    fig = visualizer.plot_detailed_pie_chart(progress_df_transactions, total_txn_count=total_transactions_count)
+    st.plotly_chart(fig)
+
+    # Streamlit app
+    st.title("Team Progress Ngram Transactions and Merchants")
+    render_member_progress(team_progress["df_ngrams"], team_progress["df_merchants"])
+
+
+# Renders the progress of every source side by side
+def render_sources_overview(overview_df):
+    st.write("## All Sources Overview")
+    st.dataframe(overview_df, hide_index=True)
+    st.plotly_chart(visualizer.plot_sources_coverage_bar_chart(overview_df[overview_df["Error"].isna()]))
+
+
+# Renders which submitted ngrams cover which source transactions
+def render_ngram_coverage(ngram_coverage):
+    st.write("## Ngram Coverage")
+    st.write(f"- **Transactions Covered by Ngrams:** {ngram_coverage['covered_transactions_count']} out of "
+             f"{ngram_coverage['total_transactions_count']} ({ngram_coverage['coverage']:.2f}%)")
+    if ngram_coverage.get("prevalidated_transactions_count"):
+        st.write(f"- **Of Which Already Validated Before Review:** {ngram_coverage['prevalidated_transactions_count']}")
+    st.write("### Ngram Hits")
+    st.dataframe(ngram_coverage["ngram_hits_df"], hide_index=True)
+    st.write("### Ngrams Submitted by More Than One Member")
+    st.dataframe(ngram_coverage["overlapping_ngrams_df"], hide_index=True)
+    st.write("### Uncovered Transactions")
+    st.dataframe(ngram_coverage["uncovered_df"].head(1000), hide_index=True)
+
+
+# Renders the source rows left to the reviewers once the already validated transactions are excluded
+def render_transactions_to_review(source_df, validated_descriptions):
+    prevalidated_transactions_count = int(source_df["description"].isin(validated_descriptions).sum())
+    st.write("## Transactions To Review")
+    st.write(f"- **Already Validated Transactions:** {prevalidated_transactions_count} out of {len(source_df)} "
+             f"(covered without review)")
+    st.download_button("Download transactions to review",
+                       get_transactions_to_review_csv(source_df, validated_descriptions,
+                                                      (source_title, source_filename), hash(validated_descriptions)),
+                       file_name=f"to_review_{os.path.splitext(source_filename)[0]}.csv", mime="text/csv")
+
+
+# Renders the daily cumulative coverage of the source, recorded by the nightly snapshot job
+def render_coverage_trend(trend_df):
+    st.write("## Coverage Trend")
+    st.plotly_chart(visualizer.plot_coverage_trend(trend_df, source_title))
+
+
+# Load the precomputed report snapshot for this source and date range, if the nightly job generated one
+use_snapshot = st.sidebar.checkbox("Load precomputed report", value=True)
+snapshot = load_report_snapshot(source_title, start_date, end_date) if use_snapshot else None
+# Pages edited since the snapshot was generated (new submissions, validations) are computed live instead
+if snapshot is not None and not is_report_snapshot_current(snapshot, data_in_scope):
+    st.sidebar.caption("The precomputed report is older than the latest submission, computing it live.")
+    snapshot = None
+
+# The overview mode computes every source in parallel instead of the selected one
+sources_overview = st.sidebar.checkbox("All sources overview", value=False)
+
+# Statistics of the process-wide caches shared by every session
+with st.sidebar.expander("Cache statistics"):
+    st.write("Notion queries and computed results", get_tagged_cache().stats)
+    st.write("Source and submission files", get_dataframe_store().stats)
+    st.write("File downloads", dict(download_stats))
+
+if sources_overview:
+    render_sources_overview(load_sources_overview(data, get_pages_key(data), start_date, end_date))
+elif snapshot is not None:
+    st.caption(f"Precomputed report generated at {snapshot['generated_at']}")
+    st.info("The source preview, transactions to review and ngram coverage aren't part of the precomputed report, "
+            "uncheck \"Load precomputed report\" to see them.")
+    if "collected_merchants_df" in snapshot:
+        render_new_merchants_progress(snapshot["collected_merchants_df"], snapshot["progress_df_merchants"],
+                                      snapshot.get("near_duplicate_merchants_df"))
+    if "progress_df_transactions" in snapshot:
+        render_team_progress(snapshot)
+    else:
+        st.write("No submitted files found.")
+elif source_file_url:
+    # The processed files ledger is shared by every session of this process
+    processed_files_ledger = get_ledger()
+
+    # Filter data based on date range and also get all Ngrams, Merchants, and Reviewed Transactions files
+    filtered_data = data_manager.filter_data_by_datae_range(data, start_date=start_date, end_date=end_date,
+                                                            source_title=source_title)
+
+    # Process the fetched data to extract file URLs and read them into DataFrames
+    # Expired signed file URLs are re-signed by fetching their page again
+    dfs_new_merchants, dfs_reviewed_transactions, dfs_ngrams = process_filtered_data(filtered_data,
+                                                                                     processed_files_ledger,
+                                                                                     notion_client)
+
+    # Process the source file
     try:
-        source_df = read_and_display_source_file(source_file_url, source_title, source_filename)
-        source_transactions = source_df["description"].values.tolist()
+        source_record = next((record for record in data_manager.get_catalog(data).by_title(source_title)
+                              if record.type == 'Source'), None)
+        source_page_id = source_record.page_id if source_record else None
+        source_df = read_and_display_source_file(source_file_url, source_title, source_filename,
+                                                 refresh_url=get_page_url_refresher(notion_client, source_page_id),
+                                                 source_version=source_record.last_edited_time if source_record
+                                                 else None)
 
         if dfs_new_merchants:
             process_new_merchants_data(dfs_new_merchants)
 
-        if dfs_reviewed_transactions:
-            team_progress_transactions = {}
-            overall_reviewed_transactions = []
-            team_progress_ngrams = {}
-            overall_reviewed_ngrams = []
-            team_progress_ngram_transactions = {}
-
-            # This is a list of dataframes for reviewed transactions used to check for overlap in reviews
-            overall_reviewed_ngram_transactions_dfs = [member_df for
-                                                       member_name, member_filename, submission_date, member_df in
-                                                       dfs_reviewed_transactions]
-            unique_overlapped_reviewed_transactions = find_overlapping_descriptions(
-                dfs=overall_reviewed_ngram_transactions_dfs)
-            overlapped_reviewed_transactions = source_df[
-                source_df["description"].isin(unique_overlapped_reviewed_transactions)]["description"].values.tolist()
-            overlapped_reviewed_transactions_count = len(overlapped_reviewed_transactions)
-
-            for member_name, member_filename, submission_date, member_df in dfs_reviewed_transactions:
-                member_df["overlapping_txn"] = 0
-                overlapping_txn_idx = member_df[member_df['description'].isin(overlapped_reviewed_transactions)].index
-                member_df.loc[overlapping_txn_idx, "overlapping_txn"] = 1
-                # member_df = member_df[~member_df['description'].isin(overlapped_reviewed_transactions)].reset_index(
-                #     drop=True)
-                member_reviewed_transactions = member_df[member_df["overlapping_txn"] == 0][
-                    'description'].values.tolist()
-                # Member Valid Ngrams
-                merchant_id_col = "merchant_id"
-                if merchant_id_col not in member_df:
-                    merchant_id_col = "merchant_Id"
-                if merchant_id_col not in member_df:
-                    merchant_id_col = "Merchant ID"
-
-                ngram_col = "key"
-                if ngram_col not in member_df.columns.tolist():
-                    if "extracted_merchant_for_review" in member_df.columns.tolist():
-                        ngram_col = "extracted_merchant_for_review"
-                    elif "merchant_for_review" in member_df.columns.tolist():
-                        ngram_col = "merchant_for_review"
-                # print(member_df.columns.tolist())
-                # print("[ngram_col] ", ngram_col)
-                invalid_ngram_query = (
-                        (member_df[merchant_id_col].isin([0, "0", "?"])) |
-                        (member_df[merchant_id_col].isna())
-                )
-                # Member Valid Ngrams
-                member_valid_ngrams = member_df[~invalid_ngram_query][ngram_col].unique().tolist()
-
-                # Member Invalid Ngrams
-                member_invalid_ngrams = member_df[invalid_ngram_query][ngram_col].unique().tolist()
-
-                # Valid Ngrams Transactions and Coverage
-                member_valid_ngrams_transactions = member_df[~invalid_ngram_query]["description"]
-                member_valid_ngrams_transactions_coverage = len(member_valid_ngrams_transactions) / len(member_df)
-
-                # Invalid Ngrams Transactions and Coverage
-                member_invalid_ngrams_transactions = member_df[invalid_ngram_query]["description"]
-                member_invalid_ngrams_transactions_coverage = len(member_invalid_ngrams_transactions) / len(member_df)
-
-                # Number of merchants
-                number_of_merchants = member_df[~invalid_ngram_query][ngram_col].nunique()
-
-                # Number of new merchants
-                number_of_new_merchants = member_df[
-                    (~member_df[merchant_id_col].isna()) &
-                    (member_df[merchant_id_col].astype(str).str.startswith("n-"))
-                    ][ngram_col].nunique()
-
-                # Initialize the nested dictionary structure if it does not exist
-                if member_name not in team_progress_ngram_transactions:
-                    team_progress_ngram_transactions[member_name] = {}
-
-                if submission_date not in team_progress_ngram_transactions[member_name]:
-                    team_progress_ngram_transactions[member_name][submission_date] = {}
-
-                # Store the calculated metrics
-                team_progress_ngram_transactions[member_name][submission_date][member_filename] = {
-                    "valid_ngrams_transactions": len(member_valid_ngrams_transactions),
-                    "invalid_ngrams_transactions": len(member_invalid_ngrams_transactions),
-                    "valid_ngrams_transactions_coverage": member_valid_ngrams_transactions_coverage,
-                    "invalid_ngrams_transactions_coverage": member_invalid_ngrams_transactions_coverage,
-                    "number_of_merchants": number_of_merchants,
-                    "number_of_new_merchants": number_of_new_merchants
-                }
-                print("[team_progress_ngram_transactions]")
-                pprint(team_progress_ngram_transactions)
-
-                # Calculate individual progress
-                # reviewed_transactions_count = len(member_reviewed_transactions)
-                reviewed_transactions_count = len(
-                    source_df[source_df["description"].isin(member_reviewed_transactions)])
-                if member_name not in team_progress_transactions:
-                    team_progress_transactions[member_name] = reviewed_transactions_count
-                else:
-                    team_progress_transactions[member_name] += reviewed_transactions_count
-
-                if member_name not in team_progress_ngrams:
-                    team_progress_ngrams[member_name] = {
-                        "valid_ngrams": len(member_valid_ngrams),
-                        "invalid_ngrams": len(member_invalid_ngrams)
-                    }
-                else:
-                    team_progress_ngrams[member_name]["valid_ngrams"] += len(member_valid_ngrams)
-                    team_progress_ngrams[member_name]["invalid_ngrams"] += len(member_invalid_ngrams)
-
-                # Update overall reviewed transactions
-                overall_reviewed_transactions += member_reviewed_transactions
-                overall_reviewed_ngrams += member_valid_ngrams
-                overall_reviewed_ngrams += member_invalid_ngrams
-
-            # Update overall reviewed transactions by adding the overlapped transactions if any
-            overall_reviewed_transactions += overlapped_reviewed_transactions
-
-            # Calculate overall progress
-            total_transactions_count = len(source_transactions)
-            # overall_reviewed_transactions_count = len(overall_reviewed_transactions)
-            overall_reviewed_transactions_count = len(
-                source_df[source_df["description"].isin(overall_reviewed_transactions)])
-            overall_reviewed_transactions_progress = (
-                                                             overall_reviewed_transactions_count / total_transactions_count
-                                                     ) * 100
-
-            st.write("## Overall Reviewed Transactions Progress")
-            st.write(
-                f"- **Total Reviewed Transactions:** {overall_reviewed_transactions_count} out of {total_transactions_count}")
-            st.write(f"- **Overall Coverage:** {overall_reviewed_transactions_progress:.2f}%")
-
-            st.write("### Reviewed Transactions")
-            progress_df_transactions = pd.DataFrame(list(team_progress_transactions.items()),
-                                                    columns=['Team Member', 'Reviewed Transactions'])
-            if overlapped_reviewed_transactions:
-                progress_df_transactions.loc[-1, "Team Member"] = "Overlapped Reviewed Transactions"
-                progress_df_transactions.loc[-1, "Reviewed Transactions"] = overlapped_reviewed_transactions_count
-
-            progress_df_transactions['Coverage (%)'] = (progress_df_transactions[
-                                                            'Reviewed Transactions'] / total_transactions_count) * 100
-            st.dataframe(progress_df_transactions)
-
-            st.write("### Reviewed Ngrams")
-            # Transform the dictionary into a list of tuples
-            data = [(member, info['valid_ngrams'], info['invalid_ngrams']) for member, info in
-                    team_progress_ngrams.items()]
-
-            # Create Ngram progress DataFrame
-            progress_df_ngrams = pd.DataFrame(data, columns=['Team Member', 'Valid Ngrams', 'Invalid Ngrams'])
-            progress_df_ngrams["Total Ngrams"] = progress_df_ngrams["Valid Ngrams"] + progress_df_ngrams[
-                "Invalid Ngrams"]
-            st.dataframe(progress_df_ngrams)
-
-            # Plotting the progress on Pie Chart
-            st.write("## Progress Charts")
-            fig = visualizer.plot_detailed_pie_chart(progress_df_transactions, total_txn_count=total_transactions_count)
-            st.plotly_chart(fig)
-
-            # Flatten the nested dictionary into two separate lists for two DataFrames
-            data_ngrams = []
-            data_merchants = []
-
-            for member_name, dates in team_progress_ngram_transactions.items():
-                for date, files in dates.items():
-                    for filename, metrics in files.items():
-                        # Data for ngrams transactions
-                        data_ngrams.append({
-                            "Team Member": member_name,
-                            "Date": date,
-                            "File": filename,
-                            "valid_ngrams_transactions": metrics["valid_ngrams_transactions"],
-                            "invalid_ngrams_transactions": metrics["invalid_ngrams_transactions"],
-                            "valid_ngrams_transactions_coverage": metrics["valid_ngrams_transactions_coverage"],
-                            "invalid_ngrams_transactions_coverage": metrics["invalid_ngrams_transactions_coverage"]
-                        })
-                        # Data for merchants
-                        data_merchants.append({
-                            "Team Member": member_name,
-                            "Date": date,
-                            "File": filename,
-                            "number_of_merchants": metrics["number_of_merchants"],
-                            "number_of_new_merchants": metrics["number_of_new_merchants"]
-                        })
-
-            # Create DataFrames
-            df_ngrams = pd.DataFrame(data_ngrams)
-            df_merchants = pd.DataFrame(data_merchants)
-
-            # Convert the Date columns to datetime type
-            df_ngrams['Date'] = pd.to_datetime(df_ngrams['Date'])
-            df_merchants['Date'] = pd.to_datetime(df_merchants['Date'])
-
-            # Streamlit app
-            st.title("Team Progress Ngram Transactions and Merchants")
-
-            # Filter data for a specific team member if needed
-            selected_member = st.selectbox("Select Team Member:", df_ngrams["Team Member"].unique())
-            filtered_df_ngrams = df_ngrams[df_ngrams["Team Member"] == selected_member]
-            filtered_df_merchants = df_merchants[df_merchants["Team Member"] == selected_member]
-            # print("[filtered_df_ngrams] \n")
-            # print(filtered_df_ngrams)
-
-            filtered_df_ngrams = filtered_df_ngrams.sort_values("Date", ascending=True)
-
-            # Plot for reviewed ngrams transactions
-            fig_ngrams = visualizer.plot_reviewed_txns_scatter_plot(filtered_df_ngrams, selected_member)
-
-            # Plot for merchants
-            fig_merchants = visualizer.plot_merchants_scatter_plot(filtered_df_merchants, selected_member)
-
-            # Show the plots in Streamlit
-            st.plotly_chart(fig_ngrams)
-            st.plotly_chart(fig_merchants)
+        # Descriptions already validated in the database are covered before any review
+        validated_descriptions = load_validated_descriptions(source_df, (source_title, source_filename),
+                                                             source_record.page if source_record else None)
+        render_transactions_to_review(source_df, validated_descriptions)
 
+        if dfs_reviewed_transactions:
+            team_progress = load_team_progress(source_df, dfs_reviewed_transactions,
+                                               source_key=(source_title, source_filename),
+                                               submissions_key=get_submissions_key(dfs_reviewed_transactions),
+                                               _validated_descriptions=validated_descriptions,
+                                               validated_key=hash(validated_descriptions),
+                                               source_version=get_file_version(source_df))
+            render_team_progress(team_progress)
         else:
             st.write("No submitted files found.")
+
+        if dfs_ngrams:
+            ngram_coverage = load_ngram_coverage(source_df, dfs_ngrams, source_key=(source_title, source_filename),
+                                                 ngram_files_key=get_submissions_key(dfs_ngrams),
+                                                 _validated_descriptions=validated_descriptions,
+                                                 validated_key=hash(validated_descriptions),
+                                                 source_version=get_file_version(source_df))
+            render_ngram_coverage(ngram_coverage)
     except ValueError as e:
         st.error(f"Error reading source file: {e}")
 else:
     st.write("Source file not found.")
+
+# The trend covers the whole history of the source, not only the selected date range
+coverage_trend = load_coverage_trend(source_title) if not sources_overview else None
+if coverage_trend is not None:
+    render_coverage_trend(coverage_trend)